@@ -0,0 +1,154 @@
+# coding: utf-8
+"""
+Per-cell cost of add_fields with the precomputed handler table against the
+legacy normalize() if/elif chain it replaced.
+
+    python benchmarks/bench_add_fields.py --columns 300 --rows 200
+"""
+import argparse
+import io
+import os
+import sys
+import timeit
+from contextlib import contextmanager
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from csv_template_ingester.template_csv_parser import *
+
+KEYWORD_MIX = ['PROPERTY: Property {} (MPa)', 'CONDITION: Condition {} (K)', 'METHOD', 'DATA TYPE',
+               'IDENTIFIER: ID {}', 'CLASSIFICATION: Class {}', 'PREPARATION STEP NAME',
+               'PREPARATION STEP DETAIL: Detail {} (s)', 'REFERENCE: doi', 'ACTUAL QUANTITY (mass %)']
+
+
+def legacy_add_fields(keywords, names, units, systs, sys_dict, row):
+    """
+    The add_fields implementation before the handler table, kept as the benchmark baseline
+    """
+
+    for s in set(systs):
+        sys_dict[s] = ChemicalSystem()
+
+    all_condition = []
+
+    for j, cell in enumerate(row):
+        cell = decode_string(cell)
+
+        if is_list(cell):
+            cell = create_list(cell)
+
+        systm = sys_dict[systs[j]]
+
+        if 'formula' == normalize(keywords[j]):
+            add_formula(systm, cell)
+        elif 'uid' == normalize(keywords[j]):
+            add_uid(systm, cell)
+        elif 'name' == normalize(keywords[j]):
+            add_name(systm, cell)
+        elif 'contact' == normalize(keywords[j]):
+            add_contacts(systm, cell, names, j)
+        elif 'file' == normalize(keywords[j]):
+            add_newfile(systm, cell, names, j)
+        elif 'identifier' == normalize(keywords[j]):
+            add_identifier(systm, cell, names, j)
+        elif 'classification' == normalize(keywords[j]):
+            add_classification(systm, cell, names, j)
+        elif 'property' == normalize(keywords[j]):
+            add_property(systm, cell, names, units, j)
+        elif 'condition' == normalize(keywords[j]):
+            add_condition(systm, cell, names, units, j)
+        elif 'allcondition' == normalize(keywords[j]):
+            add_all_condition(all_condition, cell, names, units, j)
+        elif 'method' == normalize(keywords[j]):
+            add_method(systm, cell)
+        elif 'figurenumber' == normalize(keywords[j]):
+            add_number(systm, cell, 'figure')
+        elif 'figurecaption' == normalize(keywords[j]):
+            add_caption(systm, cell, 'figure')
+        elif 'tablenumber' == normalize(keywords[j]):
+            add_number(systm, cell, 'table')
+        elif 'tablecaption' == normalize(keywords[j]):
+            add_caption(systm, cell, 'table')
+        elif 'datatype' == normalize(keywords[j]):
+            add_datatype(systm, cell)
+        elif 'preparationstepname' == normalize(keywords[j]) or 'processstepname' == normalize(keywords[j]):
+            add_preparation_step(systm, cell)
+        elif 'preparationstepdetail' == normalize(keywords[j]) or 'processstepdetail' == normalize(keywords[j]):
+            add_preparation_step_detail(systm, cell, names, units, j)
+        elif 'reference' == normalize(keywords[j]):
+            add_reference(systm, cell, names, j)
+        elif 'idealcomposition' == normalize(keywords[j]):
+            add_ideal_composition(systm, cell, names, units, j)
+        elif 'composition' == normalize(keywords[j]):
+            add_ideal_composition(systm, cell, names, units, j)
+        elif 'actualcomposition' == normalize(keywords[j]):
+            add_actual_composition(systm, cell, names, units, j)
+        elif 'idealquantity' == normalize(keywords[j]):
+            add_ideal_quantity(systm, cell, units, j)
+        elif 'actualquantity' == normalize(keywords[j]):
+            add_actual_quantity(systm, cell, units, j)
+
+    return sys_dict, all_condition
+
+
+def generate_table(columns):
+    """
+    Builds a header row and a data row cycling through KEYWORD_MIX
+    """
+
+    headers = ['NAME']
+    row = ['Sample']
+    for i in range(columns - 1):
+        header = KEYWORD_MIX[i % len(KEYWORD_MIX)].format(i)
+        headers.append(header)
+        if header.startswith('ACTUAL QUANTITY'):
+            row.append('5')
+        elif header.startswith(('METHOD', 'DATA TYPE', 'PREPARATION STEP NAME', 'REFERENCE')):
+            row.append('text {}'.format(i))
+        else:
+            row.append(str(i))
+
+    return headers, row
+
+
+@contextmanager
+def quiet():
+    stdout = sys.stdout
+    sys.stdout = io.StringIO() if sys.version_info[0] > 2 else io.BytesIO()
+    try:
+        yield
+    finally:
+        sys.stdout = stdout
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('-c', '--columns', type=int, default=300, help='Number of columns per row')
+    parser.add_argument('-r', '--rows', type=int, default=200, help='Number of rows converted per timing run')
+    parser.add_argument('--repeat', type=int, default=5, help='Number of timing runs, the best is reported')
+    args = parser.parse_args()
+
+    headers, row = generate_table(args.columns)
+    plan = compile_header_plan(headers)
+    cells = args.rows * len(row)
+
+    def run_legacy():
+        for _ in range(args.rows):
+            legacy_add_fields(plan.keywords, plan.names, plan.units, plan.systs, {}, row)
+
+    def run_table():
+        for _ in range(args.rows):
+            add_fields(plan.keywords, plan.names, plan.units, plan.systs, {}, row, plan.handlers)
+
+    with quiet():
+        legacy = min(timeit.repeat(run_legacy, number=1, repeat=args.repeat))
+        table = min(timeit.repeat(run_table, number=1, repeat=args.repeat))
+
+    print('{} rows x {} columns'.format(args.rows, len(row)))
+    print('if/elif chain:  {:.3f} us/cell'.format(legacy / cells * 1e6))
+    print('handler table:  {:.3f} us/cell'.format(table / cells * 1e6))
+    print('speedup:        {:.2f}x'.format(legacy / table))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,86 @@
+# coding: utf-8
+"""
+Time of convert_batches against convert() on a generated file, for
+ChemicalSystem and dictionary output. convert_batches validates the
+ranges of a block at once and writes its numeric columns with handlers
+made for each column, copying the name and units shared by the column
+instead of building them cell by cell. Dictionary output has no such
+construction to save, so there the block costs the range validation that
+runs before any PIF of the block is yielded.
+
+    python benchmarks/bench_batches.py --rows 5000 --columns 30 --mix property
+"""
+import argparse
+import io
+import os
+import shutil
+import sys
+import tempfile
+import timeit
+from contextlib import contextmanager
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.join(ROOT, 'test_files'))
+
+from csv_template_ingester.batches import convert_batches, BATCH_ROWS
+from csv_template_ingester.converter import convert
+from generate_test_csv import KEYWORD_MIXES, write_test_csv
+
+
+@contextmanager
+def quiet():
+    stdout = sys.stdout
+    sys.stdout = io.StringIO() if sys.version_info[0] > 2 else io.BytesIO()
+    try:
+        yield
+    finally:
+        sys.stdout = stdout
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('-r', '--rows', type=int, default=5000, help='Data rows of the generated file')
+    parser.add_argument('-c', '--columns', type=int, default=30, help='Columns of the generated file, after NAME')
+    parser.add_argument('-m', '--mix', choices=KEYWORD_MIXES, default='property', help='Keyword mix of the columns')
+    parser.add_argument('-b', '--batch-rows', type=int, default=BATCH_ROWS, help='Rows per block')
+    parser.add_argument('--repeat', type=int, default=3, help='Number of timing runs, the best is reported')
+    args = parser.parse_args()
+
+    directory = tempfile.mkdtemp(prefix='bench-batches-')
+    try:
+        path = os.path.join(directory, 'batches.csv')
+        write_test_csv(path, args.rows, args.columns, args.mix)
+
+        def run_convert(output):
+            for _ in convert([path], output=output):
+                pass
+
+        def run_batches(output, typed_scalars=False):
+            for _ in convert_batches([path], args.batch_rows, typed_scalars, output=output):
+                pass
+
+        cases = [
+            ('convert() pif', lambda: run_convert('pif')),
+            ('batches pif', lambda: run_batches('pif')),
+            ('batches pif typed', lambda: run_batches('pif', True)),
+            ('convert() dict', lambda: run_convert('dict')),
+            ('batches dict', lambda: run_batches('dict')),
+        ]
+
+        times = {}
+        with quiet():
+            for name, run in cases:
+                times[name] = min(timeit.repeat(run, number=1, repeat=args.repeat))
+    finally:
+        shutil.rmtree(directory, ignore_errors=True)
+
+    print('{} rows x {} columns ({}), {} rows per block'.format(args.rows, args.columns + 1, args.mix,
+                                                                  args.batch_rows))
+    for name, run in cases:
+        baseline = times['convert() dict' if name.endswith('dict') else 'convert() pif']
+        print('{:<20} {:>8.3f} s {:>8.2f}x'.format(name, times[name], baseline / times[name]))
+
+
+if __name__ == '__main__':
+    main()
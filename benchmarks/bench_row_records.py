@@ -0,0 +1,84 @@
+# coding: utf-8
+"""
+Allocations per row and peak memory of convert() yielding ChemicalSystems
+(output='pif') against RowRecords (output='record') for a generated
+NAME + PROPERTY file, holding every converted row in memory.
+
+    python benchmarks/bench_row_records.py --rows 2000 --columns 50
+"""
+import argparse
+import csv
+import io
+import os
+import shutil
+import sys
+import tempfile
+import time
+import tracemalloc
+from contextlib import contextmanager
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.join(ROOT, 'test_files'))
+
+from csv_template_ingester.converter import convert
+from generate_test_csv import generate_csv, generate_headers
+
+
+@contextmanager
+def quiet():
+    stdout = sys.stdout
+    sys.stdout = io.StringIO()
+    try:
+        yield
+    finally:
+        sys.stdout = stdout
+
+
+def write_test_file(path, rows, columns):
+    with open(path, 'w') as output_file:
+        writer = csv.writer(output_file)
+        writer.writerow(generate_headers(columns))
+        for row in generate_csv(rows, columns):
+            writer.writerow(row)
+
+
+def measure(path, output):
+    """
+    :return: (blocks retained per row, bytes retained per row, peak bytes, seconds)
+    """
+
+    tracemalloc.start()
+    start = time.time()
+    with quiet():
+        results = list(convert([path], output=output))
+    elapsed = time.time() - start
+    current, peak = tracemalloc.get_traced_memory()
+    blocks = sum(stat.count for stat in tracemalloc.take_snapshot().statistics('filename'))
+    tracemalloc.stop()
+
+    return float(blocks) / len(results), float(current) / len(results), peak, elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('-r', '--rows', type=int, default=2000, help='Number of rows in the generated file')
+    parser.add_argument('-c', '--columns', type=int, default=50, help='Number of PROPERTY columns')
+    args = parser.parse_args()
+
+    directory = tempfile.mkdtemp()
+    try:
+        path = os.path.join(directory, 'bench.csv')
+        write_test_file(path, args.rows, args.columns)
+
+        print('{} rows x {} columns'.format(args.rows, args.columns + 1))
+        print('{:<8} {:>14} {:>14} {:>12} {:>10}'.format('output', 'blocks/row', 'bytes/row', 'peak MB', 'seconds'))
+        for output in ('pif', 'record'):
+            blocks, size, peak, elapsed = measure(path, output)
+            print('{:<8} {:>14.1f} {:>14.0f} {:>12.1f} {:>10.2f}'.format(output, blocks, size, peak / 1e6, elapsed))
+    finally:
+        shutil.rmtree(directory)
+
+
+if __name__ == '__main__':
+    main()
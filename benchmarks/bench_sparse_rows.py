@@ -0,0 +1,89 @@
+# coding: utf-8
+"""
+Cost of filling the systems of sparse rows, where most cells of a wide
+template are empty, visiting every cell against visiting only the columns
+from row_columns (the non-empty cells and the placeholder columns of the
+header plan), on a generated file.
+
+    python benchmarks/bench_sparse_rows.py --columns 1000 --rows 500 --fill 0.1
+"""
+import argparse
+import io
+import os
+import shutil
+import sys
+import tempfile
+import timeit
+from contextlib import contextmanager
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.join(ROOT, 'test_files'))
+
+from csv_template_ingester.converter import convert, read_tables
+from csv_template_ingester.template_csv_parser import *
+from generate_test_csv import KEYWORD_MIXES, write_test_csv
+
+
+@contextmanager
+def quiet():
+    stdout = sys.stdout
+    sys.stdout = io.StringIO() if sys.version_info[0] > 2 else io.BytesIO()
+    try:
+        yield
+    finally:
+        sys.stdout = stdout
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('-c', '--columns', type=int, default=1000, help='Columns of the generated file, after NAME')
+    parser.add_argument('-r', '--rows', type=int, default=500, help='Data rows of the generated file')
+    parser.add_argument('-f', '--fill', type=float, default=0.1, help='Fraction of the cells that hold a value')
+    parser.add_argument('-m', '--mix', choices=KEYWORD_MIXES, default='mixed', help='Keyword mix of the columns')
+    parser.add_argument('--repeat', type=int, default=5, help='Number of timing runs, the best is reported')
+    args = parser.parse_args()
+
+    directory = tempfile.mkdtemp(prefix='bench-sparse-')
+    try:
+        path = os.path.join(directory, 'sparse.csv')
+        write_test_csv(path, args.rows, args.columns, args.mix, args.fill)
+
+        tables = read_tables(path)
+        table = list(next(tables))
+        tables.close()
+        plan = compile_header_plan(table[0][1])
+        rows = [row for i, row in table[1:]]
+        cells = sum(len(row) for row in rows)
+        filled_cells = sum(1 for row in rows for cell in row if cell != '')
+
+        def run_dense():
+            for row in rows:
+                add_fields(plan.keywords, plan.names, plan.units, plan.systs, {}, row, plan.handlers, {})
+
+        def run_sparse():
+            for row in rows:
+                add_fields(plan.keywords, plan.names, plan.units, plan.systs, {}, row, plan.handlers, {},
+                           row_columns(plan, row))
+
+        def run_convert():
+            for _ in convert([path]):
+                pass
+
+        with quiet():
+            dense = min(timeit.repeat(run_dense, number=1, repeat=args.repeat))
+            sparse = min(timeit.repeat(run_sparse, number=1, repeat=args.repeat))
+            converted = min(timeit.repeat(run_convert, number=1, repeat=args.repeat))
+    finally:
+        shutil.rmtree(directory, ignore_errors=True)
+
+    print('{} rows x {} columns, {:.1%} of the cells filled, {} placeholder columns'.format(
+        len(rows), len(plan.columns), float(filled_cells) / cells, len(plan.placeholders)))
+    print('every cell:     {:.3f} ms/row'.format(dense / len(rows) * 1e3))
+    print('row_columns:    {:.3f} ms/row'.format(sparse / len(rows) * 1e3))
+    print('speedup:        {:.2f}x'.format(dense / sparse))
+    print('convert():      {:.3f} ms/row'.format(converted / len(rows) * 1e3))
+
+
+if __name__ == '__main__':
+    main()
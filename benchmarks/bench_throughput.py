@@ -0,0 +1,244 @@
+# coding: utf-8
+"""
+End-to-end throughput of convert() over a grid of generated files
+(rows x columns x keyword mix). Each case runs in its own process and
+reports rows/sec, cells/sec, peak RSS and the time to the first PIF.
+
+    python benchmarks/bench_throughput.py --output results.json
+    python benchmarks/bench_throughput.py --baseline results.json --threshold 0.2
+
+With --baseline the run fails (exit status 1) when the cells/sec of any
+case common to both runs drops by more than the threshold fraction. Each
+run also times a fixed pure-Python workload that does not touch the
+converter, and the baseline throughput is scaled by the ratio of the two
+runs' calibration scores, so a baseline recorded on one machine can gate
+runs on another. CI compares the --quick grid against
+benchmarks/baseline-quick.json.
+"""
+import argparse
+import io
+import json
+import os
+import platform
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+from contextlib import contextmanager
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.join(ROOT, 'test_files'))
+
+from generate_test_csv import KEYWORD_MIXES, write_test_csv
+
+ROWS = [100, 1000, 10000]
+COLUMNS = [10, 100]
+QUICK_ROWS = [200]
+QUICK_COLUMNS = [10, 50]
+
+
+@contextmanager
+def quiet():
+    stdout = sys.stdout
+    sys.stdout = io.StringIO() if sys.version_info[0] > 2 else io.BytesIO()
+    try:
+        yield
+    finally:
+        sys.stdout = stdout
+
+
+def peak_rss_mb():
+    """
+    :return: peak resident set size of this process in MB, None where the resource module is unavailable
+    """
+
+    try:
+        import resource
+    except ImportError:
+        return None
+
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is in bytes on macOS and in kilobytes elsewhere
+    return peak / 1e6 if sys.platform == 'darwin' else peak / 1e3
+
+
+def run_case(path, output):
+    """
+    Converts a file once, timing the first PIF separately
+
+    :param path: path of the generated file
+    :param output: output mode passed to convert
+    :return: dictionary of the row count, the seconds to the first PIF and the total seconds
+    """
+
+    from csv_template_ingester.converter import convert
+
+    with quiet():
+        start = time.time()
+        pifs = convert([path], output=output)
+        count = 1 if next(pifs, None) is not None else 0
+        first = time.time() - start
+        for _ in pifs:
+            count += 1
+        elapsed = time.time() - start
+
+    return {'rows': count, 'first_pif_seconds': first, 'seconds': elapsed}
+
+
+def measure(path, output, repeat):
+    """
+    Runs a case in a child process so that its peak RSS is not shared with other cases
+
+    :return: dictionary of the best of the timing runs and the peak RSS of the child process
+    """
+
+    command = [sys.executable, os.path.abspath(__file__), '--run-case', path, '--convert-output', output,
+               '--repeat', str(repeat)]
+
+    return json.loads(subprocess.check_output(command).decode('utf-8'))
+
+
+def calibrate(repeat=5):
+    """
+    Times a fixed pure-Python workload of dictionary, list and string operations that does not use the converter
+
+    :param repeat: number of timing runs, the best is kept
+    :return: workload runs per second
+    """
+
+    def workload():
+        rows = []
+        for i in range(20000):
+            row = {'name': 'Sample {}'.format(i), 'value': str(i * 7 % 1000)}
+            row['scalars'] = [row['value'].strip()]
+            rows.append(row)
+        return json.dumps(rows)
+
+    best = None
+    for _ in range(repeat):
+        start = time.time()
+        workload()
+        elapsed = time.time() - start
+        best = elapsed if best is None else min(best, elapsed)
+
+    return 1 / best
+
+
+def case_key(case):
+    return '{}x{}-{}-{}'.format(case['rows'], case['columns'], case['mix'], case['output'])
+
+
+def compare(results, baseline, threshold, scale=1.0):
+    """
+    Compares the cells/sec of each case with a previous run
+
+    :param results: cases of this run
+    :param baseline: cases of the previous run
+    :param threshold: largest allowed drop, as a fraction of the baseline throughput
+    :param scale: factor the baseline throughput is multiplied by, the ratio of the calibration scores of this run
+        and the previous one
+    :return: list of (case key, scaled baseline cells/sec, cells/sec) for the cases that dropped past the threshold
+    """
+
+    previous = dict((case_key(case), case) for case in baseline)
+    regressions = []
+
+    for case in results:
+        key = case_key(case)
+        if key not in previous:
+            continue
+
+        expected = previous[key]['cells_per_sec'] * scale
+        if case['cells_per_sec'] < expected * (1 - threshold):
+            regressions.append((key, expected, case['cells_per_sec']))
+
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('-r', '--rows', type=int, nargs='+', help='Data rows per generated file')
+    parser.add_argument('-c', '--columns', type=int, nargs='+', help='Columns per generated file, after NAME')
+    parser.add_argument('-m', '--mix', choices=KEYWORD_MIXES, nargs='+', default=KEYWORD_MIXES,
+                        help='Keyword mixes of the generated files')
+    parser.add_argument('--convert-output', choices=['pif', 'record', 'dict'], nargs='+', default=['pif'],
+                        help='Output modes of convert to time')
+    parser.add_argument('--repeat', type=int, default=3, help='Number of timing runs per case, the best is reported')
+    parser.add_argument('--quick', action='store_true', help='Small grid for CI')
+    parser.add_argument('-o', '--output', help='Write the results to this JSON file')
+    parser.add_argument('-b', '--baseline', help='JSON results of a previous run to compare against')
+    parser.add_argument('-t', '--threshold', type=float, default=0.2,
+                        help='Fail when cells/sec drops by more than this fraction of the baseline')
+    parser.add_argument('--run-case', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.run_case:
+        runs = [run_case(args.run_case, args.convert_output[0]) for _ in range(args.repeat)]
+        best = min(runs, key=lambda run: run['seconds'])
+        best['peak_rss_mb'] = peak_rss_mb()
+        print(json.dumps(best))
+        return 0
+
+    rows = args.rows or (QUICK_ROWS if args.quick else ROWS)
+    columns = args.columns or (QUICK_COLUMNS if args.quick else COLUMNS)
+
+    calibration = calibrate()
+    print('calibration: {:.1f} runs/sec'.format(calibration))
+
+    results = []
+    directory = tempfile.mkdtemp()
+    try:
+        print('{:<24} {:>12} {:>14} {:>10} {:>14}'.format('case', 'rows/sec', 'cells/sec', 'peak MB',
+                                                         'first PIF ms'))
+        for mix in args.mix:
+            for row_count in rows:
+                for column_count in columns:
+                    path = os.path.join(directory, '{}-{}-{}.csv'.format(mix, row_count, column_count))
+                    write_test_csv(path, row_count, column_count, mix)
+
+                    for output in args.convert_output:
+                        run = measure(path, output, args.repeat)
+                        case = {
+                            'rows': row_count,
+                            'columns': column_count + 1,
+                            'mix': mix,
+                            'output': output,
+                            'seconds': run['seconds'],
+                            'rows_per_sec': run['rows'] / run['seconds'],
+                            'cells_per_sec': run['rows'] * (column_count + 1) / run['seconds'],
+                            'peak_rss_mb': run['peak_rss_mb'],
+                            'first_pif_seconds': run['first_pif_seconds'],
+                        }
+                        results.append(case)
+
+                        print('{:<24} {:>12.0f} {:>14.0f} {:>10} {:>14.2f}'.format(
+                            case_key(case), case['rows_per_sec'], case['cells_per_sec'],
+                            '-' if case['peak_rss_mb'] is None else '{:.1f}'.format(case['peak_rss_mb']),
+                            case['first_pif_seconds'] * 1e3))
+    finally:
+        shutil.rmtree(directory)
+
+    if args.output:
+        with open(args.output, 'w') as output_file:
+            json.dump({'python': platform.python_version(), 'platform': platform.platform(), 'time': time.time(),
+                       'calibration': calibration, 'cases': results}, output_file, indent=2)
+
+    if args.baseline:
+        with open(args.baseline) as baseline_file:
+            baseline = json.load(baseline_file)
+
+        scale = calibration / baseline['calibration'] if baseline.get('calibration') else 1.0
+        regressions = compare(results, baseline['cases'], args.threshold, scale)
+        for key, before, after in regressions:
+            print('Regression in {}: {:.0f} -> {:.0f} cells/sec ({:.0%})'.format(key, before, after,
+                                                                                after / before - 1))
+        if regressions:
+            return 1
+
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,458 @@
+# coding: utf-8
+"""
+Conversion of tables in blocks of rows. The numeric columns of a block (PROPERTY, CONDITION, ALL CONDITION and
+PREPARATION STEP DETAIL) are parsed with NumPy at once: the range(min, max) cells of its PROPERTY columns are validated
+for the whole block before any PIF of the block is built, and reach the field handlers as parsed scalars. The numbers
+parsed can be given to the PIFs as typed scalars instead of the text of the cells.
+
+The properties and values of the named numeric columns are written by field handlers made for each column, which
+copy the name and units that every cell of the column shares from a prototype instead of building and validating them
+cell by cell, and skip the range syntax check done for the block.
+
+NumPy is only needed for convert_batches.
+"""
+import re
+from collections import namedtuple
+from itertools import islice
+from pypif.obj import Property, Scalar, Value
+from csv_template_ingester.converter import read_tables, fill_pif, CELL_LIMIT, _publish_report
+from csv_template_ingester.dict_builder import fill_pif_dict, get_dict_handlers
+from csv_template_ingester.plan_cache import get_plan_cache
+from csv_template_ingester.template_csv_parser import *
+from pif_csv_utils.diagnostics import DiagnosticsReport
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+STRING_TYPES = (type(b''), type(u''))
+
+# Number of rows converted per block
+BATCH_ROWS = 1000
+
+# Fields whose columns are parsed as numbers
+NUMERIC_FIELDS = frozenset(['property', 'condition', 'allcondition', 'preparationstepdetail'])
+
+# Fields whose cells can hold a range(min, max)
+RANGE_FIELDS = frozenset(['property'])
+
+# Text that type_block gives as an int: a whole number literal as in RANGE_PATTERN, without leading zeros
+INTEGER_PATTERN = re.compile(r'^[-+]?(0|[1-9]\d*)$')
+
+# Text that type_block gives as a float: a decimal or exponent literal as in RANGE_PATTERN, without leading zeros
+DECIMAL_PATTERN = re.compile(r'^[-+]?((0|[1-9]\d*)(\.\d*)?|\.\d+)([eE][-+]?\d+)?$')
+
+
+class NumericColumn(namedtuple('NumericColumn', ['index', 'values', 'numbers', 'minimums', 'maximums',
+                                                 'ranges'])):
+    """
+    Numbers parsed from a column of a block of rows, as arrays indexed by the row in the block
+
+    :param index: index of the column
+    :param values: float64 array of the number in each cell, NaN where the cell does not hold a single finite number.
+        None if the numbers were not parsed
+    :param numbers: boolean array, True where the cell holds a single finite number: a number from a spreadsheet, or
+        text matching INTEGER_PATTERN or DECIMAL_PATTERN. None if the numbers were not parsed
+    :param minimums: float64 array of the minimum of each range(min, max) cell, NaN for other cells
+    :param maximums: float64 array of the maximum of each range(min, max) cell, NaN for other cells
+    :param ranges: boolean array, True where the cell holds a range
+    """
+
+    __slots__ = ()
+
+
+def parse_numeric_column(cells, index=None, ranges=False, numbers=True):
+    """
+    Parses the cells of a column of a block of rows into numbers. Text cells that are number literals are converted
+    together by NumPy.
+
+    :param cells: list of the cells of the column, text or numbers from spreadsheets
+    :param index: index of the column
+    :param ranges: True to parse range(min, max) cells
+    :param numbers: False to only parse the ranges, leaving values and numbers None
+    :return: NumericColumn
+    """
+
+    count = len(cells)
+    text = [cell.strip() if isinstance(cell, STRING_TYPES) else u'' for cell in cells]
+
+    values = is_number = None
+    if numbers:
+        values = numpy.full(count, numpy.nan)
+
+        literals = [i for i, cell in enumerate(text) if cell and DECIMAL_PATTERN.match(cell)]
+        if literals:
+            values[literals] = numpy.array([text[i] for i in literals], dtype=numpy.str_).astype(numpy.float64)
+
+        for i, cell in enumerate(cells):
+            if not isinstance(cell, STRING_TYPES) and cell is not None:
+                values[i] = cell
+
+        with numpy.errstate(invalid='ignore'):
+            is_number = numpy.isfinite(values)
+        values[~is_number] = numpy.nan
+
+    minimums = numpy.full(count, numpy.nan)
+    maximums = numpy.full(count, numpy.nan)
+    is_range = numpy.zeros(count, dtype=bool)
+
+    if ranges:
+        for i, cell in enumerate(text):
+            min_max = RANGE_PATTERN.match(cell) if cell[:1] in 'rR' else None
+            if min_max:
+                minimums[i] = float(min_max.group('min'))
+                maximums[i] = float(min_max.group('max'))
+                is_range[i] = True
+
+    return NumericColumn(index, values, is_number, minimums, maximums, is_range)
+
+
+def parse_block(plan, block, numbers=True):
+    """
+    Parses the numeric columns of a block of rows
+
+    :param plan: HeaderPlan of the table
+    :param block: list of the rows of the block
+    :param numbers: False to only parse the ranges of the PROPERTY columns
+    :return: list of NumericColumn. Raises ValueError if a range of the block has a minimum greater than its maximum
+    """
+
+    columns = []
+    for j, field in enumerate(plan.fields):
+        if field not in (NUMERIC_FIELDS if numbers else RANGE_FIELDS):
+            continue
+
+        column = parse_numeric_column([row[j] if j < len(row) else u'' for row in block], j, field in RANGE_FIELDS,
+                                      numbers)
+
+        inverted = numpy.flatnonzero(column.ranges & (column.minimums > column.maximums))
+        if len(inverted):
+            i = inverted[0]
+            raise ValueError("Minimum ({}) cannot be greater than maximum ({})".format(float(column.minimums[i]),
+                                                                                    float(column.maximums[i])))
+
+        columns.append(column)
+
+    return columns
+
+
+def type_block(block, columns):
+    """
+    Replaces the text of the numbers in the numeric columns of a block with the numbers: ints for whole number
+    literals, parsed exactly, and floats for decimal and exponent literals. Text that is not a plain number literal,
+    such as 007, 1_000 or inf, is kept as text, as are zeros with a sign or an exponent (see _type_literal).
+
+    :param block: list of the rows of the block
+    :param columns: list of NumericColumn of the block, with the numbers parsed
+    :return: list of the rows with typed numbers
+    """
+
+    rows = [list(row) for row in block]
+
+    for column in columns:
+        j = column.index
+        values = column.values.tolist()
+        for i in numpy.flatnonzero(column.numbers).tolist():
+            cell = rows[i][j]
+            if isinstance(cell, STRING_TYPES):
+                rows[i][j] = _type_literal(cell, values[i])
+
+    return rows
+
+
+def _type_literal(cell, value):
+    """
+    :param cell: text cell holding a number literal
+    :param value: float parsed from the cell
+    :return: int of a whole number literal, the float of other literals, or the cell itself for a zero with a sign
+        or an exponent, such as -0 or 0e5, which the number would not keep
+    """
+
+    text = cell.strip()
+    if value == 0 and (text[:1] in '+-' or 'e' in text or 'E' in text):
+        return cell
+
+    return int(text) if INTEGER_PATTERN.match(text) else value
+
+
+def block_ranges(columns, make_range):
+    """
+    Values of the range(min, max) cells of a block, as given to the field handlers in place of their text
+
+    :param columns: list of NumericColumn of the block
+    :param make_range: callable of the minimum and maximum returning the scalar of a range
+    :return: dictionary of the row in the block to a dictionary of the column index to the list of the range scalar
+    """
+
+    ranges = {}
+    for column in columns:
+        for i in numpy.flatnonzero(column.ranges).tolist():
+            ranges.setdefault(i, {})[column.index] = [make_range(float(column.minimums[i]),
+                                                                 float(column.maximums[i]))]
+
+    return ranges
+
+
+def _scalar_range(minimum, maximum):
+    return Scalar(minimum=minimum, maximum=maximum)
+
+
+def _dict_range(minimum, maximum):
+    return {'minimum': minimum, 'maximum': maximum}
+
+
+def _prototype(prototype_class, name, unit):
+    """
+    :return: pypif object of the class holding the name and unit of a column
+    """
+
+    prototype = prototype_class(name=name)
+    if unit:
+        prototype.units = unit
+
+    return prototype
+
+
+def _clone(prototype):
+    """
+    :return: shallow copy of a prototype, cheaper than copy.copy since it skips the copy protocol lookups
+    """
+
+    clone = prototype.__class__.__new__(prototype.__class__)
+    clone.__dict__.update(prototype.__dict__)
+    return clone
+
+
+def _property_field(name, unit):
+    """
+    :return: field handler of a PROPERTY column adding a copy of a prototype Property with the scalars of the cell
+    """
+
+    prototype = _prototype(Property, name, unit)
+
+    def handler(systm, cell, names, units, column_index, all_condition):
+        if cell:
+            prop = _clone(prototype)
+            prop.scalars = listify(cell)
+            child_list(systm, 'properties').append(prop)
+
+    return handler
+
+
+def _condition_field(name, unit):
+    """
+    :return: field handler of a CONDITION column adding a copy of a prototype Value with the scalars of the cell to
+        the last property
+    """
+
+    prototype = _prototype(Value, name, unit)
+
+    def handler(systm, cell, names, units, column_index, all_condition):
+        if cell:
+            prop = last_property(systm, CONDITION_BEFORE_PROPERTY)
+            condition = _clone(prototype)
+            condition.scalars = listify(cell)
+            child_list(prop, 'conditions').append(condition)
+
+    return handler
+
+
+def _all_condition_field(name, unit):
+    """
+    :return: field handler of an ALL CONDITION column adding a copy of a prototype Value with the scalars of the cell
+        to the all_conditions
+    """
+
+    prototype = _prototype(Value, name, unit)
+
+    def handler(systm, cell, names, units, column_index, all_condition):
+        if cell:
+            condition = _clone(prototype)
+            condition.scalars = listify(cell)
+            all_condition.append(condition)
+
+    return handler
+
+
+def _preparation_step_detail_field(name, unit):
+    """
+    :return: field handler of a PREPARATION STEP DETAIL column adding a copy of a prototype Value with the scalars of
+        the cell to the last preparation step
+    """
+
+    prototype = _prototype(Value, name, unit)
+
+    def handler(systm, cell, names, units, column_index, all_condition):
+        if cell:
+            if not systm.preparation:
+                raise ValueError(DETAIL_BEFORE_STEP)
+            detail = _clone(prototype)
+            detail.scalars = listify(cell)
+            child_list(systm.preparation[-1], 'details').append(detail)
+
+    return handler
+
+
+def _dict_value(name, unit, cell):
+    """
+    :return: dictionary of a property or value of a column with the scalars of the cell
+    """
+
+    value = {'name': name, 'scalars': listify(cell)}
+    if unit:
+        value['units'] = unit
+
+    return value
+
+
+def _dict_property_field(name, unit):
+    def handler(systm, cell, names, units, column_index, all_condition):
+        if cell:
+            systm.setdefault('properties', []).append(_dict_value(name, unit, cell))
+
+    return handler
+
+
+def _dict_condition_field(name, unit):
+    def handler(systm, cell, names, units, column_index, all_condition):
+        if cell:
+            if not systm.get('properties'):
+                raise ValueError(CONDITION_BEFORE_PROPERTY)
+            systm['properties'][-1].setdefault('conditions', []).append(_dict_value(name, unit, cell))
+
+    return handler
+
+
+def _dict_all_condition_field(name, unit):
+    def handler(systm, cell, names, units, column_index, all_condition):
+        if cell:
+            all_condition.append(_dict_value(name, unit, cell))
+
+    return handler
+
+
+def _dict_preparation_step_detail_field(name, unit):
+    def handler(systm, cell, names, units, column_index, all_condition):
+        if cell:
+            if not systm.get('preparation'):
+                raise ValueError(DETAIL_BEFORE_STEP)
+            systm['preparation'][-1].setdefault('details', []).append(_dict_value(name, unit, cell))
+
+    return handler
+
+
+# Makers of the field handlers of the named numeric columns of a block, called with the name and unit of the column.
+# Range cells reach them as parsed scalars, so they only copy the name and unit shared by the column
+BLOCK_FIELD_HANDLERS = {
+    'property': _property_field,
+    'condition': _condition_field,
+    'allcondition': _all_condition_field,
+    'preparationstepdetail': _preparation_step_detail_field,
+}
+
+# Makers of the dictionary field handlers of the named numeric columns of a block, as BLOCK_FIELD_HANDLERS
+DICT_BLOCK_FIELD_HANDLERS = {
+    'property': _dict_property_field,
+    'condition': _dict_condition_field,
+    'allcondition': _dict_all_condition_field,
+    'preparationstepdetail': _dict_preparation_step_detail_field,
+}
+
+
+def get_block_handlers(plan, output='pif'):
+    """
+    Resolves the field handlers of a header plan for blocks of rows. Named numeric columns get handlers of their own
+    (see BLOCK_FIELD_HANDLERS); unnamed ones, which only an ALL CONDITION column accepts, keep the handler of the plan,
+    as do the other columns.
+
+    :param plan: HeaderPlan
+    :param output: 'pif' for handlers filling ChemicalSystems, 'dict' for handlers filling dictionaries
+    :return: tuple of field handlers, indexed by column
+    """
+
+    if output == 'dict':
+        handlers, makers = list(get_dict_handlers(plan)), DICT_BLOCK_FIELD_HANDLERS
+    else:
+        handlers, makers = list(plan.handlers), BLOCK_FIELD_HANDLERS
+
+    for j, field in enumerate(plan.fields):
+        if field in makers and plan.names[j]:
+            handlers[j] = makers[field](plan.names[j], plan.units[j])
+
+    return tuple(handlers)
+
+
+def convert_batches(files, batch_rows=BATCH_ROWS, typed_scalars=False, cell_limit=CELL_LIMIT, sheets=None,
+                    output='pif', plan_cache=None, diagnostics=None):
+    """
+    Converts files a block of rows at a time. Blocks hold the rows of a single table. With typed_scalars False the
+    PIFs are the ones convert() gives, except that a range with a minimum greater than its maximum raises before any
+    PIF of its block is yielded.
+
+    :param files: list of files to convert
+    :param batch_rows: number of rows per block
+    :param typed_scalars: True to give the number literals in the text cells of numeric columns to the PIFs as ints or
+        floats (see type_block) instead of text
+    :param cell_limit: Max number of cells (rows * columns) allowed per table
+    :param sheets: names or indices of the workbook sheets to convert, defaults to every sheet
+    :param output: 'pif' for ChemicalSystems, 'dict' for the PIFs as plain dictionaries
+    :param plan_cache: HeaderPlanCache to get header plans from, defaults to the in-memory cache of the process
+    :param diagnostics: optional list that a DiagnosticsReport of each file is appended to, as for convert()
+    :return: yields a list of the PIFs of each block
+    """
+
+    if numpy is None:
+        raise ImportError('convert_batches needs NumPy, install it with pip install numpy')
+
+    if output not in ('pif', 'dict'):
+        raise ValueError('Output must be pif or dict, not {}'.format(output))
+
+    if batch_rows < 1:
+        raise ValueError('Blocks must hold at least one row')
+
+    if plan_cache is None:
+        plan_cache = get_plan_cache()
+
+    if output == 'dict':
+        build, make_range = fill_pif_dict, _dict_range
+    else:
+        build, make_range = fill_pif, _scalar_range
+
+    for f in files:
+        report = DiagnosticsReport(f)
+        try:
+            for table_rows in read_tables(f, cell_limit, sheets):
+                header = next(table_rows, None)
+                if header is None:
+                    continue
+
+                plan = plan_cache.get_plan(header[1])
+                handlers = get_block_handlers(plan, output)
+
+                while True:
+                    numbered = list(islice(table_rows, batch_rows))
+                    if not numbered:
+                        break
+
+                    block = [row for i, row in numbered]
+                    columns = parse_block(plan, block, typed_scalars)
+                    if typed_scalars:
+                        block = type_block(block, columns)
+                    ranges = block_ranges(columns, make_range)
+
+                    systems = []
+                    for k, ((i, _), row) in enumerate(zip(numbered, block)):
+                        values = decode_cells(plan.handlers, plan.systs, row, row_columns(plan, row))
+                        parsed = ranges.get(k)
+                        if parsed:
+                            values = [(j, parsed.get(j, cell), fills) for j, cell, fills in values]
+
+                        report.activate(i)
+                        systems.append(build(plan, values, handlers))
+                        report.deactivate()
+
+                    yield systems
+        finally:
+            report.deactivate()
+            _publish_report(report, diagnostics)
@@ -1,49 +1,106 @@
 # coding: utf-8
+import argparse
+import json
+import logging
 import sys
 from pypif import pif
 from pif_csv_utils.file_utils import *
+from pif_csv_utils.row_index import get_row_index
+from pif_csv_utils.diagnostics import DiagnosticsReport
 from csv_template_ingester.template_csv_parser import *
+from csv_template_ingester.dict_builder import *
+from csv_template_ingester.plan_cache import get_plan_cache
+from csv_template_ingester.output_cache import OutputCache, parse_size
+from csv_template_ingester.merge import merge_pifs, MERGE_KEYS
+from csv_template_ingester.stats import ConversionStats, NULL_STATS, timer
 
 
-def _check_table_size(table, cell_limit=100 * 100000 + 1):
+CELL_LIMIT = 100 * 100000 + 1
+
+
+def _check_cell_count(row_count, col_count, cell_limit=CELL_LIMIT):
     """
-    Check a reader object to see if the total number of cells exceeds the set limit
+    Check the number of cells read so far against the set limit
 
-    :param table: The reader object containing the table data
+    :param row_count: number of data rows read so far
+    :param col_count: number of columns in the header row
     :param cell_limit: Max number of cells allowed
-    :return: True if within the limit or exits if the table is too large
+    :return: True if within the limit or raises if the table is too large
     """
 
-    pif_count = 0
-    col_count = 0
-
-    for i, row in enumerate(table):
-        if i == 0:
-            col_count = len(row)
-        else:
-            pif_count += 1
-
-        if pif_count * col_count > cell_limit:
-            raise ValueError(
-                'This ingester only supports up to {} cells (rows * columns).\nPlease split your file into smaller files and ingest each separately'.format(
-                    cell_limit))
+    if row_count * col_count > cell_limit:
+        raise ValueError(
+            'This ingester only supports up to {} cells (rows * columns).\nPlease split your file into smaller files and ingest each separately'.format(
+                cell_limit))
 
     return True
 
 
-def create_pif(headers, row):
+def create_pif(plan, row):
     """
     Creates PIFs from lists of table row
 
-    :param headers: header data from the table
+    :param plan: HeaderPlan compiled from the header row, or the raw header row
     :param row: the row of data
     :return: ChemicalSystem containing the data from that row
     """
 
-    sys_dict = {}
-    keywords, names, units, systs = get_header_info(headers)
+    if not isinstance(plan, HeaderPlan):
+        plan = compile_header_plan(plan)
 
-    sys_dict, all_condition = add_fields(keywords, names, units, systs, sys_dict, row)
+    return _create_pif(plan, row, plan.handlers, NULL_STATS)
+
+
+def _create_pif(plan, row, handlers, stats):
+    """
+    create_pif recording the add_fields and assemble stages of the row
+
+    :param plan: HeaderPlan compiled from the header row
+    :param row: the row of data
+    :param handlers: field handlers of the plan, wrapped by stats.time_handlers
+    :param stats: ConversionStats to record into, or NULL_STATS
+    :return: ChemicalSystem containing the data from that row
+    """
+
+    start = timer()
+    filled = {}
+    sys_dict, all_condition = fill_systems(decode_cells(plan.handlers, plan.systs, row, row_columns(plan, row)),
+                                           handlers, plan.names, plan.units, plan.systs, {}, filled)
+    added = timer()
+    stats.add('add_fields', added - start, 1, len(row))
+
+    main_system = _assemble_pif(sys_dict, all_condition, filled)
+    stats.add('assemble', timer() - added, 1)
+
+    return main_system
+
+
+def fill_pif(plan, values, handlers=None):
+    """
+    Creates the PIF for the decoded values of a table row
+
+    :param plan: HeaderPlan compiled from the header row
+    :param values: list of (column index, value, fills) tuples from decode_cells
+    :param handlers: field handlers to write the values with, the handlers of the plan if not given
+    :return: ChemicalSystem containing the data from that row
+    """
+
+    filled = {}
+    sys_dict, all_condition = fill_systems(values, plan.handlers if handlers is None else handlers, plan.names,
+                                           plan.units, plan.systs, {}, filled)
+
+    return _assemble_pif(sys_dict, all_condition, filled)
+
+
+def _assemble_pif(sys_dict, all_condition, filled):
+    """
+    Formats the main system of a row and attaches the sub-systems that hold data, in the order they were created
+
+    :param sys_dict: dictionary of systems filled by add_fields
+    :param all_condition: list of all_conditions from add_fields
+    :param filled: dictionary of the number of cells written to each sub-system, from add_fields
+    :return: ChemicalSystem containing the data from the row
+    """
 
     main_system = sys_dict['main']
     main_system.sub_systems = []
@@ -55,53 +112,426 @@ def create_pif(headers, row):
         main_system.preparation = [step for step in main_system.preparation if step.name != '']
 
     for item in sys_dict:
-        if item != 'main':
-            if len([s for s in sys_dict[item].as_dictionary()]) > 1:
-                main_system.sub_systems.append(sys_dict[item])
+        if item != 'main' and filled.get(item):
+            main_system.sub_systems.append(sys_dict[item])
 
     return main_system
 
 
-def convert(files=[], **kwargs):
+class RowRecord(object):
+    """
+    Compact record of a data row: the values of its non-empty cells decoded for their field handlers (numbers as text
+    or as numbers, [A, B] cells as lists) along with the plan of its table. No pypif objects are built until to_pif
+    is called, which only writes the decoded values to new systems, so rows that are filtered, counted or serialized
+    another way never allocate the object model.
+    """
+
+    __slots__ = ('plan', 'values', 'row_number')
+
+    def __init__(self, plan, values, row_number=None):
+        """
+        Constructor.
+
+        :param plan: HeaderPlan of the table the row belongs to
+        :param values: tuple of (column index, value, fills) tuples from decode_cells
+        :param row_number: index of the row in its table, the header being row 0
+        """
+        self.plan = plan
+        self.values = values
+        self.row_number = row_number
+
+    @classmethod
+    def from_row(cls, plan, row, row_number=None):
+        """
+        Decodes a data row into a record
+
+        :param plan: HeaderPlan of the table the row belongs to
+        :param row: the row of data
+        :param row_number: index of the row in its table, the header being row 0
+        :return: RowRecord
+        """
+        return cls(plan, tuple(decode_cells(plan.handlers, plan.systs, row, row_columns(plan, row))), row_number)
+
+    def to_pif(self):
+        """
+        Builds the PIF for the row. A new ChemicalSystem is built on every call.
+
+        :return: ChemicalSystem containing the data from the row
+        """
+        return fill_pif(self.plan, self.values)
+
+    def as_dictionary(self):
+        """
+        :return: the PIF for the row as a dictionary, built without the pypif object model
+        """
+        return fill_pif_dict(self.plan, self.values)
+
+    def __repr__(self):
+        return 'RowRecord(row_number={}, values={!r})'.format(self.row_number, self.values)
+
+
+def _limit_rows(table, cell_limit=CELL_LIMIT):
+    """
+    Skips empty rows and enforces the cell limit as rows stream through
+
+    :param table: iterable of rows, header row first
+    :param cell_limit: Max number of cells (rows * columns) allowed
+    :return: yields tuples of (row number, row) for the non-empty rows
     """
-    Converts a specialized CSV/TSV file to a physical information file.
+
+    for i, row in enumerate(table):
+
+        if i == 0:
+            col_count = len(row)
+        else:
+            _check_cell_count(i, col_count, cell_limit)
+
+        if not any(row):
+            continue
+
+        yield i, row
+
+
+def _select_rows(read_rows, row_count, rows, cell_limit=CELL_LIMIT):
+    """
+    Picks the header row and a slice of the data rows of a table without reading the rows in between, skipping
+    empty rows and enforcing the cell limit on the rows picked
+
+    :param read_rows: function of a slice of row numbers returning an iterable of (row number, row) tuples
+    :param row_count: number of rows in the table, empty rows included
+    :param rows: slice of the data rows, counted from 0 after the header row
+    :param cell_limit: Max number of cells (rows * columns) allowed
+    :return: yields tuples of (row number, row) for the header row followed by the picked non-empty data rows
+    """
+
+    for header_number in range(row_count):
+        for header_number, header in read_rows(slice(header_number, header_number + 1)):
+            pass
+        if any(header):
+            break
+    else:
+        return
+
+    yield header_number, header
+
+    first = header_number + 1
+    start, stop, step = rows.indices(row_count - first)
+    for count, (i, row) in enumerate(read_rows(slice(first + start, first + stop, step)), 1):
+        _check_cell_count(count, len(header), cell_limit)
+
+        if not any(row):
+            continue
+
+        yield i, row
+
+
+def read_tables(f, cell_limit=CELL_LIMIT, sheets=None, rows=None, index_sidecar=False):
+    """
+    Reads the tables of a file in a single pass, skipping empty rows and enforcing the cell limit on each table.
+    CSV/TSV files hold one table, XLS/XLSX workbooks one per sheet.
+
+    With rows, CSV/TSV files are read through a memory mapped row index instead, so that only the rows asked for
+    are read, and the cell limit applies to those rows.
+
+    :param f: path of the file to read
+    :param cell_limit: Max number of cells (rows * columns) allowed per table
+    :param sheets: names or indices of the workbook sheets to read, defaults to every sheet
+    :param rows: slice of the data rows to read from each table, counted from 0 after the header row with empty
+        rows included, defaults to every row
+    :param index_sidecar: with rows, keep the row index of CSV/TSV files in a .rowidx file next to them
+    :return: yields a row iterator per table, each yielding (row number, row) for the header row followed by the
+        data rows
+    """
+
+    if f.endswith('.xls') or f.endswith('.xlsx'):
+        for table in get_data_from_excel(f, sheets):
+            if rows is None:
+                yield _limit_rows(table, cell_limit)
+            else:
+                table = list(table)
+                yield _select_rows(lambda selected: ((i, table[i]) for i in range(*selected.indices(len(table)))),
+                                   len(table), rows, cell_limit)
+
+        return
+
+    if f.endswith('.csv'):
+        delimiter = None
+
+    elif f.endswith('.tsv'):
+        delimiter = '\t'
+
+    else:
+        raise IOError('Filetype provided is not compatible with this parser. Please upload a .csv, .tsv, .xls or .xlsx file.\n')
+
+    if rows is not None:
+        with get_row_index(f, delimiter, index_sidecar) as index:
+            yield _select_rows(index.read_rows, len(index), rows, cell_limit)
+
+        return
+
+    input_file, dialect = open_table(f, delimiter)
+    with input_file:
+        yield _limit_rows(get_data_from_table(input_file, dialect), cell_limit)
+
+
+def convert(files=[], cell_limit=CELL_LIMIT, sheets=None, output='pif', stats=None, on_stage=None, plan_cache=None,
+            rows=None, index_sidecar=False, output_cache=None, merge_on=None, merge_sorted=False, diagnostics=None,
+            **kwargs):
+    """
+    Converts a specialized CSV/TSV or XLS/XLSX file to a physical information file.
+
+    The table is read in a single pass. The cell limit is enforced as rows stream through, so PIFs for the rows
+    before the limit is crossed will already have been yielded when the ValueError is raised.
 
     :param files: list of files to convert
+    :param cell_limit: Max number of cells (rows * columns) allowed per table
+    :param sheets: names or indices of the workbook sheets to convert, defaults to every sheet
+    :param output: 'pif' to yield ChemicalSystems, 'record' to yield RowRecords of the decoded values of each row
+        that build them on demand, 'dict' to yield the PIFs as plain dictionaries equal to
+        ChemicalSystem.as_dictionary()
+    :param stats: optional ConversionStats that collects the time, calls, rows and cells of each stage
+    :param on_stage: optional callable, called as on_stage(stage, seconds, rows, cells) for every timed stage
+    :param plan_cache: HeaderPlanCache to get header plans from, defaults to the in-memory cache of the process
+    :param rows: slice of the data rows to convert from each table, counted from 0 after the header row with empty
+        rows included. CSV/TSV files are then read through a row index that jumps straight to those rows
+    :param index_sidecar: with rows, keep the row index of CSV/TSV files in a .rowidx file next to them for later runs
+    :param output_cache: optional OutputCache. The PIFs of a file whose content was converted before with the same
+        options are streamed back from it, otherwise they are stored in it. Not used for output='record'
+    :param merge_on: 'name' or 'uid' to merge the PIFs of the rows sharing a name or uid into one, with their
+        properties merged by property_merge and their other fields taken from the first row. Not available for
+        output='record'
+    :param merge_sorted: with merge_on, True if the rows of each group are consecutive so that they are merged in one
+        streaming pass. Otherwise merged PIFs are yielded in the order of their names or uids, after rows with neither,
+        and large inputs are sorted on disk
+    :param diagnostics: optional list that a DiagnosticsReport of the unique warnings of each file, such as unknown
+        headers, is appended to once the file is done. Reports are logged to the 'csv_template_ingester' logger
+        instead if not given. Files read back from output_cache or converted to records have empty reports
     :return: yields PIFs created from the input files
     """
 
-    for f in files:
+    if output not in ('pif', 'record', 'dict'):
+        raise ValueError('Output must be pif, record or dict, not {}'.format(output))
 
-        with open(f, 'rU') as input_file:
-            if f.endswith('.csv'):
-                table = get_data_from_csv(input_file)
+    if merge_on is not None:
+        if output == 'record':
+            raise ValueError('Rows cannot be merged into records')
 
-            elif f.endswith('.tsv'):
-                table = get_data_from_tsv(input_file)
+        pifs = convert(files, cell_limit, sheets, 'pif', stats, on_stage, plan_cache, rows, index_sidecar,
+                       output_cache, diagnostics=diagnostics)
+        for system in merge_pifs(pifs, merge_on, merge_sorted):
+            yield system.as_dictionary() if output == 'dict' else system
 
-            else:
-                raise IOError('Filetype provided is not compatible with this parser. Please upload a .csv or .tsv file.\n')
+        return
+
+    if output_cache is not None and output != 'record':
+        for item in _convert_cached(files, cell_limit, sheets, output, stats, on_stage, plan_cache, rows,
+                                    index_sidecar, output_cache, diagnostics):
+            yield item
 
-            if not _check_table_size(table, (100 * 100000 + 1)):
-                continue
+        return
 
-            input_file.seek(0)
+    if plan_cache is None:
+        plan_cache = get_plan_cache()
 
-            for i, row in enumerate(table):
+    if stats is None:
+        stats = ConversionStats(on_stage) if on_stage is not None else NULL_STATS
 
-                if not any(row):
+    for f in files:
+        report = DiagnosticsReport(f)
+        try:
+            for table_rows in read_tables(f, cell_limit, sheets, rows, index_sidecar):
+                table_rows = stats.time_rows(table_rows)
+                header = next(table_rows, None)
+                if header is None:
                     continue
 
-                if i == 0:
-                    headers = row
+                start = timer()
+                plan = plan_cache.get_plan(header[1])
+                stats.add('header', timer() - start, 1, len(header[1]))
+
+                if output == 'record':
+                    for i, row in table_rows:
+                        start = timer()
+                        record = RowRecord.from_row(plan, row, i)
+                        stats.add('record', timer() - start, 1, len(row))
+                        yield record
+                elif output == 'dict':
+                    dict_handlers = stats.time_handlers(get_dict_handlers(plan), plan.fields)
+                    for i, row in table_rows:
+                        report.activate(i)
+                        start = timer()
+                        pif_dict = create_pif_dict(plan, row, dict_handlers)
+                        stats.add('build_dict', timer() - start, 1, len(row))
+                        report.deactivate()
+                        yield pif_dict
                 else:
-                    row_pif = create_pif(headers, row)
+                    handlers = stats.time_handlers(plan.handlers, plan.fields)
+                    for i, row in table_rows:
+                        report.activate(i)
+                        system = _create_pif(plan, row, handlers, stats)
+                        report.deactivate()
+                        yield system
+        finally:
+            report.deactivate()
+            _publish_report(report, diagnostics)
+
+
+def _publish_report(report, diagnostics):
+    """
+    Hands the diagnostics report of a file to the caller, or logs it if the caller did not ask for reports
+
+    :param report: DiagnosticsReport of the file
+    :param diagnostics: list to append the report to, None to log it
+    """
 
-                    yield row_pif
+    if diagnostics is not None:
+        diagnostics.append(report)
+    else:
+        report.log()
 
 
-if __name__ == '__main__':
-    result = convert(files=[sys.argv[1]])
+def _convert_cached(files, cell_limit, sheets, output, stats, on_stage, plan_cache, rows, index_sidecar,
+                    output_cache, diagnostics):
+    """
+    convert() through an OutputCache, one entry per file
+
+    :return: yields PIFs created from the input files
+    """
+
+    serialize = json.dumps if output == 'dict' else pif.dumps
+    deserialize = json.loads if output == 'dict' else pif.loads
+
+    for f in files:
+        key = output_cache.key(f, cell_limit, sheets, rows)
+        entry = output_cache.get(key)
+
+        if entry is not None:
+            _publish_report(DiagnosticsReport(f), diagnostics)
+            with entry:
+                for line in entry:
+                    yield deserialize(line)
+            continue
+
+        items = convert([f], cell_limit, sheets, output, stats, on_stage, plan_cache, rows, index_sidecar,
+                        diagnostics=diagnostics)
+        for item in output_cache.put(key, ((item, serialize(item)) for item in items)):
+            yield item
+
 
-    with open(sys.argv[1].replace('.{}'.format(sys.argv[1].rpartition('.')[-1]), '-pif.json'), 'w') as output_file:
-        pif.dump(list(result), output_file, indent=2)
+def _output_path(input_path, output_format='json', compress=False):
+    """
+    Output path for the PIFs converted from an input file
+
+    :param input_path: path of the input file
+    :param output_format: json or jsonl
+    :param compress: add a .gz suffix if True
+    :return: input path with its extension replaced by -pif.json, -pif.jsonl, -pif.json.gz or -pif.jsonl.gz
+    """
+
+    suffix = '-pif.{}{}'.format(output_format, '.gz' if compress else '')
+
+    return input_path.replace('.{}'.format(input_path.rpartition('.')[-1]), suffix)
+
+
+def main(argv=None):
+    """
+    Command line entry point. Writes the PIFs for each input file next to it as <name>-pif.json
+
+    :param argv: command line arguments, defaults to sys.argv[1:]
+    :return: exit status
+    """
+
+    parser = argparse.ArgumentParser(description='Converts specialized CSV/TSV or XLS/XLSX files to physical information files.')
+    parser.add_argument('files', nargs='+', help='CSV, TSV, XLS or XLSX files to convert')
+    parser.add_argument('-s', '--sheet', action='append', dest='sheets',
+                        help='Name of a workbook sheet to convert, may be repeated (default: every sheet)')
+    parser.add_argument('-w', '--workers', type=int, default=1,
+                        help='Number of worker processes. Use 0 for one per CPU (default: 1)')
+    parser.add_argument('--unordered', action='store_true',
+                        help='With several workers, write files in the order they finish rather than the order given')
+    parser.add_argument('--chunk-size', type=int,
+                        help='With several workers, split each file into blocks of this many rows across the workers '
+                             'instead of converting one file per worker')
+    parser.add_argument('--row-index', action='store_true',
+                        help='With --chunk-size, split CSV/TSV files by the byte ranges of a row index so that the '
+                             'workers read their rows from the file')
+    parser.add_argument('-f', '--format', choices=['json', 'jsonl'], default='json',
+                        help='Write a JSON array or one PIF per line (default: json)')
+    parser.add_argument('-z', '--gzip', action='store_true', help='Gzip the output files')
+    parser.add_argument('--flush-every', type=int, default=1000,
+                        help='Flush the output after this many PIFs (default: 1000)')
+    parser.add_argument('--plan-cache', metavar='DIR',
+                        help='Directory of an on-disk header plan cache shared by the workers and later runs')
+    parser.add_argument('--output-cache', metavar='DIR',
+                        help='Directory of an on-disk cache of converted files, so that files converted before are '
+                             'not parsed again (requires --workers 1)')
+    parser.add_argument('--output-cache-size', type=parse_size, default='1G',
+                        help='Size the output cache is pruned to, in bytes or with a K, M or G suffix (default: 1G)')
+    parser.add_argument('--merge-on', choices=sorted(MERGE_KEYS),
+                        help='Merge the rows sharing a name or uid into one PIF')
+    parser.add_argument('--merge-sorted', action='store_true',
+                        help='With --merge-on, the rows to merge are consecutive, merge them in one streaming pass')
+    parser.add_argument('--profile', action='store_true',
+                        help='Print the time spent in each conversion stage after the run (requires --workers 1)')
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(format='%(message)s')
+
+    if args.profile and args.workers != 1:
+        parser.error('--profile requires --workers 1')
+
+    if args.output_cache and args.workers != 1:
+        parser.error('--output-cache requires --workers 1')
+
+    if args.merge_on and args.workers != 1:
+        parser.error('--merge-on requires --workers 1')
+
+    def write(pifs, f):
+        with open_output(_output_path(f, args.format, args.gzip), args.gzip) as output_file:
+            write_pifs(pifs, output_file, args.format, args.flush_every, indent=2 if args.format == 'json' else None)
+
+    if args.workers == 1:
+        stats = ConversionStats() if args.profile else None
+        output_cache = OutputCache(args.output_cache, args.output_cache_size) if args.output_cache else None
+        start = timer()
+
+        for f in args.files:
+            write(convert(files=[f], sheets=args.sheets, stats=stats, plan_cache=get_plan_cache(args.plan_cache),
+                          output_cache=output_cache, merge_on=args.merge_on, merge_sorted=args.merge_sorted), f)
+
+        if stats is not None:
+            elapsed = timer() - start
+            sys.stderr.write(stats.report() + '\n')
+            sys.stderr.write('{:.4f}s in conversion stages, {:.4f}s total including writing the output\n'.format(
+                stats.seconds, elapsed))
+            if output_cache is not None:
+                sys.stderr.write('Output cache: {} hits, {} misses\n'.format(output_cache.hits, output_cache.misses))
+
+        return 0
+
+    from csv_template_ingester.parallel import convert_many, convert_file_parallel
+
+    workers = args.workers or None
+
+    if args.chunk_size:
+        for f in args.files:
+            write(convert_file_parallel(f, workers=workers, chunk_size=args.chunk_size, sheets=args.sheets,
+                                        plan_cache_dir=args.plan_cache, use_index=args.row_index), f)
+
+        return 0
+
+    status = 0
+    for result in convert_many(args.files, workers=workers, ordered=not args.unordered, sheets=args.sheets,
+                               plan_cache_dir=args.plan_cache):
+        if result.error:
+            sys.stderr.write('Unable to convert {}: {}\n'.format(result.path, result.error))
+            status = 1
+            continue
+
+        write(result.pifs, result.path)
+
+    return status
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,393 @@
+# coding: utf-8
+"""
+Builds PIFs as plain dictionaries straight from a header plan, without going through the pypif object model.
+
+The dictionaries are the ones ChemicalSystem.as_dictionary() gives for the same row: every field handler here
+follows the grouping and validation rules of its pypif counterpart in template_csv_parser. pypif's own type
+checks on attribute values are not repeated. Rows are decoded and written to their systems by the same decode_cells
+and fill_systems as create_pif, only the field handlers differ; tests/test_convert.py checks both sets of handlers
+against each other on random tables.
+"""
+from pypif.obj import Person
+from csv_template_ingester.template_csv_parser import *
+
+# Attributes that can be read from a pypif Person, used to mirror getattr on an existing contact
+PERSON_FIELDS = frozenset(attribute.lstrip('_') for attribute in Person().__dict__)
+
+
+def _new_system():
+    return {'category': 'system.chemical'}
+
+
+def _last_property(systm, message):
+    """
+    Gets the last property of a system for a detail column
+
+    :param systm: system dictionary
+    :param message: error message if the system has no property yet
+    :return: property dictionary
+    """
+
+    if not systm.get('properties'):
+        raise ValueError(message)
+
+    return systm['properties'][-1]
+
+
+def _value(cell, names, units, column_index):
+    value = {}
+    if names[column_index]:
+        value['name'] = names[column_index]
+    value['scalars'] = listify(cell)
+    if units[column_index]:
+        value['units'] = units[column_index]
+
+    return value
+
+
+def _formula_field(systm, cell, names, units, column_index, all_condition):
+    if systm.get('chemicalFormula'):
+        raise ValueError(
+            'You are attempting to add a chemical formula to a system that already has one. Each ChemicalSystem can only have 1 formula.\n')
+    elif isinstance(cell, list):
+        raise ValueError('You are trying to add multiple formulas to a system. Each ChemicalSystem can only have 1 formula')
+    elif cell:
+        systm['chemicalFormula'] = cell
+
+
+def _uid_field(systm, cell, names, units, column_index, all_condition):
+    if systm.get('uid'):
+        raise ValueError(
+            'You are attempting to add a UID to a system that already has one. Each system can only have 1 UID.\n')
+    elif isinstance(cell, list):
+        raise ValueError('You are trying to add multiple UIDs to a system. Each ChemicalSystem can only have 1 UID')
+    elif cell:
+        systm['uid'] = re.sub(r'\W', '', cell)
+        warn(MANUAL_UIDS)
+
+
+def _name_field(systm, cell, names, units, column_index, all_condition):
+    if cell and cell != '[]':
+        if systm.get('names'):
+            systm['names'].extend(listify(cell))
+        else:
+            systm['names'] = listify(cell)
+
+
+def _contact_field(systm, cell, names, units, column_index, all_condition, field=None):
+    if not cell:
+        return
+
+    if field is None:
+        field = normalize(names[column_index])
+    contacts = systm.get('contacts')
+
+    if contacts:
+        last_person = contacts[-1]
+        if field not in PERSON_FIELDS:
+            raise AttributeError("'Person' object has no attribute '{}'".format(field))
+
+        if not last_person.get(field):
+            last_person[field] = cell
+            return
+
+    person = {field: cell} if field in RECOGNIZED_CONTACT_FIELDS else {'name': cell}
+    systm.setdefault('contacts', []).append(person)
+
+
+def _file_field(systm, cell, names, units, column_index, all_condition):
+    if not names[column_index]:
+        raise ValueError(
+            'No file name has been specified for column: %s. Every files column must have a name provided in the header row.\n' % (
+                column_index + 1))
+
+    ext = cell.split('.')[-1]
+    if cell:
+        mt = 'image' if ext.lower() in ['tif', 'jpg', 'png'] else 'file'
+        prop = {'name': names[column_index], 'files': [{'relativePath': cell, 'mimeType': '%s/%s' % (mt, ext)}]}
+        systm.setdefault('properties', []).append(prop)
+
+
+def _identifier_field(systm, cell, names, units, column_index, all_condition):
+    if cell:
+        systm.setdefault('ids', []).append({'name': names[column_index] or 'ID', 'value': cell})
+
+
+def _classification_field(systm, cell, names, units, column_index, all_condition):
+    if cell:
+        systm.setdefault('classifications', []).append({'name': names[column_index] or 'Classification',
+                                                        'value': cell})
+
+
+def _property_field(systm, cell, names, units, column_index, all_condition):
+    if not names[column_index]:
+        raise ValueError(
+            'No property name has been specified for column: %s. Every property column must have a name provided in the header row.\n' % (
+                column_index + 1))
+
+    if not cell:
+        return
+
+    prop = {'name': names[column_index]}
+
+    min_max = RANGE_PATTERN.match(cell) if isinstance(cell, str) else None
+    if min_max:
+        minimum = float(min_max.group('min'))
+        maximum = float(min_max.group('max'))
+        if minimum > maximum:
+            raise ValueError("Minimum ({}) cannot be greater than maximum ({})".format(minimum, maximum))
+        prop['scalars'] = [{'minimum': minimum, 'maximum': maximum}]
+    else:
+        prop['scalars'] = listify(cell)
+
+    if units[column_index]:
+        prop['units'] = units[column_index]
+
+    systm.setdefault('properties', []).append(prop)
+
+
+def _condition_field(systm, cell, names, units, column_index, all_condition):
+    if cell:
+        if not systm.get('properties'):
+            raise ValueError(CONDITION_BEFORE_PROPERTY)
+
+        if not names[column_index]:
+            raise ValueError(
+                'No condition name has been specified for column: %s. Conditions must have a name specified in the header row.\n' % (
+                    column_index + 1))
+
+        systm['properties'][-1].setdefault('conditions', []).append(_value(cell, names, units, column_index))
+
+
+def _all_condition_field(systm, cell, names, units, column_index, all_condition):
+    if cell:
+        all_condition.append(_value(cell, names, units, column_index))
+
+
+def _method_field(systm, cell, names, units, column_index, all_condition):
+    if cell:
+        prop = _last_property(systm, METHOD_BEFORE_PROPERTY)
+        prop.setdefault('methods', []).append({'name': cell})
+
+
+def _display_item(systm, cell, source_type, key, message):
+    reference = _last_property(systm, message).setdefault('references', [{}])[0]
+    reference.setdefault(source_type, {})[key] = cell
+
+
+def _figure_number_field(systm, cell, names, units, column_index, all_condition):
+    if cell:
+        _display_item(systm, cell, 'figure', 'number', NUMBER_BEFORE_PROPERTY)
+
+
+def _figure_caption_field(systm, cell, names, units, column_index, all_condition):
+    if cell:
+        _display_item(systm, cell, 'figure', 'caption', CAPTION_BEFORE_PROPERTY)
+
+
+def _table_number_field(systm, cell, names, units, column_index, all_condition):
+    if cell:
+        _display_item(systm, cell, 'table', 'number', NUMBER_BEFORE_PROPERTY)
+
+
+def _table_caption_field(systm, cell, names, units, column_index, all_condition):
+    if cell:
+        _display_item(systm, cell, 'table', 'caption', CAPTION_BEFORE_PROPERTY)
+
+
+def _datatype_field(systm, cell, names, units, column_index, all_condition):
+    if cell:
+        prop = _last_property(systm, DATATYPE_BEFORE_PROPERTY)
+        prop['dataType'] = cell
+
+
+def _preparation_step_field(systm, cell, names, units, column_index, all_condition):
+    systm.setdefault('preparation', []).append({'name': cell})
+
+
+def _preparation_step_detail_field(systm, cell, names, units, column_index, all_condition):
+    if cell:
+        if not systm.get('preparation'):
+            raise ValueError(DETAIL_BEFORE_STEP)
+
+        if not names[column_index]:
+            raise ValueError(
+                'No preparation step detail name has been specified for column: %s. Preparation step details mst have a name specified in the header row.\n' % (
+                    column_index + 1))
+
+        systm['preparation'][-1].setdefault('details', []).append(_value(cell, names, units, column_index))
+
+
+def _reference_field(systm, cell, names, units, column_index, all_condition, field=None):
+    if not cell:
+        return
+
+    if field is None:
+        field = normalize(names[column_index])
+    references = systm.get('references')
+
+    if not references:
+        systm['references'] = [{field if field in RECOGNIZED_REFERENCE_FIELDS else 'citation': cell}]
+        return
+
+    new_reference = {}
+    if field in RECOGNIZED_REFERENCE_FIELDS:
+        if not references[-1].get(field):
+            references[-1][field] = cell
+        else:
+            new_reference[field] = cell
+
+    references.append(new_reference)
+
+
+def _composition(systm, cell, names, units, column_index, atomic_key, weight_key):
+    if cell:
+        if not names[column_index]:
+            raise ValueError('No element has been specified in column: %s' % column_index)
+
+        unit = units[column_index]
+        if 'atomic' in unit or 'at' in unit:
+            key = atomic_key
+        elif 'weight' in unit or 'wt' in unit:
+            key = weight_key
+        else:
+            raise ValueError('Please specify atomic or weight percent for the composition in column: %s\n' % column_index)
+
+        systm.setdefault('composition', []).append({'element': names[column_index], key: cell})
+
+
+def _ideal_composition_field(systm, cell, names, units, column_index, all_condition):
+    _composition(systm, cell, names, units, column_index, 'idealAtomicPercent', 'idealWeightPercent')
+
+
+def _actual_composition_field(systm, cell, names, units, column_index, all_condition):
+    _composition(systm, cell, names, units, column_index, 'actualAtomicPercent', 'actualWeightPercent')
+
+
+def _quantity(systm, cell, units, column_index, prefix):
+    if cell:
+        unit = units[column_index]
+        if 'mass' in unit:
+            key = prefix + 'MassPercent'
+        elif 'volume' in unit:
+            key = prefix + 'VolumePercent'
+        elif 'number' in unit:
+            key = prefix + 'NumberPercent'
+        else:
+            raise ValueError('Please specify mass, volume or number percent for the quantity in column: %s\n' % column_index)
+
+        systm['quantity'] = {key: {'value': cell}}
+
+
+def _ideal_quantity_field(systm, cell, names, units, column_index, all_condition):
+    _quantity(systm, cell, units, column_index, 'ideal')
+
+
+def _actual_quantity_field(systm, cell, names, units, column_index, all_condition):
+    _quantity(systm, cell, units, column_index, 'actual')
+
+
+# Dictionary field handlers keyed by field, with the same signature as FIELD_HANDLERS
+DICT_FIELD_HANDLERS = {
+    'formula': _formula_field,
+    'uid': _uid_field,
+    'name': _name_field,
+    'contact': _contact_field,
+    'file': _file_field,
+    'identifier': _identifier_field,
+    'classification': _classification_field,
+    'property': _property_field,
+    'condition': _condition_field,
+    'allcondition': _all_condition_field,
+    'method': _method_field,
+    'figurenumber': _figure_number_field,
+    'figurecaption': _figure_caption_field,
+    'tablenumber': _table_number_field,
+    'tablecaption': _table_caption_field,
+    'datatype': _datatype_field,
+    'preparationstepname': _preparation_step_field,
+    'preparationstepdetail': _preparation_step_detail_field,
+    'reference': _reference_field,
+    'idealcomposition': _ideal_composition_field,
+    'actualcomposition': _actual_composition_field,
+    'idealquantity': _ideal_quantity_field,
+    'actualquantity': _actual_quantity_field,
+}
+
+
+def get_dict_handlers(plan):
+    """
+    Resolves the dictionary field handlers for a header plan
+
+    :param plan: HeaderPlan
+    :return: tuple of dictionary field handlers, indexed by column
+    """
+
+    return tuple(bind_slot(DICT_FIELD_HANDLERS.get(field), slot) for field, slot in zip(plan.fields, plan.slots))
+
+
+def format_main_prop_dicts(properties, all_condition):
+    """
+    Format property dictionaries and add all_conditions to every property, as format_main_prop does
+
+    :param properties: list of property dictionaries
+    :param all_condition: list of condition dictionaries
+    :return: updated property list
+    """
+
+    properties = [prop for prop in properties if prop.get('scalars') != [''] or prop.get('files')]
+
+    if all_condition:
+        for prop in properties:
+            if prop.get('conditions'):
+                prop['conditions'].extend(all_condition)
+            else:
+                prop['conditions'] = list(all_condition)
+
+    return properties
+
+
+def create_pif_dict(plan, row, dict_handlers=None):
+    """
+    Creates the dictionary form of the PIF for a table row, equal to create_pif(plan, row).as_dictionary()
+
+    :param plan: HeaderPlan compiled from the header row
+    :param row: the row of data
+    :param dict_handlers: dictionary field handlers from get_dict_handlers, resolved from the plan if not given
+    :return: dictionary of the ChemicalSystem containing the data from that row
+    """
+
+    return fill_pif_dict(plan, decode_cells(plan.handlers, plan.systs, row, row_columns(plan, row)), dict_handlers)
+
+
+def fill_pif_dict(plan, values, dict_handlers=None):
+    """
+    Creates the dictionary form of the PIF for the decoded values of a table row
+
+    :param plan: HeaderPlan compiled from the header row
+    :param values: list of (column index, value, fills) tuples from decode_cells
+    :param dict_handlers: dictionary field handlers from get_dict_handlers, resolved from the plan if not given
+    :return: dictionary of the ChemicalSystem containing the data from that row
+    """
+
+    if dict_handlers is None:
+        dict_handlers = get_dict_handlers(plan)
+
+    filled = {}
+    sys_dict, all_condition = fill_systems(values, dict_handlers, plan.names, plan.units, plan.systs, {}, filled,
+                                           _new_system)
+
+    main_system = sys_dict['main']
+    main_system['subSystems'] = []
+
+    if main_system.get('properties'):
+        main_system['properties'] = format_main_prop_dicts(main_system['properties'], all_condition)
+
+    if main_system.get('preparation'):
+        main_system['preparation'] = [step for step in main_system['preparation'] if step['name'] != '']
+
+    for item in sys_dict:
+        if item != 'main' and filled.get(item):
+            main_system['subSystems'].append(sys_dict[item])
+
+    return main_system
@@ -0,0 +1,151 @@
+# coding: utf-8
+"""
+Group-by merge of the PIFs of rows describing the same sample. The rows of a group are merged into the PIF of the
+first row of the group, with their properties merged by property_merge.
+"""
+import heapq
+import io
+import json
+import os
+import shutil
+import tempfile
+from itertools import groupby
+from pypif import pif
+from pif_csv_utils.pif_utils import property_merge
+
+STRING_TYPES = (type(b''), type(u''))
+
+
+def _text(value):
+    return value if isinstance(value, STRING_TYPES) else str(value)
+
+
+# Functions giving the key a PIF is grouped by, a tuple of strings so that keys sort. PIFs with an empty key are not
+# merged.
+MERGE_KEYS = {
+    'name': lambda system: tuple(_text(name) for name in system.names or ()),
+    'uid': lambda system: (_text(system.uid),) if system.uid else (),
+}
+
+# Number of rows held in memory when merging unsorted input before they are sorted and spilled to disk
+MERGE_BUFFER_ROWS = 100000
+
+
+def merge_group(systems):
+    """
+    Merges the PIFs of a group
+
+    :param systems: list of the PIFs of the group, in row order
+    :return: the first PIF, with the properties of every PIF merged into it
+    """
+
+    merged = systems[0]
+    if len(systems) > 1:
+        merged.properties = property_merge([prop for system in systems for prop in system.properties or ()])
+
+    return merged
+
+
+def merge_pifs(systems, merge_on, presorted=False, buffer_rows=MERGE_BUFFER_ROWS):
+    """
+    Merges PIFs that share a name or uid
+
+    :param systems: iterable of PIFs
+    :param merge_on: 'name' or 'uid'
+    :param presorted: True if the rows of each group are consecutive, they are then merged in one streaming pass in
+        the order of the input. Otherwise the groups are yielded in the order of their keys, and buffer_rows rows at a
+        time are sorted and spilled to disk
+    :param buffer_rows: number of rows held in memory before spilling to disk, for unsorted input
+    :return: yields the merged PIFs
+    """
+
+    if merge_on not in MERGE_KEYS:
+        raise ValueError('Can only merge on {}, not {}'.format(' or '.join(sorted(MERGE_KEYS)), merge_on))
+
+    get_key = MERGE_KEYS[merge_on]
+
+    if presorted:
+        for key, group in groupby(systems, get_key):
+            if key:
+                yield merge_group(list(group))
+            else:
+                for system in group:
+                    yield system
+        return
+
+    for system in _merge_unsorted(systems, get_key, buffer_rows):
+        yield system
+
+
+def _merge_unsorted(systems, get_key, buffer_rows):
+    """
+    Groups PIFs in memory, spilling sorted runs to disk once buffer_rows are held and merging the runs back with
+    an external merge sort
+
+    :return: yields the merged PIFs, PIFs with an empty key first as they come
+    """
+
+    groups = {}
+    buffered = 0
+    directory = None
+    runs = []
+
+    try:
+        for sequence, system in enumerate(systems):
+            key = get_key(system)
+            if not key:
+                yield system
+                continue
+
+            groups.setdefault(key, []).append((sequence, system))
+            buffered += 1
+
+            if buffered >= buffer_rows:
+                if directory is None:
+                    directory = tempfile.mkdtemp(prefix='pif-merge-')
+                runs.append(_spill(groups, directory, len(runs)))
+                groups = {}
+                buffered = 0
+
+        if not runs:
+            for key in sorted(groups):
+                yield merge_group([system for sequence, system in groups[key]])
+            return
+
+        if groups:
+            runs.append(_spill(groups, directory, len(runs)))
+            groups = {}
+
+        entries = heapq.merge(*[_read_run(path) for path in runs])
+        for key, group in groupby(entries, lambda entry: entry[0]):
+            yield merge_group([pif.loado(pif_dict) for key, sequence, pif_dict in group])
+    finally:
+        if directory is not None:
+            shutil.rmtree(directory, ignore_errors=True)
+
+
+def _spill(groups, directory, number):
+    """
+    Writes buffered groups to a run file, sorted by key and row
+
+    :return: path of the run file
+    """
+
+    path = os.path.join(directory, 'run-{}.jsonl'.format(number))
+    with io.open(path, 'w', encoding='utf-8') as run_file:
+        for key in sorted(groups):
+            for sequence, system in groups[key]:
+                run_file.write(u'{}\n'.format(json.dumps([list(key), sequence, system.as_dictionary()])))
+
+    return path
+
+
+def _read_run(path):
+    """
+    :return: yields (key, row sequence, PIF dictionary) for the entries of a run file, in order
+    """
+
+    with io.open(path, 'r', encoding='utf-8') as run_file:
+        for line in run_file:
+            key, sequence, pif_dict = json.loads(line)
+            yield tuple(key), sequence, pif_dict
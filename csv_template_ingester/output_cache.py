@@ -0,0 +1,245 @@
+# coding: utf-8
+"""
+Cache of the PIFs converted from whole files, keyed by a hash of the file content and the converter version, so
+that converting a byte-identical file again streams the PIFs back from disk instead of parsing the file.
+
+    python -m csv_template_ingester.output_cache DIR --max-size 500M
+"""
+import argparse
+import hashlib
+import io
+import json
+import os
+import sys
+import tempfile
+from collections import OrderedDict
+from pif_csv_utils.file_utils import _dialect_cache_key
+from csv_template_ingester.template_csv_parser import HEADER_PARSER_VERSION
+
+# Part of every cache key, bump when the PIFs converted from the same file change
+CONVERTER_VERSION = 3
+
+DEFAULT_MAX_BYTES = 1024 * 1024 * 1024
+
+ENTRY_SUFFIX = '.jsonl'
+
+HASH_BLOCK_SIZE = 1024 * 1024
+
+_CONTENT_HASHES = OrderedDict()
+
+CONTENT_HASH_CACHE_SIZE = 256
+
+
+def content_hash(file_path):
+    """
+    Hash of the content of a file, remembered until the file changes
+
+    :param file_path: path of the file
+    :return: hex digest of the file content
+    """
+
+    key = _dialect_cache_key(file_path)
+    digest = _CONTENT_HASHES.get(key)
+    if digest is not None:
+        return digest
+
+    content = hashlib.sha1()
+    with io.open(file_path, 'rb') as input_file:
+        for block in iter(lambda: input_file.read(HASH_BLOCK_SIZE), b''):
+            content.update(block)
+    digest = content.hexdigest()
+
+    _CONTENT_HASHES[key] = digest
+    if len(_CONTENT_HASHES) > CONTENT_HASH_CACHE_SIZE:
+        _CONTENT_HASHES.popitem(last=False)
+
+    return digest
+
+
+class OutputCache(object):
+    """
+    Directory of the serialized PIFs of converted files, one JSON lines file per conversion. An entry only appears
+    once its conversion has finished, through a rename, so processes can share the directory. Reading an entry
+    marks it as used; the least recently used entries are pruned once the directory holds more than max_bytes.
+    """
+
+    def __init__(self, directory, max_bytes=DEFAULT_MAX_BYTES):
+        """
+        Constructor.
+
+        :param directory: directory of the entries, created if missing
+        :param max_bytes: size of the entries above which the least recently used ones are pruned
+        """
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+
+        if not os.path.isdir(directory):
+            try:
+                os.makedirs(directory)
+            except OSError:
+                if not os.path.isdir(directory):
+                    raise
+
+    def key(self, file_path, cell_limit=None, sheets=None, rows=None):
+        """
+        Key of the conversion of a file
+
+        :param file_path: path of the file
+        :param cell_limit: cell limit of the conversion
+        :param sheets: sheets converted
+        :param rows: slice of the rows converted
+        :return: hex digest of the file content, the file type, the converter versions and the options
+        """
+
+        if rows is not None:
+            rows = [rows.start, rows.stop, rows.step]
+
+        raw = json.dumps([CONVERTER_VERSION, HEADER_PARSER_VERSION, content_hash(file_path),
+                          file_path.rpartition('.')[-1], cell_limit,
+                          None if sheets is None else [str(sheet) for sheet in sheets], rows])
+
+        return hashlib.sha1(raw.encode('utf-8')).hexdigest()
+
+    def _path(self, key):
+        return os.path.join(self.directory, key + ENTRY_SUFFIX)
+
+    def get(self, key):
+        """
+        Opens an entry, counting a hit or a miss
+
+        :param key: key of the conversion
+        :return: file of the serialized PIFs one per line, None on a miss
+        """
+
+        path = self._path(key)
+        try:
+            entry_file = io.open(path, 'r', encoding='utf-8')
+        except (IOError, OSError):
+            self.misses += 1
+            return None
+
+        self.hits += 1
+        try:
+            os.utime(path, None)
+        except OSError:
+            pass
+
+        return entry_file
+
+    def put(self, key, serialized):
+        """
+        Writes an entry as the serialized PIFs stream through. The entry is only stored if every item is consumed;
+        an error or a consumer that stops early discards it.
+
+        :param key: key of the conversion
+        :param serialized: iterable of (item, serialized PIF) tuples
+        :return: yields the items
+        """
+
+        descriptor, temp_path = tempfile.mkstemp(dir=self.directory, suffix='.tmp')
+        try:
+            with io.open(descriptor, 'w', encoding='utf-8') as temp_file:
+                for item, text in serialized:
+                    temp_file.write(text + u'\n')
+                    yield item
+            os.rename(temp_path, self._path(key))
+        finally:
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+
+        self.prune()
+
+    def entries(self):
+        """
+        :return: list of (last used time, size, path) of the entries, least recently used first
+        """
+
+        entries = []
+        for name in os.listdir(self.directory):
+            if not name.endswith(ENTRY_SUFFIX):
+                continue
+            path = os.path.join(self.directory, name)
+            try:
+                stat = os.stat(path)
+            except OSError:
+                continue
+            entries.append((stat.st_mtime, stat.st_size, path))
+
+        return sorted(entries)
+
+    @property
+    def size(self):
+        """
+        :return: number of bytes of the entries
+        """
+        return sum(size for used, size, path in self.entries())
+
+    def prune(self, max_bytes=None):
+        """
+        Deletes the least recently used entries until the entries take at most max_bytes
+
+        :param max_bytes: size to prune to, defaults to the max_bytes of the cache
+        :return: number of entries deleted
+        """
+
+        if max_bytes is None:
+            max_bytes = self.max_bytes
+
+        entries = self.entries()
+        excess = sum(size for used, size, path in entries) - max_bytes
+        pruned = 0
+
+        for used, size, path in entries:
+            if excess <= 0:
+                break
+            try:
+                os.remove(path)
+            except OSError:
+                # pruned by another process
+                pass
+            excess -= size
+            pruned += 1
+
+        return pruned
+
+
+def parse_size(text):
+    """
+    :param text: number of bytes, optionally followed by K, M or G
+    :return: number of bytes
+    """
+
+    multiplier = 1
+    if text[-1:].upper() in ('K', 'M', 'G'):
+        multiplier = 1024 ** ('KMG'.index(text[-1].upper()) + 1)
+        text = text[:-1]
+
+    return int(float(text) * multiplier)
+
+
+def main(argv=None):
+    """
+    Command line entry point. Prunes a cache directory
+
+    :param argv: command line arguments, defaults to sys.argv[1:]
+    :return: exit status
+    """
+
+    parser = argparse.ArgumentParser(description='Prunes the least recently used entries of a conversion cache.')
+    parser.add_argument('directory', help='Directory of the cache')
+    parser.add_argument('--max-size', type=parse_size, default=DEFAULT_MAX_BYTES,
+                        help='Size to prune the cache to, in bytes or with a K, M or G suffix (default: 1G)')
+    parser.add_argument('--clear', action='store_true', help='Delete every entry')
+    args = parser.parse_args(argv)
+
+    cache = OutputCache(args.directory, args.max_size)
+    pruned = cache.prune(0 if args.clear else None)
+    sys.stdout.write('Pruned {} entries, {} bytes left\n'.format(pruned, cache.size))
+
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,261 @@
+# coding: utf-8
+import multiprocessing
+from collections import deque, namedtuple
+from itertools import islice
+from pypif import pif
+from csv_template_ingester.converter import convert, create_pif, read_tables, CELL_LIMIT, _check_cell_count, _select_rows, \
+    _publish_report
+from pif_csv_utils.row_index import get_row_index, read_span
+from pif_csv_utils.diagnostics import DiagnosticsReport
+from csv_template_ingester.plan_cache import get_plan_cache
+
+
+class FileResult(namedtuple('FileResult', ['path', 'pifs', 'error'])):
+    """
+    Result of converting a single file with convert_many
+
+    :param path: path of the converted file
+    :param pifs: list of serialized PIFs (JSON strings), None if the conversion failed
+    :param error: error message if the conversion failed, otherwise None
+    """
+
+    __slots__ = ()
+
+
+def _convert_file(args):
+    """
+    Converts a single file to serialized PIFs, catching any error so a bad file does not stop the other workers
+
+    :param args: tuple of (file path, cell limit, sheets, plan cache directory)
+    :return: tuple of the FileResult and the DiagnosticsReport of the file
+    """
+
+    path, cell_limit, sheets, plan_cache_dir = args
+
+    reports = []
+    try:
+        pifs = [pif.dumps(system) for system in convert([path], cell_limit=cell_limit, sheets=sheets,
+                                                        plan_cache=get_plan_cache(plan_cache_dir),
+                                                        diagnostics=reports)]
+    except Exception as e:
+        return FileResult(path, None, '{}: {}'.format(type(e).__name__, e)), _file_report(path, reports)
+
+    return FileResult(path, pifs, None), _file_report(path, reports)
+
+
+def _file_report(path, reports):
+    """
+    :return: the DiagnosticsReport convert() gave for a file, an empty one if it failed before giving one
+    """
+
+    return reports[0] if reports else DiagnosticsReport(path)
+
+
+def convert_many(files, workers=None, ordered=True, cell_limit=CELL_LIMIT, sheets=None, plan_cache_dir=None,
+                 diagnostics=None):
+    """
+    Converts many files over a process pool. PIFs are passed back from the workers as serialized JSON rather than
+    pickled pypif objects; use pif.loads to get objects back.
+
+    :param files: list of files to convert
+    :param workers: number of worker processes, defaults to the number of CPUs. 1 converts in this process
+    :param ordered: yield results in the order of files if True, otherwise as soon as each file finishes
+    :param cell_limit: Max number of cells (rows * columns) allowed per table
+    :param sheets: names or indices of the workbook sheets to convert, defaults to every sheet
+    :param plan_cache_dir: directory of an on-disk header plan cache shared by the workers, optional
+    :param diagnostics: optional list that the DiagnosticsReport of each file is appended to before its result is
+        yielded, as for convert(). Reports are logged in this process instead if not given
+    :return: yields a FileResult per file
+    """
+
+    tasks = ((f, cell_limit, sheets, plan_cache_dir) for f in files)
+
+    if workers == 1:
+        for task in tasks:
+            result, report = _convert_file(task)
+            _publish_report(report, diagnostics)
+            yield result
+        return
+
+    pool = multiprocessing.Pool(workers)
+    try:
+        results = pool.imap(_convert_file, tasks) if ordered else pool.imap_unordered(_convert_file, tasks)
+        for result, report in results:
+            _publish_report(report, diagnostics)
+            yield result
+        pool.close()
+    finally:
+        pool.terminate()
+        pool.join()
+
+
+class RowSpan(namedtuple('RowSpan', ['path', 'dialect', 'start', 'end', 'row_number'])):
+    """
+    Block of rows given by its byte range in a file, read by the worker through a memory map
+
+    :param path: path of the csv or tsv file
+    :param dialect: TableDialect of the file
+    :param start: byte offset of the first row
+    :param end: byte offset after the last row
+    :param row_number: number of the first row, the header row being row 0
+    """
+
+    __slots__ = ()
+
+
+class ChunkResult(namedtuple('ChunkResult', ['pifs', 'report'])):
+    """
+    Result of converting a block of rows in a worker
+
+    :param pifs: list of serialized PIFs (JSON strings) in row order
+    :param report: DiagnosticsReport of the block, with the row numbers of the file
+    """
+
+    __slots__ = ()
+
+
+def _convert_chunk(args):
+    """
+    Converts a block of rows to serialized PIFs
+
+    :param args: tuple of (HeaderPlan, list of (row number, row) tuples or RowSpan)
+    :return: ChunkResult
+    """
+
+    plan, rows = args
+
+    if isinstance(rows, RowSpan):
+        rows = [(i, row) for i, row in enumerate(read_span(rows.path, rows.dialect, rows.start, rows.end),
+                                                 rows.row_number) if any(row)]
+
+    report = DiagnosticsReport()
+    pifs = []
+    try:
+        for i, row in rows:
+            report.activate(i)
+            pifs.append(pif.dumps(create_pif(plan, row)))
+            report.deactivate()
+    finally:
+        report.deactivate()
+
+    return ChunkResult(pifs, report)
+
+
+def _read_blocks(f, chunk_size, cell_limit, sheets, plan_cache=None):
+    """
+    Reads the rows of a file in blocks, each paired with the header plan of its table
+
+    :param f: path of the file to read
+    :param chunk_size: number of rows per block
+    :param cell_limit: Max number of cells (rows * columns) allowed per table
+    :param sheets: names or indices of the workbook sheets to read
+    :param plan_cache: HeaderPlanCache to get header plans from, defaults to the in-memory cache of the process
+    :return: yields tuples of (HeaderPlan, list of (row number, row) tuples)
+    """
+
+    if plan_cache is None:
+        plan_cache = get_plan_cache()
+
+    for rows in read_tables(f, cell_limit, sheets):
+        header = next(rows, None)
+        if header is None:
+            continue
+
+        plan = plan_cache.get_plan(header[1])
+
+        for chunk in iter(lambda: list(islice(rows, chunk_size)), []):
+            yield plan, chunk
+
+
+def _index_blocks(f, chunk_size, cell_limit, plan_cache=None, index_sidecar=False):
+    """
+    Splits the rows of a csv or tsv file into blocks by their byte ranges in a row index, so that the rows are read
+    by the workers rather than copied to them
+
+    :param f: path of the file to read
+    :param chunk_size: number of rows per block
+    :param cell_limit: Max number of cells (rows * columns) allowed
+    :param plan_cache: HeaderPlanCache to get header plans from, defaults to the in-memory cache of the process
+    :param index_sidecar: keep the row index in a .rowidx file next to the file
+    :return: yields tuples of (HeaderPlan, RowSpan)
+    """
+
+    if plan_cache is None:
+        plan_cache = get_plan_cache()
+
+    with get_row_index(f, '\t' if f.endswith('.tsv') else None, index_sidecar) as index:
+        header = next(_select_rows(index.read_rows, len(index), slice(0, 0), cell_limit), None)
+        if header is None:
+            return
+
+        _check_cell_count(len(index) - 1, len(header[1]), cell_limit)
+
+        plan = plan_cache.get_plan(header[1])
+
+        for start in range(header[0] + 1, len(index), chunk_size):
+            yield plan, RowSpan(f, index.dialect, *index.span(start, min(start + chunk_size, len(index))),
+                                row_number=start)
+
+
+def convert_file_parallel(f, workers=None, chunk_size=1000, max_pending=None, cell_limit=CELL_LIMIT, sheets=None,
+                          plan_cache_dir=None, use_index=False, index_sidecar=False, diagnostics=None):
+    """
+    Converts a single file by shipping blocks of rows, together with the compiled header plan, to a process pool.
+    Output keeps the original row order: at most max_pending blocks are in flight, and they are yielded strictly
+    in the order they were read.
+
+    :param f: path of the file to convert
+    :param workers: number of worker processes, defaults to the number of CPUs. 1 converts in this process
+    :param chunk_size: number of rows per block. Smaller blocks give the first PIF sooner, larger ones less overhead
+    :param max_pending: max number of blocks in flight or waiting to be yielded, defaults to twice the workers
+    :param cell_limit: Max number of cells (rows * columns) allowed per table
+    :param sheets: names or indices of the workbook sheets to convert, defaults to every sheet
+    :param plan_cache_dir: directory of an on-disk header plan cache, optional
+    :param use_index: for csv and tsv files, build a row index and ship the byte range of each block instead of its
+        rows. The whole file is checked against the cell limit before any block is converted
+    :param index_sidecar: with use_index, keep the row index in a .rowidx file next to the file
+    :param diagnostics: optional list that the DiagnosticsReport of the file, merged from the reports of its blocks,
+        is appended to once the file is done, as for convert(). The report is logged instead if not given
+    :return: yields serialized PIFs (JSON strings) in row order
+    """
+
+    if use_index and f.endswith(('.csv', '.tsv')):
+        blocks = _index_blocks(f, chunk_size, cell_limit, get_plan_cache(plan_cache_dir), index_sidecar)
+    else:
+        blocks = _read_blocks(f, chunk_size, cell_limit, sheets, get_plan_cache(plan_cache_dir))
+
+    report = DiagnosticsReport(f)
+    try:
+        if workers == 1:
+            for block in blocks:
+                result = _convert_chunk(block)
+                report.merge(result.report)
+                for serialized in result.pifs:
+                    yield serialized
+            return
+
+        pool = multiprocessing.Pool(workers)
+        max_pending = max_pending or 2 * (workers or multiprocessing.cpu_count())
+        pending = deque()
+        try:
+            for block in blocks:
+                pending.append(pool.apply_async(_convert_chunk, (block,)))
+
+                if len(pending) >= max_pending:
+                    result = pending.popleft().get()
+                    report.merge(result.report)
+                    for serialized in result.pifs:
+                        yield serialized
+
+            while pending:
+                result = pending.popleft().get()
+                report.merge(result.report)
+                for serialized in result.pifs:
+                    yield serialized
+
+            pool.close()
+        finally:
+            pool.terminate()
+            pool.join()
+    finally:
+        _publish_report(report, diagnostics)
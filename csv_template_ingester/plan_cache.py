@@ -0,0 +1,162 @@
+# coding: utf-8
+import hashlib
+import json
+import os
+import tempfile
+from collections import OrderedDict
+from csv_template_ingester.template_csv_parser import *
+
+
+class HeaderPlanCache(object):
+    """
+    Cache of header plans keyed by a hash of the raw header row. Plans are kept in memory with least recently used
+    eviction, and optionally in a directory shared by pool workers and later runs. Entries written by another
+    HEADER_PARSER_VERSION are ignored and rebuilt.
+    """
+
+    def __init__(self, maxsize=128, directory=None):
+        """
+        Constructor.
+
+        :param maxsize: number of plans kept in memory
+        :param directory: optional directory for the on-disk store, created if missing
+        """
+        self.maxsize = maxsize
+        self.directory = directory
+        self.plans = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+        if directory is not None and not os.path.isdir(directory):
+            try:
+                os.makedirs(directory)
+            except OSError:
+                if not os.path.isdir(directory):
+                    raise
+
+    def get_plan(self, headers):
+        """
+        Gets the plan of a header row, compiling it on a miss
+
+        :param headers: list of header values
+        :return: HeaderPlan for the header row
+        """
+
+        headers = list(headers)
+        key = header_key(headers)
+
+        plan = self.plans.pop(key, None)
+        if plan is not None:
+            self.hits += 1
+        else:
+            plan = self._load(key, headers)
+            if plan is not None:
+                self.hits += 1
+            else:
+                self.misses += 1
+                plan = self._compile(key, headers)
+
+        self.plans[key] = plan
+        if len(self.plans) > self.maxsize:
+            self.plans.popitem(last=False)
+
+        return plan
+
+    def clear(self):
+        """
+        Empties the in-memory cache. The on-disk store is left as is.
+        """
+        self.plans.clear()
+
+    def _path(self, key):
+        return os.path.join(self.directory, '{}.json'.format(key))
+
+    def _load(self, key, headers):
+        """
+        :return: plan from the on-disk store, None if there is no usable entry
+        """
+
+        if self.directory is None:
+            return None
+
+        try:
+            with open(self._path(key)) as entry_file:
+                entry = json.load(entry_file)
+        except (IOError, OSError, ValueError):
+            return None
+
+        if entry.get('version') != HEADER_PARSER_VERSION or entry.get('headers') != headers:
+            return None
+
+        return build_header_plan(entry['keywords'], entry['names'], entry['units'], entry['systs'])
+
+    def _compile(self, key, headers):
+        """
+        Compiles a header row and writes the result to the on-disk store
+
+        :return: HeaderPlan for the header row
+        """
+
+        keywords, names, units, systs = get_header_info(headers)
+
+        if self.directory is not None:
+            entry = {'version': HEADER_PARSER_VERSION, 'headers': headers, 'keywords': keywords, 'names': names,
+                     'units': units, 'systs': systs}
+            try:
+                _write_atomic(self._path(key), json.dumps(entry))
+            except (IOError, OSError, TypeError, ValueError):
+                # the store is only an optimization, a header that cannot be stored is compiled again next time
+                pass
+
+        return build_header_plan(keywords, names, units, systs)
+
+
+def header_key(headers):
+    """
+    Key of a header row in the cache
+
+    :param headers: list of header values
+    :return: hex digest of the parser version and the header values
+    """
+
+    raw = json.dumps([HEADER_PARSER_VERSION, list(headers)])
+
+    return hashlib.sha1(raw.encode('utf-8')).hexdigest()
+
+
+def _write_atomic(path, text):
+    """
+    Writes a file through a temporary file in the same directory, so readers in other processes never see a
+    partial entry
+    """
+
+    descriptor, temp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix='.tmp')
+    try:
+        with os.fdopen(descriptor, 'w') as temp_file:
+            temp_file.write(text)
+        os.rename(temp_path, path)
+    except OSError:
+        os.remove(temp_path)
+        raise
+
+
+HEADER_PLAN_CACHE = HeaderPlanCache()
+
+_DIRECTORY_CACHES = {}
+
+
+def get_plan_cache(directory=None):
+    """
+    Plan cache of this process for an on-disk store
+
+    :param directory: directory of the on-disk store, None for the in-memory cache only
+    :return: HeaderPlanCache, the same instance for every call with the same directory
+    """
+
+    if directory is None:
+        return HEADER_PLAN_CACHE
+
+    if directory not in _DIRECTORY_CACHES:
+        _DIRECTORY_CACHES[directory] = HeaderPlanCache(directory=directory)
+
+    return _DIRECTORY_CACHES[directory]
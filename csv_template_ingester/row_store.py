@@ -0,0 +1,338 @@
+# coding: utf-8
+"""
+Incremental re-ingestion. Each data row is hashed together with its header row, and a local SQLite store keeps the
+serialized PIF of every row hash and the row hashes last converted from each source file. Converting a file again
+only yields the rows that are new or changed since the last run, followed by tombstones for the rows that are gone.
+"""
+import hashlib
+import json
+import os
+import sqlite3
+import time
+from collections import namedtuple
+from pypif import pif
+from csv_template_ingester.converter import create_pif, read_tables, CELL_LIMIT, _publish_report
+from csv_template_ingester.dict_builder import create_pif_dict, get_dict_handlers
+from csv_template_ingester.plan_cache import get_plan_cache, header_key
+from pif_csv_utils.diagnostics import DiagnosticsReport
+
+# Part of every row hash, bump when the PIFs built from the same row change so that stored PIFs are not reused
+ROW_STORE_VERSION = 2
+
+DEFAULT_MAX_BYTES = 256 * 1024 * 1024
+
+# Number of new PIFs held in memory before they are written to the store
+WRITE_BATCH_SIZE = 1000
+
+SCHEMA = (
+    'CREATE TABLE IF NOT EXISTS pifs (row_hash TEXT PRIMARY KEY, pif TEXT NOT NULL, size INTEGER NOT NULL, '
+    'last_used REAL NOT NULL)',
+    'CREATE INDEX IF NOT EXISTS pifs_last_used ON pifs (last_used)',
+    'CREATE TABLE IF NOT EXISTS source_rows (source TEXT NOT NULL, row_hash TEXT NOT NULL, '
+    'PRIMARY KEY (source, row_hash))',
+)
+
+
+class RowChange(namedtuple('RowChange', ['source', 'row_hash', 'row_number', 'pif'])):
+    """
+    Row yielded by convert_incremental
+
+    :param source: source key of the file the row was read from
+    :param row_hash: hash of the row and its header row
+    :param row_number: index of the row in its table, the header being row 0. None for a tombstone
+    :param pif: PIF of a new or changed row, None for a tombstone of a row that is no longer in the source
+    """
+
+    __slots__ = ()
+
+    @property
+    def removed(self):
+        return self.pif is None
+
+
+def row_hash(headers_key, row):
+    """
+    Hash of a data row
+
+    :param headers_key: header_key of the header row of the table
+    :param row: list of the cells of the row
+    :return: hex digest of the store version, the header row and the cells
+    """
+
+    raw = json.dumps([ROW_STORE_VERSION, headers_key, list(row)], default=str)
+
+    return hashlib.sha1(raw.encode('utf-8')).hexdigest()
+
+
+def source_key(path, sheets=None):
+    """
+    Key of a file in the store. Converting other sheets of a workbook is another source.
+
+    :param path: path of the file
+    :param sheets: names or indices of the workbook sheets converted, None for every sheet
+    :return: string key
+    """
+
+    key = os.path.abspath(path)
+    if sheets is not None:
+        key += '?sheets=' + json.dumps([str(sheet) for sheet in sheets])
+
+    return key
+
+
+class RowStore(object):
+    """
+    SQLite store of serialized PIFs by row hash and of the row hashes of each source. The database is opened in
+    write-ahead logging mode and every write is a short transaction, so several processes can share the store.
+    Stored PIFs are evicted least recently used first once they take more than max_bytes; the row hashes of the
+    sources are never evicted, as the tombstones are computed from them.
+    """
+
+    def __init__(self, path, max_bytes=DEFAULT_MAX_BYTES, timeout=60.0):
+        """
+        Constructor.
+
+        :param path: path of the SQLite database, created if missing
+        :param max_bytes: size of the stored PIFs above which the least recently used ones are evicted
+        :param timeout: seconds to wait for a lock held by another process
+        """
+        self.path = path
+        self.max_bytes = max_bytes
+        self.connection = sqlite3.connect(path, timeout=timeout, isolation_level=None)
+        self.connection.execute('PRAGMA journal_mode=WAL')
+        with self._transaction() as cursor:
+            for statement in SCHEMA:
+                cursor.execute(statement)
+
+    def _transaction(self):
+        return _Transaction(self.connection)
+
+    def get_pifs(self, row_hashes):
+        """
+        :param row_hashes: row hashes to look up
+        :return: dictionary of row hash to serialized PIF for the row hashes in the store
+        """
+
+        row_hashes = list(row_hashes)
+        found = {}
+        for start in range(0, len(row_hashes), 500):
+            batch = row_hashes[start:start + 500]
+            query = 'SELECT row_hash, pif FROM pifs WHERE row_hash IN ({})'.format(','.join('?' * len(batch)))
+            found.update(self.connection.execute(query, batch))
+
+        if found:
+            now = time.time()
+            with self._transaction() as cursor:
+                cursor.executemany('UPDATE pifs SET last_used = ? WHERE row_hash = ?',
+                                   ((now, key) for key in found))
+
+        return found
+
+    def put_pifs(self, items):
+        """
+        Stores serialized PIFs
+
+        :param items: iterable of (row hash, serialized PIF) tuples
+        """
+
+        now = time.time()
+        with self._transaction() as cursor:
+            cursor.executemany('INSERT OR REPLACE INTO pifs (row_hash, pif, size, last_used) VALUES (?, ?, ?, ?)',
+                               ((key, text, len(text), now) for key, text in items))
+
+    def source_hashes(self, source):
+        """
+        :param source: source key
+        :return: set of the row hashes stored for the source, empty if it was never converted
+        """
+        return set(key for key, in self.connection.execute('SELECT row_hash FROM source_rows WHERE source = ?',
+                                                           (source,)))
+
+    def replace_source(self, source, row_hashes):
+        """
+        Replaces the row hashes of a source in a single transaction
+
+        :param source: source key
+        :param row_hashes: row hashes of the source
+        """
+
+        with self._transaction() as cursor:
+            cursor.execute('DELETE FROM source_rows WHERE source = ?', (source,))
+            cursor.executemany('INSERT OR IGNORE INTO source_rows (source, row_hash) VALUES (?, ?)',
+                               ((source, key) for key in row_hashes))
+
+    def forget_source(self, source):
+        """
+        Drops the row hashes of a source, its next conversion yields every row again
+        """
+        self.replace_source(source, ())
+
+    @property
+    def size(self):
+        """
+        :return: number of bytes of stored PIFs
+        """
+        return self.connection.execute('SELECT COALESCE(SUM(size), 0) FROM pifs').fetchone()[0]
+
+    def evict(self):
+        """
+        Deletes the least recently used PIFs until the stored PIFs take at most max_bytes
+
+        :return: number of PIFs deleted
+        """
+
+        with self._transaction() as cursor:
+            excess = cursor.execute('SELECT COALESCE(SUM(size), 0) FROM pifs').fetchone()[0] - self.max_bytes
+            if excess <= 0:
+                return 0
+
+            evicted = []
+            for key, size in cursor.execute('SELECT row_hash, size FROM pifs ORDER BY last_used'):
+                evicted.append((key,))
+                excess -= size
+                if excess <= 0:
+                    break
+
+            cursor.executemany('DELETE FROM pifs WHERE row_hash = ?', evicted)
+
+        return len(evicted)
+
+    def close(self):
+        self.connection.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+class _Transaction(object):
+    """
+    Write transaction that takes the database lock up front, so that concurrent writers wait for each other
+    instead of failing on lock upgrades
+    """
+
+    def __init__(self, connection):
+        self.connection = connection
+
+    def __enter__(self):
+        self.connection.execute('BEGIN IMMEDIATE')
+        return self.connection.cursor()
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.connection.execute('COMMIT' if exc_type is None else 'ROLLBACK')
+
+
+def _deserialize(text, output):
+    return json.loads(text) if output == 'dict' else pif.loads(text)
+
+
+def _convert_source(f, store, cell_limit, sheets, output, plan_cache, report):
+    """
+    Converts the new and changed rows of one file, then records its row hashes
+
+    :param report: DiagnosticsReport of the file, collecting the diagnostics of the rows converted
+    :return: yields RowChange tuples, tombstones last
+    """
+
+    source = source_key(f, sheets)
+    previous = store.source_hashes(source)
+    current = set()
+    pending = []
+
+    def flush():
+        stored = store.get_pifs(key for key, i, row, plan, dict_handlers in pending)
+        new = []
+
+        for key, i, row, plan, dict_handlers in pending:
+            text = stored.get(key)
+            if text is not None:
+                yield RowChange(source, key, i, _deserialize(text, output))
+                continue
+
+            report.activate(i)
+            if output == 'dict':
+                pif_dict = create_pif_dict(plan, row, dict_handlers)
+                text = json.dumps(pif_dict)
+            else:
+                pif_dict = create_pif(plan, row)
+                text = pif.dumps(pif_dict)
+            report.deactivate()
+
+            new.append((key, text))
+            yield RowChange(source, key, i, pif_dict)
+
+        store.put_pifs(new)
+        del pending[:]
+
+    for table_rows in read_tables(f, cell_limit, sheets):
+        header = next(table_rows, None)
+        if header is None:
+            continue
+
+        plan = plan_cache.get_plan(header[1])
+        headers_key = header_key(header[1])
+        dict_handlers = get_dict_handlers(plan) if output == 'dict' else None
+
+        for i, row in table_rows:
+            key = row_hash(headers_key, row)
+            if key in current:
+                continue
+
+            current.add(key)
+            if key in previous:
+                continue
+
+            pending.append((key, i, row, plan, dict_handlers))
+            if len(pending) >= WRITE_BATCH_SIZE:
+                for change in flush():
+                    yield change
+
+    for change in flush():
+        yield change
+
+    for key in sorted(previous - current):
+        yield RowChange(source, key, None, None)
+
+    store.replace_source(source, current)
+    store.evict()
+
+
+def convert_incremental(files, store, cell_limit=CELL_LIMIT, sheets=None, output='pif', plan_cache=None,
+                        diagnostics=None):
+    """
+    Converts the rows of each file that are new or changed since the file was last converted with the same store.
+
+    Rows are identified by a hash of their cells and header row, so an edited row is yielded under its new hash
+    and a tombstone is yielded for its old one. Rows repeated within a file are yielded once. PIFs already in the
+    store, e.g. from another file, are read back instead of being converted again. The row hashes of a file are
+    recorded once all of its rows have been yielded, so a conversion that stops early or fails leaves the store as
+    it was and the next one yields the same rows again.
+
+    :param files: list of files to convert
+    :param store: RowStore to compare against and update
+    :param cell_limit: Max number of cells (rows * columns) allowed per table
+    :param sheets: names or indices of the workbook sheets to convert, defaults to every sheet
+    :param output: 'pif' for ChemicalSystems or 'dict' for plain dictionaries
+    :param plan_cache: HeaderPlanCache to get header plans from, defaults to the in-memory cache of the process
+    :param diagnostics: optional list that a DiagnosticsReport of each file is appended to, as for convert(). The
+        report only holds the rows converted, not the ones read back from the store. It is logged if not given
+    :return: yields a RowChange for each new or changed row of each file, followed by one with no PIF for each row
+        of the file that has been removed
+    """
+
+    if output not in ('pif', 'dict'):
+        raise ValueError('Output must be pif or dict, not {}'.format(output))
+
+    if plan_cache is None:
+        plan_cache = get_plan_cache()
+
+    for f in files:
+        report = DiagnosticsReport(f)
+        try:
+            for change in _convert_source(f, store, cell_limit, sheets, output, plan_cache, report):
+                yield change
+        finally:
+            report.deactivate()
+            _publish_report(report, diagnostics)
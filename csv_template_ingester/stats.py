@@ -0,0 +1,178 @@
+# coding: utf-8
+"""
+Per-stage timing of a conversion, collected when a ConversionStats is passed to convert().
+
+Stages are 'read' (the file reader, empty row skipping and the cell limit check), 'header' (compiling the header
+plan), 'add_fields' (filling the systems of a row), one 'field:<field>' stage per keyword handler nested in
+add_fields, 'assemble' (format_main_prop and sub-system assembly), 'build_dict' for output='dict' and 'record' for
+output='record'.
+"""
+import time
+
+timer = getattr(time, 'perf_counter', time.time)
+
+# Stages that do not overlap, their times add up to the time spent in convert()
+TOP_LEVEL_STAGES = ('read', 'header', 'add_fields', 'assemble', 'build_dict', 'record')
+
+
+class StageStats(object):
+    """
+    Totals of one stage
+    """
+
+    __slots__ = ('seconds', 'calls', 'rows', 'cells')
+
+    def __init__(self):
+        self.seconds = 0.0
+        self.calls = 0
+        self.rows = 0
+        self.cells = 0
+
+    def as_dictionary(self):
+        return {'seconds': self.seconds, 'calls': self.calls, 'rows': self.rows, 'cells': self.cells}
+
+
+class ConversionStats(object):
+    """
+    Collects wall time, call counts and row/cell counts per stage of a conversion
+    """
+
+    def __init__(self, on_stage=None):
+        """
+        Constructor.
+
+        :param on_stage: optional callable, called as on_stage(stage, seconds, rows, cells) for every timed call
+        """
+        self.on_stage = on_stage
+        self.stages = {}
+
+    def add(self, stage, seconds, rows=0, cells=0):
+        """
+        Records one timed call of a stage
+
+        :param stage: name of the stage
+        :param seconds: wall time of the call
+        :param rows: number of rows handled by the call
+        :param cells: number of cells handled by the call
+        """
+
+        totals = self.stages.get(stage)
+        if totals is None:
+            totals = self.stages[stage] = StageStats()
+
+        totals.seconds += seconds
+        totals.calls += 1
+        totals.rows += rows
+        totals.cells += cells
+
+        if self.on_stage is not None:
+            self.on_stage(stage, seconds, rows, cells)
+
+    def time_rows(self, rows):
+        """
+        Times the reading of each row of a table
+
+        :param rows: iterator of (row number, row) tuples from read_tables
+        :return: yields the same tuples
+        """
+
+        rows = iter(rows)
+        while True:
+            start = timer()
+            try:
+                i, row = next(rows)
+            except StopIteration:
+                self.add('read', timer() - start)
+                return
+            self.add('read', timer() - start, 1, len(row))
+
+            yield i, row
+
+    def time_handlers(self, handlers, fields):
+        """
+        Wraps the field handlers of a header plan so that each call is recorded as a 'field:<field>' stage
+
+        :param handlers: field handlers indexed by column, None for unknown columns
+        :param fields: canonical field of each column
+        :return: tuple of the wrapped handlers
+        """
+
+        return tuple(None if handler is None else _TimedHandler(handler, 'field:' + field, self)
+                     for handler, field in zip(handlers, fields))
+
+    @property
+    def seconds(self):
+        """
+        :return: total wall time of the stages that do not overlap
+        """
+        return sum(self.stages[stage].seconds for stage in TOP_LEVEL_STAGES if stage in self.stages)
+
+    def as_dictionary(self):
+        return dict((stage, totals.as_dictionary()) for stage, totals in self.stages.items())
+
+    def report(self):
+        """
+        :return: table of the stages, slowest first, as a string
+        """
+
+        total = self.seconds or 1.0
+        lines = ['{:<32} {:>10} {:>10} {:>12} {:>10} {:>7}'.format('stage', 'calls', 'rows', 'cells', 'seconds', '%')]
+        for stage, totals in sorted(self.stages.items(), key=lambda item: -item[1].seconds):
+            lines.append('{:<32} {:>10} {:>10} {:>12} {:>10.4f} {:>6.1f}%'.format(
+                stage if stage in TOP_LEVEL_STAGES else '  ' + stage, totals.calls, totals.rows, totals.cells,
+                totals.seconds, 100.0 * totals.seconds / total))
+
+        return '\n'.join(lines)
+
+
+class NullStats(object):
+    """
+    Stands in for a ConversionStats when a conversion is not timed, so that timed and untimed conversions share one
+    code path. Records nothing.
+    """
+
+    __slots__ = ()
+
+    def add(self, stage, seconds, rows=0, cells=0):
+        pass
+
+    def time_rows(self, rows):
+        return rows
+
+    def time_handlers(self, handlers, fields):
+        return handlers
+
+
+NULL_STATS = NullStats()
+
+
+class _TimedHandler(object):
+    """
+    Field handler that records the time of each call. Hashes and compares equal to the handler it wraps, so checks
+    such as membership of NUMERIC_FIELD_HANDLERS behave as for the handler itself.
+    """
+
+    __slots__ = ('handler', 'stage', 'stats')
+
+    def __init__(self, handler, stage, stats):
+        self.handler = handler
+        self.stage = stage
+        self.stats = stats
+
+    def __call__(self, *args):
+        start = timer()
+        try:
+            return self.handler(*args)
+        finally:
+            self.stats.add(self.stage, timer() - start, 0, 1)
+
+    def __eq__(self, other):
+        if isinstance(other, _TimedHandler):
+            other = other.handler
+        return self.handler == other
+
+    def __ne__(self, other):
+        return not self == other
+
+    def __hash__(self):
+        return hash(self.handler)
@@ -1,30 +1,86 @@
 # coding: utf-8
 from pif_csv_utils.pif_utils import *
 import csv
+from collections import namedtuple
 try:
     from StringIO import StringIO
 except ImportError:
     from io import StringIO
 
 
+RANGE_PATTERN = re.compile(
+    r"^\s*range\(\s*(?P<min>([-+]?(\d*\.\d+|\d+\.?)([eE][-+]?\d+)?))\s*,\s*(?P<max>([-+]?(\d*\.\d+|\d+\.?)([eE][-+]?\d+)?))\s*\)\s*$",
+    re.IGNORECASE)
+
+
+def _unit_span(line, escapes):
+    """
+    Finds the parentheses holding the unit in one line of a header cell. The unit runs from the first opening
+    parenthesis to the last closing one; doubled parentheses, or escaped ones when escapes is True, do not count.
+
+    :param line: header cell text without line breaks
+    :param escapes: True if \\( and \\) escape parentheses, False if ((...)) marks parentheses that are not a unit
+    :return: indices of the opening and closing parenthesis, None if the line has no unit
+    """
+
+    if escapes:
+        def is_open(i):
+            return i == 0 or line[i - 1] not in '\\('
+
+        def is_close(i):
+            return line[i - 1] != '\\'
+    else:
+        def is_open(i):
+            return (i == 0 or line[i - 1] != '(') and line[i + 1:i + 2] != '('
+
+        def is_close(i):
+            return line[i - 1] != ')' and line[i + 1:i + 2] != ')'
+
+    close = line.rfind(')')
+    while close != -1 and not is_close(close):
+        close = line.rfind(')', 0, close)
+
+    if close == -1:
+        return None
+
+    start = line.find('(', 0, close)
+    while start != -1 and not is_open(start):
+        start = line.find('(', start + 1, close)
+
+    if start == -1:
+        return None
+
+    return start, close
+
+
 def get_units(column_header):
     """
     Gets a unit from the header cell. Only match single parenthesis not double.
 
+    Scans the cell with str.find rather than a backtracking regex so that parsing stays linear in the length of
+    the cell. Like the regex it replaces, the unit is taken from the last line of the cell that has one.
+
     :param column_header:  header cell
     :return: unit, updated column_header
     """
 
     if '((' in column_header and '))' in column_header and '\\' not in column_header:
-        potential_unit = re.findall(r'(?<!\()\((?!\()(.*)(?<!\))\)(?!\))', column_header)
+        escapes = False
     elif '(' in column_header and ')' in column_header:
-        potential_unit = re.findall(r'(?<!\\|\()(?:\()(.*)(?<!\\)(?:\))', column_header)
+        escapes = True
     else:
-        potential_unit = None
-
-    if potential_unit:
-        unit = potential_unit[-1].replace('\(', '(').replace('\)', ')')
-        column_header = column_header.replace('(' + potential_unit[-1] + ')', '').replace('\(', '(').replace('\)', ')')
+        return '', column_header.strip()
+
+    potential_unit = None
+    for line in reversed(column_header.split('\n')):
+        span = _unit_span(line, escapes)
+        if span is not None:
+            potential_unit = line[span[0] + 1:span[1]]
+            break
+
+    if potential_unit is not None:
+        unit = potential_unit.replace('\(', '(').replace('\)', ')')
+        column_header = column_header.replace('(' + potential_unit + ')', '').replace('\(', '(').replace('\)', ')')
         while '  ' in column_header:
             column_header = column_header.replace('  ', ' ')
         while '((' in column_header:
@@ -35,17 +91,45 @@ def get_units(column_header):
     return unit, column_header.strip()
 
 
+# Keywords that can follow a system name, in the order they are matched when several start at the same position
+SYSTEM_KEYWORDS = ('name', 'formula', 'identifier', 'figurenumber', 'tablenumber', 'tablecaption', 'figurecaption',
+                   'composition', 'processstep', 'processstepdetail', 'preparationstepdetail', 'method', 'datatype',
+                   'file', 'idealcomposition', 'actualcomposition', 'reference', 'preparationstep', 'property',
+                   'condition', 'idealquantity', 'actualquantity', 'classification')
+
+
 def split_on_keyword(string):
     """
     Split a string on a known keyword
 
+    Each keyword is searched for at most once per position it can next occur at, so splitting is linear in the
+    length of the string.
+
     :param string: string to split
-    :return: list of pieces
+    :return: list of pieces, alternating between the text between keywords and the keywords
     """
 
-    pieces = re.split(
-            r'(name|formula|identifier|figurenumber|tablenumber|tablecaption|figurecaption|composition|processstep|processstepdetail|preparationstepdetail|method|datatype|file|idealcomposition|actualcomposition|reference|preparationstep|property|condition|idealquantity|actualquantity|classification)',
-            normalize(string))
+    string = normalize(string)
+    found = [string.find(keyword) for keyword in SYSTEM_KEYWORDS]
+    pieces = []
+    position = 0
+
+    while True:
+        best = None
+        for k, keyword in enumerate(SYSTEM_KEYWORDS):
+            if -1 < found[k] < position:
+                found[k] = string.find(keyword, position)
+            if found[k] != -1 and (best is None or found[k] < found[best]):
+                best = k
+
+        if best is None:
+            break
+
+        pieces.append(string[position:found[best]])
+        pieces.append(SYSTEM_KEYWORDS[best])
+        position = found[best] + len(SYSTEM_KEYWORDS[best])
+
+    pieces.append(string[position:])
 
     return pieces
 
@@ -97,6 +181,33 @@ def get_system(column_header):
     return syst, column_header.strip()
 
 
+class HeaderCell(namedtuple('HeaderCell', ['system', 'keyword', 'name', 'unit'])):
+    """
+    Parsed form of a header cell, SYSTEM KEYWORD: name (unit)
+
+    :param system: system the column should be associated with, 'main' unless the cell names a sub-system
+    :param keyword: keyword as written in the header
+    :param name: column name
+    :param unit: column unit, '' if the cell has none
+    """
+
+    __slots__ = ()
+
+
+def parse_header_cell(column_header):
+    """
+    Parses a header cell into its system, keyword, name and unit
+
+    :param column_header: header cell
+    :return: HeaderCell
+    """
+
+    unit, column_header = get_units(column_header)
+    keyword, syst, name = get_keyword(column_header)
+
+    return HeaderCell(syst, keyword, name, unit)
+
+
 def get_header_info(headers):
     """
     Breaks headers into their components
@@ -111,18 +222,173 @@ def get_header_info(headers):
     systs = []
 
     for column_header in headers:
-        column_header = decode_string(column_header)
+        cell = parse_header_cell(column_header)
+        keywords.append(cell.keyword)
+        names.append(cell.name)
+        units.append(cell.unit)
+        systs.append(cell.system)
 
-        unit, column_header = get_units(column_header)
-        units.append(unit)
+    return keywords, names, units, systs
 
-        keyword, syst, column_header = get_keyword(column_header)
-        keywords.append(keyword)
-        systs.append(syst)
 
-        names.append(column_header)
+class HeaderColumn(namedtuple('HeaderColumn', ['keyword', 'system', 'name', 'unit', 'field', 'handler', 'slot',
+                                               'parent'])):
+    """
+    Parsed description of a single header cell
+
+    :param keyword: keyword as written in the header
+    :param system: system the column should be associated with
+    :param name: column name
+    :param unit: column unit
+    :param field: normalized keyword with aliases resolved, None if the keyword is not recognized
+    :param handler: field handler for the column's cells, None if the keyword is not recognized
+    :param slot: attribute of a Person or Reference that a CONTACT or REFERENCE column writes to, None for other
+        columns
+    :param parent: for a column that adds details to a property or preparation step, index of the column that starts
+        it: the nearest property, file or step name column to its left in the same system. None for other columns
+    """
+
+    __slots__ = ()
 
-    return keywords, names, units, systs
+
+class HeaderPlan(namedtuple('HeaderPlan', ['columns', 'keywords', 'names', 'units', 'systs', 'fields',
+                                           'handlers', 'slots', 'placeholders', 'detail_steps'])):
+    """
+    Immutable column plan compiled once from a header row and reused for every data row
+
+    :param columns: tuple of HeaderColumn, one per header cell
+    :param keywords: tuple of keywords, indexed by column
+    :param names: tuple of column names, indexed by column
+    :param units: tuple of units, indexed by column
+    :param systs: tuple of system names, indexed by column
+    :param fields: tuple of normalized keywords with aliases resolved, indexed by column
+    :param handlers: tuple of field handlers, indexed by column
+    :param slots: tuple of the Person or Reference attribute of each CONTACT or REFERENCE column, None for other
+        columns, indexed by column
+    :param placeholders: tuple of the indices of the columns visited even when their cell is empty, see row_columns
+    :param detail_steps: dictionary of the index of each preparation step detail column of the main system to the
+        index of its step name column, which is visited when the detail has a value
+    """
+
+    __slots__ = ()
+
+
+# Version of the header parsing rules. Bump it whenever get_header_info or the field tables change so that cached
+# header plans are rebuilt.
+HEADER_PARSER_VERSION = 1
+
+
+def compile_header_plan(headers):
+    """
+    Compiles a header row into a column plan
+
+    :param headers: list of header values
+    :return: HeaderPlan for the header row
+    """
+
+    return build_header_plan(*get_header_info(headers))
+
+
+def build_header_plan(keywords, names, units, systs):
+    """
+    Builds a column plan from the components of a header row
+
+    :param keywords: keywords from headers
+    :param names: column names from headers
+    :param units: units from headers
+    :param systs: system names from headers
+    :return: HeaderPlan for the header row
+    """
+
+    fields = [get_field(keyword) for keyword in keywords]
+    slots = [normalize(name) if field in SLOT_FIELDS else None for field, name in zip(fields, names)]
+    handlers = [bind_slot(FIELD_HANDLERS.get(field), slot) for field, slot in zip(fields, slots)]
+    parents = find_parents(fields, systs)
+
+    for j, (field, name) in enumerate(zip(fields, names)):
+        if field in UNNAMED_COLUMN and not name:
+            raise ValueError(UNNAMED_COLUMN[field] % (j + 1))
+
+    columns = tuple(HeaderColumn(*column) for column in zip(keywords, systs, names, units, fields, handlers, slots,
+                                                            parents))
+
+    placeholders = []
+    detail_steps = {}
+    main_steps = False
+    for j, column in enumerate(columns):
+        if column.handler is None or column.handler in PLACEHOLDER_FIELD_HANDLERS:
+            placeholders.append(j)
+        elif column.field == 'preparationstepname' and (column.system != 'main' or not main_steps):
+            placeholders.append(j)
+            main_steps = main_steps or column.system == 'main'
+        elif column.field == 'preparationstepdetail' and column.system == 'main':
+            detail_steps[j] = column.parent
+
+    return HeaderPlan(columns, tuple(keywords), tuple(names), tuple(units), tuple(systs), tuple(fields),
+                      tuple(handlers), tuple(slots), tuple(placeholders), detail_steps)
+
+
+CONDITION_BEFORE_PROPERTY = 'Condition details were provided before a property was given. Condition columns must appear to the right of the property that they belong to.\n'
+
+DETAIL_BEFORE_STEP = 'Preparation details were provided before a step name was given. A preparation step name must always be provided to the left of the details columns.\n'
+
+# Fields that start a property, which the detail columns to their right add to
+PROPERTY_FIELDS = frozenset(['property', 'file'])
+
+# Errors for the fields that need a name in the header, checked when the plan is built since rows do not write to
+# a sub-system until it has a value
+UNNAMED_COLUMN = {
+    'property': 'No property name has been specified for column: %s. Every property column must have a name provided in the header row.\n',
+    'file': 'No file name has been specified for column: %s. Every files column must have a name provided in the header row.\n',
+}
+
+# Fields that add details to the last property, with the error for a header that has no property to their left
+PROPERTY_DETAIL_FIELDS = {
+    'condition': CONDITION_BEFORE_PROPERTY,
+    'method': METHOD_BEFORE_PROPERTY,
+    'figurenumber': NUMBER_BEFORE_PROPERTY,
+    'figurecaption': CAPTION_BEFORE_PROPERTY,
+    'tablenumber': NUMBER_BEFORE_PROPERTY,
+    'tablecaption': CAPTION_BEFORE_PROPERTY,
+    'datatype': DATATYPE_BEFORE_PROPERTY,
+}
+
+
+def find_parents(fields, systs):
+    """
+    Links each property detail and preparation step detail column to the column that starts its parent. A detail
+    cell of a row is added to the last property or step that the row has, which is the one of this column unless
+    the row leaves it empty.
+
+    :param fields: fields of the columns
+    :param systs: system names of the columns
+    :return: list of the index of the parent column of each column, None for columns that are not details. Raises
+        ValueError if a detail column has no parent column to its left in the same system
+    """
+
+    last_property = {}
+    last_step = {}
+    parents = []
+
+    for j, (field, syst) in enumerate(zip(fields, systs)):
+        parent = None
+
+        if field in PROPERTY_FIELDS:
+            last_property[syst] = j
+        elif field == 'preparationstepname':
+            last_step[syst] = j
+        elif field in PROPERTY_DETAIL_FIELDS:
+            parent = last_property.get(syst)
+            if parent is None:
+                raise ValueError(PROPERTY_DETAIL_FIELDS[field])
+        elif field == 'preparationstepdetail':
+            parent = last_step.get(syst)
+            if parent is None:
+                raise ValueError(DETAIL_BEFORE_STEP)
+
+        parents.append(parent)
+
+    return parents
 
 
 def is_list(string):
@@ -133,7 +399,7 @@ def is_list(string):
     :return: Boolean
     """
 
-    if string:
+    if string and not isinstance(string, NUMBER_TYPES):
         if '[' == string[0] and ']' == string[-1] and ',' in string:
             return True
 
@@ -157,193 +423,203 @@ def create_list(string):
     return lst
 
 
-def add_fields(keywords, names, units, systs, sys_dict, row):
+def row_columns(plan, row):
     """
-    Add the row data to a system and add that system to the sys_dict
-
-    :param keywords: keywords from headers
-    :param names: column names from headers
-    :param units: units from headers
-    :param systs: system names from headers
-    :param sys_dict: dictionary of systems
-    :param row: data for the current row
-    :return: updated dictionary and list of all_conditions
+    Finds the columns of a row that add_fields has to visit: the non-empty cells and the placeholder columns of the
+    plan. The empty cells of the other columns write nothing, so skipping them leaves the PIF unchanged. An empty
+    preparation step name starts an unnamed step for the details to its right; the main system drops unnamed steps,
+    so after its first step name column, which gives it a preparation list, its step name columns are only visited
+    when one of their details has a value.
+
+    :param plan: HeaderPlan of the table
+    :param row: the row of data
+    :return: list of column indices, in order
     """
 
-    for s in set(systs):
-        sys_dict[s] = ChemicalSystem()
+    columns = [j for j, cell in enumerate(row) if cell != '']
 
-    all_condition = []
+    width = len(row)
+    extra = [j for j in plan.placeholders if j < width]
+    if plan.detail_steps:
+        detail_steps = plan.detail_steps
+        extra.extend(detail_steps[j] for j in columns if j in detail_steps)
+
+    if extra:
+        columns = sorted(set(columns).union(extra))
 
-    unknown = ''
+    return columns
 
-    for j, cell in enumerate(row):
-        cell = decode_string(cell)
 
-        if is_list(cell):
-            cell = create_list(cell)
+def decode_cells(handlers, systs, row, columns=None):
+    """
+    Decodes the cells of a row into the values their field handlers are given: numbers from spreadsheets are turned
+    into text for the fields that do not keep them, and cells of the form [A, B] into lists
+
+    :param handlers: field handlers for each column
+    :param systs: system names from headers
+    :param row: data for the current row, as decoded text (see open_text)
+    :param columns: indices of the columns to decode in order, from row_columns. Every cell of the row if not given
+    :return: list of (column index, value, fills) tuples, in column order. fills is True if the handler writes the
+        value to a sub-system (see fills_system), always False for columns of the main system
+    """
+
+    if columns is None:
+        columns = range(len(row))
 
-        systm = sys_dict[systs[j]]
+    values = []
 
-        if 'formula' == normalize(keywords[j]):
-            systm = add_formula(systm, cell)
+    for j in columns:
+        cell = row[j]
+        handler = handlers[j]
 
-        elif 'uid' == normalize(keywords[j]):
-            systm = add_uid(systm, cell)
+        if handler is not None:
+            if isinstance(cell, NUMBER_TYPES) and (not cell or handler not in NUMERIC_FIELD_HANDLERS):
+                cell = to_text(cell)
 
-        elif 'name' == normalize(keywords[j]):
-            systm = add_name(systm, cell)
+            if is_list(cell):
+                cell = create_list(cell)
 
-        elif 'contact' == normalize(keywords[j]):
-            systm = add_contacts(systm, cell, names, j)
+        values.append((j, cell, systs[j] != 'main' and handler is not None and fills_system(handler, cell)))
 
-        elif 'file' == normalize(keywords[j]):
-            systm = add_newfile(systm, cell, names, j)
+    return values
 
-        elif 'identifier' == normalize(keywords[j]):
-            systm = add_identifier(systm, cell, names, j)
 
-        elif 'classification' == normalize(keywords[j]):
-            systm = add_classification(systm, cell, names, j)
+def fill_systems(values, handlers, names, units, systs, sys_dict, filled=None, new_system=ChemicalSystem):
+    """
+    Writes the decoded values of a row to its systems and adds the systems to the sys_dict. The main system is always
+    created, a sub-system only once a value of the row is written to it
 
-        elif 'property' == normalize(keywords[j]):
-            systm = add_property(systm, cell, names, units, j)
+    :param values: list of (column index, value, fills) tuples from decode_cells
+    :param handlers: field handlers for each column
+    :param names: column names from headers
+    :param units: units from headers
+    :param systs: system names from headers
+    :param sys_dict: dictionary of systems
+    :param filled: dictionary counting the cells written to each sub-system, updated if given
+    :param new_system: callable creating an empty system
+    :return: updated dictionary and list of all_conditions
+    """
 
-        elif 'condition' == normalize(keywords[j]):
-            systm = add_condition(systm, cell, names, units, j)
+    if filled is None:
+        filled = {}
 
-        elif 'allcondition' == normalize(keywords[j]):
-            all_condition = add_all_condition(all_condition, cell, names, units, j)
+    main_system = sys_dict['main'] = new_system()
 
-        elif 'method' == normalize(keywords[j]):
-            systm = add_method(systm, cell)
+    all_condition = []
 
-        elif 'figurenumber' == normalize(keywords[j]):
-            systm = add_number(systm, cell, 'figure')
+    unknown = []
 
-        elif 'figurecaption' == normalize(keywords[j]):
-            systm = add_caption(systm, cell, 'figure')
+    for j, cell, fills in values:
+        handler = handlers[j]
 
-        elif 'tablenumber' == normalize(keywords[j]):
-            systm = add_number(systm, cell, 'table')
+        if handler is None:
+            unknown.append(j)
+            continue
 
-        elif 'tablecaption' == normalize(keywords[j]):
-            systm = add_caption(systm, cell, 'table')
+        systm = sys_dict.get(systs[j])
+        if systm is not main_system:
+            if systm is None:
+                if not fills and not cell:
+                    continue
+                systm = sys_dict[systs[j]] = new_system()
+            if fills:
+                filled[systs[j]] = filled.get(systs[j], 0) + 1
 
-        elif 'datatype' == normalize(keywords[j]):
-            systm = add_datatype(systm, cell)
+        handler(systm, cell, names, units, j, all_condition)
 
-        elif 'preparationstepname' == normalize(keywords[j]) or 'processstepname' == normalize(keywords[j]):
-            systm = add_preparation_step(systm, cell)
+    if unknown:
+        warn(UNKNOWN_HEADERS, ', '.join(str(j) for j in unknown))
 
-        elif 'preparationstepdetail' == normalize(keywords[j]) or 'processstepdetail' == normalize(keywords[j]):
-            systm = add_preparation_step_detail(systm, cell, names, units, j)
+    return sys_dict, all_condition
 
-        elif 'reference' == normalize(keywords[j]):
-            systm = add_reference(systm, cell, names, j)
 
-        elif 'idealcomposition' == normalize(keywords[j]):
-            systm = add_ideal_composition(systm, cell, names, units, j)
+def add_fields(keywords, names, units, systs, sys_dict, row, handlers=None, filled=None, columns=None):
+    """
+    Add the row data to a system and add that system to the sys_dict. The main system is always created, a
+    sub-system only once a cell of the row is written to it
 
-        elif 'composition' == normalize(keywords[j]):
-            systm = add_ideal_composition(systm, cell, names, units, j)
+    :param keywords: keywords from headers
+    :param names: column names from headers
+    :param units: units from headers
+    :param systs: system names from headers
+    :param sys_dict: dictionary of systems
+    :param row: data for the current row, as decoded text (see open_text). Numbers from spreadsheets are kept as
+        numbers where the field accepts them
+    :param handlers: field handlers for each column, resolved from the keywords if not given
+    :param filled: dictionary counting the cells written to each sub-system, updated if given
+    :param columns: indices of the columns to fill in order, from row_columns. Every cell of the row if not given
+    :return: updated dictionary and list of all_conditions
+    """
 
-        elif 'actualcomposition' == normalize(keywords[j]):
-            systm = add_actual_composition(systm, cell, names, units, j)
+    if handlers is None:
+        handlers = [get_field_handler(keyword) for keyword in keywords]
 
-        elif 'idealquantity' == normalize(keywords[j]):
-            systm = add_ideal_quantity(systm, cell, units, j)
+    return fill_systems(decode_cells(handlers, systs, row, columns), handlers, names, units, systs, sys_dict, filled)
 
-        elif 'actualquantity' == normalize(keywords[j]):
-            systm = add_actual_quantity(systm, cell, units, j)
 
-        else:
-            unknown += ', %s' % j
+RECOGNIZED_CONTACT_FIELDS = ['name', 'email', 'url']
 
-    if any(unknown):
-        print ('Unknown header(s) for column(s) %s.\n' % (unknown[1:]))
+RECOGNIZED_REFERENCE_FIELDS = ['doi', 'isbn', 'publisher', 'title', 'year', 'journal', 'volume']
 
-    return sys_dict, all_condition
+# Fields whose columns write to an attribute of a Person or Reference named by the column, resolved when header
+# plans are built (see SlotHandler)
+SLOT_FIELDS = frozenset(['contact', 'reference'])
 
 
-def create_person(contact_value, names, column_index):
+def create_person(contact_value, names, column_index, field=None):
     """
     Creates a person object
 
     :param contact_value: value to use in the person object
     :param names: list of column names
     :param column_index: column index to reference
+    :param field: attribute the column writes to, the normalized column name if not given
     :return: person object in a list
     """
 
-    recognized_contact_fields = ['name', 'email', 'url']
+    if field is None:
+        field = normalize(names[column_index])
 
     new_person = Person()
 
-    if normalize(names[column_index]) in recognized_contact_fields:
-        setattr(new_person, normalize(names[column_index]), contact_value)
+    if field in RECOGNIZED_CONTACT_FIELDS:
+        setattr(new_person, field, contact_value)
     else:
         new_person.name = contact_value
 
     return [new_person]
 
 
-def add_contacts(systm, contact_value, names, column_index):
+def add_contacts(systm, contact_value, names, column_index, field=None):
     """
-    Adds contact info to existing or new people objects
+    Adds contact info to the last person object, or to a new one if the last person already has that field
 
     :param systm: system to add to
     :param contact_value: value to add
     :param names: list of column names
     :param column_index: column index to reference
+    :param field: attribute the column writes to, the normalized column name if not given
     :return: updated system with new contact info added
     """
 
     if contact_value:
 
-        systm.contacts = listify(systm.contacts)
-
-        if not systm.contacts:
-            people = create_person(contact_value, names, column_index)
-
-        elif len(systm.contacts) == 1:
-            existing_person = systm.contacts[0]
-
-            if getattr(existing_person, normalize(names[column_index])):
-                new_person = create_person(contact_value, names, column_index)
-            else:
-                setattr(existing_person, normalize(names[column_index]), contact_value)
-                new_person = None
-
-            new_person = listify(new_person)
-            existing_person = listify(existing_person)
-
-            if new_person:
-                people = existing_person + new_person
-            else:
-                people = existing_person
+        if field is None:
+            field = normalize(names[column_index])
 
-        elif len(systm.contacts) > 1:
+        people = systm.contacts
 
-            existing_people = systm.contacts[:-1]
-            last_person = systm.contacts[-1]
+        if not people:
+            systm.contacts = create_person(contact_value, names, column_index, field)
 
-            if getattr(last_person, normalize(names[column_index])):
-                new_person = create_person(contact_value, names, column_index)
-            else:
-                setattr(last_person, normalize(names[column_index]), contact_value)
-                new_person = None
-
-            new_person = listify(new_person)
-            last_person = listify(last_person)
-            existing_people = listify(existing_people)
+        else:
+            if not isinstance(people, list):
+                systm.contacts = people = [people]
 
-            if new_person:
-                people = existing_people + last_person + new_person
+            if getattr(people[-1], field):
+                people.extend(create_person(contact_value, names, column_index, field))
             else:
-                people = existing_people + last_person
-
-        systm.contacts = people
+                setattr(people[-1], field, contact_value)
 
     return systm
 
@@ -505,9 +781,7 @@ def add_newfile(systm, file_name, names, column_index):
     if names[column_index]:
         prop.name = names[column_index]
     else:
-        raise ValueError(
-            'No file name has been specified for column: %s. Every files column must have a name provided in the header row.\n' % (
-                column_index + 1))
+        raise ValueError(UNNAMED_COLUMN['file'] % (column_index + 1))
 
     ext = file_name.split('.')[-1]
     if file_name:
@@ -538,21 +812,17 @@ def add_property(systm, property_value, names, units, column_index):
     :return: system updated with the property info
     """
 
-    range_pattern = r"^\s*range\(\s*(?P<min>([-+]?(\d*\.\d+|\d+\.?)([eE][-+]?\d+)?))\s*,\s*(?P<max>([-+]?(\d*\.\d+|\d+\.?)([eE][-+]?\d+)?))\s*\)\s*$"
-
     prop = Property()
     if names[column_index]:
         prop.name = names[column_index]
     else:
-        raise ValueError(
-            'No property name has been specified for column: %s. Every property column must have a name provided in the header row.\n' % (
-                column_index + 1))
+        raise ValueError(UNNAMED_COLUMN['property'] % (column_index + 1))
 
     if not property_value:
         return systm
 
-    if isinstance(property_value, str) and re.match(range_pattern, property_value, re.IGNORECASE):
-        min_max = re.match(range_pattern, property_value, re.IGNORECASE).groupdict()
+    if isinstance(property_value, str) and RANGE_PATTERN.match(property_value):
+        min_max = RANGE_PATTERN.match(property_value).groupdict()
         minimum = float(min_max["min"])
         maximum = float(min_max["max"])
         if minimum > maximum:
@@ -586,16 +856,8 @@ def add_preparation_step_detail(systm, preparation_step_detail, names, units, co
     """
 
     if preparation_step_detail:
-        if systm.preparation:
-            step = systm.preparation[-1]
-        else:
-            raise ValueError(
-                'Preparation details were provided before a step name was given. A preparation step name must always be provided to the left of the details columns.\n')
-
-        if step.details:
-            step.details = listify(step.details)
-        else:
-            step.details = []
+        if not systm.preparation:
+            raise ValueError(DETAIL_BEFORE_STEP)
 
         detail = Value()
         if names[column_index]:
@@ -611,9 +873,7 @@ def add_preparation_step_detail(systm, preparation_step_detail, names, units, co
         if units[column_index]:
             detail.units = units[column_index]
 
-        step.details.append(detail)
-
-        systm.preparation[-1] = step
+        child_list(systm.preparation[-1], 'details').append(detail)
 
     return systm
 
@@ -631,16 +891,7 @@ def add_condition(systm, condition, names, units, column_index):
     """
 
     if condition:
-        if systm.properties:
-            prop = systm.properties[-1]
-        else:
-            raise ValueError(
-                'Condition details were provided before a property was given. Condition columns must appear to the right of the property that they belong to.\n')
-
-        if prop.conditions:
-            prop.conditions = listify(prop.conditions)
-        else:
-            prop.conditions = []
+        prop = last_property(systm, CONDITION_BEFORE_PROPERTY)
 
         conditions = Value()
         if names[column_index]:
@@ -656,9 +907,7 @@ def add_condition(systm, condition, names, units, column_index):
         if units[column_index]:
             conditions.units = units[column_index]
 
-        prop.conditions.append(conditions)
-
-        systm.properties[-1] = prop
+        child_list(prop, 'conditions').append(conditions)
 
     return systm
 
@@ -691,71 +940,45 @@ def add_all_condition(all_condition, condition, names, units, column_index):
     return all_condition
 
 
-def add_reference(systm, reference_value, names, column_index):
+def add_reference(systm, reference_value, names, column_index, field=None):
     """
-    A reference to add to the system
+    A reference to add to the system. Every value after the first starts a new reference; a recognized field is
+    written to the last reference instead if it does not have that field yet, leaving the new reference empty.
 
     :param systm: system object to add the reference info to
     :param reference_value: reference value to add
     :param names: list of names from the header row
     :param column_index: index of the current column
+    :param field: attribute the column writes to, the normalized column name if not given
     :return: system updated with the reference info
     """
 
-    recognized_ref_fields = ['doi', 'isbn', 'publisher', 'title', 'year', 'journal', 'volume']
-
     if reference_value:
 
-        systm.references = listify(systm.references)
-
-        if not systm.references:
-            r = Reference()
-
-            if normalize(names[column_index]) in recognized_ref_fields:
-                setattr(r, normalize(names[column_index]), reference_value)
-
-            else:
-                r.citation = reference_value
+        if field is None:
+            field = normalize(names[column_index])
+        recognized = field in RECOGNIZED_REFERENCE_FIELDS
 
-            r = [r]
+        references = systm.references
 
-        elif len(systm.references) == 1:
-            new_reference = Reference()
-
-            r = systm.references[0]
-
-            if normalize(names[column_index]) in recognized_ref_fields:
-                if not getattr(r, normalize(names[column_index])):
-                    setattr(r, normalize(names[column_index]), reference_value)
-                else:
-                    setattr(new_reference, normalize(names[column_index]), reference_value)
+        if not references:
+            r = Reference()
+            setattr(r, field if recognized else 'citation', reference_value)
+            systm.references = [r]
 
-            if new_reference:
-                r = [r, new_reference]
-            else:
-                r = [r]
+        else:
+            if not isinstance(references, list):
+                systm.references = references = [references]
 
-        elif len(systm.references) > 1:
             new_reference = Reference()
 
-            rr = systm.references[:]
-
-            existing_references = rr[:-1]
-            ref = rr[-1]
-
-            if normalize(names[column_index]) in recognized_ref_fields:
-
-                if not getattr(ref, normalize(names[column_index])):
-                    setattr(ref, normalize(names[column_index]), reference_value)
+            if recognized:
+                if not getattr(references[-1], field):
+                    setattr(references[-1], field, reference_value)
                 else:
-                    setattr(new_reference, normalize(names[column_index]), reference_value)
+                    setattr(new_reference, field, reference_value)
 
-            if new_reference:
-                r = existing_references + [ref] + [new_reference]
-            else:
-                r = existing_references + [ref]
-
-        systm.references = r
+            references.append(new_reference)
 
     return systm
 
@@ -817,4 +1040,222 @@ def add_classification(systm, classification, names, column_index):
         else:
             systm.classifications = [clss]
 
-    return systm
\ No newline at end of file
+    return systm
+
+
+def _formula_field(systm, cell, names, units, column_index, all_condition):
+    return add_formula(systm, cell)
+
+
+def _uid_field(systm, cell, names, units, column_index, all_condition):
+    return add_uid(systm, cell)
+
+
+def _name_field(systm, cell, names, units, column_index, all_condition):
+    return add_name(systm, cell)
+
+
+def _contact_field(systm, cell, names, units, column_index, all_condition, field=None):
+    return add_contacts(systm, cell, names, column_index, field)
+
+
+def _file_field(systm, cell, names, units, column_index, all_condition):
+    return add_newfile(systm, cell, names, column_index)
+
+
+def _identifier_field(systm, cell, names, units, column_index, all_condition):
+    return add_identifier(systm, cell, names, column_index)
+
+
+def _classification_field(systm, cell, names, units, column_index, all_condition):
+    return add_classification(systm, cell, names, column_index)
+
+
+def _property_field(systm, cell, names, units, column_index, all_condition):
+    return add_property(systm, cell, names, units, column_index)
+
+
+def _condition_field(systm, cell, names, units, column_index, all_condition):
+    return add_condition(systm, cell, names, units, column_index)
+
+
+def _all_condition_field(systm, cell, names, units, column_index, all_condition):
+    return add_all_condition(all_condition, cell, names, units, column_index)
+
+
+def _method_field(systm, cell, names, units, column_index, all_condition):
+    return add_method(systm, cell)
+
+
+def _figure_number_field(systm, cell, names, units, column_index, all_condition):
+    return add_number(systm, cell, 'figure')
+
+
+def _figure_caption_field(systm, cell, names, units, column_index, all_condition):
+    return add_caption(systm, cell, 'figure')
+
+
+def _table_number_field(systm, cell, names, units, column_index, all_condition):
+    return add_number(systm, cell, 'table')
+
+
+def _table_caption_field(systm, cell, names, units, column_index, all_condition):
+    return add_caption(systm, cell, 'table')
+
+
+def _datatype_field(systm, cell, names, units, column_index, all_condition):
+    return add_datatype(systm, cell)
+
+
+def _preparation_step_field(systm, cell, names, units, column_index, all_condition):
+    return add_preparation_step(systm, cell)
+
+
+def _preparation_step_detail_field(systm, cell, names, units, column_index, all_condition):
+    return add_preparation_step_detail(systm, cell, names, units, column_index)
+
+
+def _reference_field(systm, cell, names, units, column_index, all_condition, field=None):
+    return add_reference(systm, cell, names, column_index, field)
+
+
+def _ideal_composition_field(systm, cell, names, units, column_index, all_condition):
+    return add_ideal_composition(systm, cell, names, units, column_index)
+
+
+def _actual_composition_field(systm, cell, names, units, column_index, all_condition):
+    return add_actual_composition(systm, cell, names, units, column_index)
+
+
+def _ideal_quantity_field(systm, cell, names, units, column_index, all_condition):
+    return add_ideal_quantity(systm, cell, units, column_index)
+
+
+def _actual_quantity_field(systm, cell, names, units, column_index, all_condition):
+    return add_actual_quantity(systm, cell, units, column_index)
+
+
+# Keywords that are written differently but fill the same field
+FIELD_ALIASES = {
+    'processstepname': 'preparationstepname',
+    'processstepdetail': 'preparationstepdetail',
+    'composition': 'idealcomposition',
+}
+
+# Field handlers keyed by field (normalized keyword with aliases resolved). Every handler takes
+# (systm, cell, names, units, column_index, all_condition).
+FIELD_HANDLERS = {
+    'formula': _formula_field,
+    'uid': _uid_field,
+    'name': _name_field,
+    'contact': _contact_field,
+    'file': _file_field,
+    'identifier': _identifier_field,
+    'classification': _classification_field,
+    'property': _property_field,
+    'condition': _condition_field,
+    'allcondition': _all_condition_field,
+    'method': _method_field,
+    'figurenumber': _figure_number_field,
+    'figurecaption': _figure_caption_field,
+    'tablenumber': _table_number_field,
+    'tablecaption': _table_caption_field,
+    'datatype': _datatype_field,
+    'preparationstepname': _preparation_step_field,
+    'preparationstepdetail': _preparation_step_detail_field,
+    'reference': _reference_field,
+    'idealcomposition': _ideal_composition_field,
+    'actualcomposition': _actual_composition_field,
+    'idealquantity': _ideal_quantity_field,
+    'actualquantity': _actual_quantity_field,
+}
+
+# Field handlers that keep typed (numeric) cell values. Every other handler is given the text of the number,
+# as are zeros so that they are not dropped as empty cells.
+NUMERIC_FIELD_HANDLERS = frozenset([
+    _property_field,
+    _condition_field,
+    _all_condition_field,
+    _preparation_step_detail_field,
+    _ideal_composition_field,
+    _actual_composition_field,
+    _ideal_quantity_field,
+    _actual_quantity_field,
+])
+
+# Field handlers that write to the system of their column even for an empty cell
+EMPTY_CELL_FIELD_HANDLERS = frozenset([_preparation_step_field])
+
+# Field handlers that never write to the system of their column
+SYSTEMLESS_FIELD_HANDLERS = frozenset([_all_condition_field])
+
+# Field handlers that check the system on empty cells too: a UID or formula column rejects a system that already has
+# one
+PLACEHOLDER_FIELD_HANDLERS = frozenset([_uid_field, _formula_field])
+
+
+class SlotHandler(namedtuple('SlotHandler', ['handler', 'field'])):
+    """
+    Field handler of a CONTACT or REFERENCE column of a header plan, giving the handler the attribute the column
+    writes to so that it is not resolved again for every cell
+
+    :param handler: field handler taking the attribute as its last argument
+    :param field: attribute of a Person or Reference the column writes to
+    """
+
+    __slots__ = ()
+
+    def __call__(self, systm, cell, names, units, column_index, all_condition):
+        return self.handler(systm, cell, names, units, column_index, all_condition, self.field)
+
+
+def bind_slot(handler, slot):
+    """
+    :param handler: field handler of a column, None if the keyword is not recognized
+    :param slot: attribute of a Person or Reference the column writes to, None for columns of other fields
+    :return: the handler, given the slot through a SlotHandler if there is one
+    """
+    return handler if slot is None or handler is None else SlotHandler(handler, slot)
+
+
+def fills_system(handler, cell):
+    """
+    Checks if a field handler writes a cell to the system of its column
+
+    :param handler: field handler of the column
+    :param cell: value of the cell, as given to the handler
+    :return: Boolean
+    """
+
+    if handler in SYSTEMLESS_FIELD_HANDLERS:
+        return False
+    if handler in EMPTY_CELL_FIELD_HANDLERS:
+        return True
+
+    # add_name skips the text of an empty list
+    return bool(cell) and not (handler == _name_field and cell == '[]')
+
+
+def get_field(keyword):
+    """
+    Resolves the field filled by a header keyword
+
+    :param keyword: keyword from the header
+    :return: normalized keyword with aliases resolved, or None if the keyword is not recognized
+    """
+
+    field = normalize(keyword)
+    field = FIELD_ALIASES.get(field, field)
+
+    return field if field in FIELD_HANDLERS else None
+
+
+def get_field_handler(keyword):
+    """
+    Resolves the field handler for a header keyword
+
+    :param keyword: keyword from the header
+    :return: field handler, or None if the keyword is not recognized
+    """
+
+    return FIELD_HANDLERS.get(get_field(keyword))
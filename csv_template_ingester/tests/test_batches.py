@@ -0,0 +1,92 @@
+# coding: utf-8
+import glob
+import pytest
+from csv_template_ingester.converter import convert
+
+numpy = pytest.importorskip('numpy')
+
+from csv_template_ingester.batches import convert_batches, parse_numeric_column, type_block
+
+ROWS = ['a,12,"range(1, 2)",300,Anneal,1e3', 'b,7.5,,x,Quench,', 'c,n/a,"RANGE(0.5,4)","[1, 2]",,0',
+        'd,-0,0e5,-0.0,Age,+0']
+
+
+@pytest.fixture
+def samples(tmpdir):
+    path = str(tmpdir.join('samples.csv'))
+    with open(path, 'w') as output_file:
+        output_file.write('NAME,PROPERTY: Hardness (HV),PROPERTY: Density (g/cc),CONDITION: Temperature (K),'
+                          'PREPARATION STEP NAME,PREPARATION STEP DETAIL: Time (s)\n')
+        output_file.write('\n'.join(ROWS) + '\n')
+
+    return path
+
+
+def test_parse_numeric_column():
+    column = parse_numeric_column([' 12', '', 'x', 2.5, 'nan', 'range(3, 1)', '-1e2'], 4, ranges=True)
+    assert column.index == 4
+    assert column.numbers.tolist() == [True, False, False, True, False, False, True]
+    assert column.values[[0, 3, 6]].tolist() == [12.0, 2.5, -100.0]
+    assert column.ranges.tolist() == [False] * 5 + [True, False]
+    assert (column.minimums[5], column.maximums[5]) == (3.0, 1.0)
+
+    assert not parse_numeric_column(['range(3, 1)']).ranges.any()
+
+    column = parse_numeric_column(['12', 'range(1, 2)'], ranges=True, numbers=False)
+    assert column.values is None and column.numbers is None
+    assert column.ranges.tolist() == [False, True]
+
+
+def test_type_block():
+    cells = ['12345678901234567890', '007', '1_000', 'inf', '1e3', ' 12 ', '-0.5', '1.', '0', '0.0', '-0', '0e5',
+             ' +0.0 ']
+    block = [['a', cell] for cell in cells]
+    column = parse_numeric_column([row[1] for row in block], 1)
+    typed = [row[1] for row in type_block(block, [column])]
+    assert typed == [12345678901234567890, '007', '1_000', 'inf', 1000.0, 12, -0.5, 1.0, 0, 0.0, '-0', '0e5',
+                     ' +0.0 ']
+    assert [type(cell) for cell in typed[4:10]] == [float, int, float, float, int, float]
+    assert block[0][1] == '12345678901234567890'
+
+
+@pytest.mark.parametrize('batch_rows', [1, 2, 1000])
+def test_convert_batches(samples, batch_rows):
+    blocks = list(convert_batches([samples], batch_rows=batch_rows))
+    assert [len(block) for block in blocks] == [min(batch_rows, len(ROWS) - i)
+                                                for i in range(0, len(ROWS), batch_rows)]
+    assert [p.as_dictionary() for block in blocks for p in block] == [p.as_dictionary() for p in convert([samples])]
+
+    dicts = [p for block in convert_batches([samples], batch_rows, output='dict') for p in block]
+    assert dicts == list(convert([samples], output='dict'))
+
+
+@pytest.mark.parametrize('path', sorted(glob.glob('./test_files/*.csv') + glob.glob('./test_files/*.xls')))
+def test_convert_batches_files(path):
+    pifs = [p.as_dictionary() for block in convert_batches([path], batch_rows=2) for p in block]
+    assert pifs == [p.as_dictionary() for p in convert([path])]
+
+
+def test_convert_batches_typed(samples):
+    pifs = [p for block in convert_batches([samples], typed_scalars=True) for p in block]
+    assert pifs[0].properties[0].scalars == [12]
+    assert pifs[0].properties[1].scalars[0].minimum == 1.0
+    assert pifs[0].properties[1].conditions[0].scalars == [300]
+    assert pifs[0].preparation[0].details[0].scalars == [1000]
+    assert pifs[1].properties[0].scalars == [7.5]
+    assert pifs[1].properties[0].conditions[0].scalars == ['x']
+    assert pifs[2].properties[0].scalars == ['n/a']
+    assert pifs[2].properties[1].conditions[0].scalars == ['1', '2']
+
+    typed = [p.as_dictionary() for p in pifs[3:]]
+    assert typed == [p.as_dictionary() for p in convert([samples])][3:]
+    assert typed[0]['properties'][0]['scalars'] == ['-0']
+
+
+def test_convert_batches_ranges(tmpdir):
+    path = str(tmpdir.join('ranges.csv'))
+    with open(path, 'w') as output_file:
+        output_file.write('NAME,PROPERTY: Hardness (HV)\na,1\nb,"range(3, 1)"\n')
+
+    blocks = convert_batches([path], batch_rows=2)
+    with pytest.raises(ValueError):
+        next(blocks)
@@ -0,0 +1,39 @@
+# coding: utf-8
+import pytest
+from csv_template_ingester.converter import convert
+from csv_template_ingester.merge import merge_pifs
+
+ROWS = ['b,1,7.1,300', 'a,2,7.2,300', 'b,3,7.3,400', ',9,9,9', 'a,4,7.4,500']
+
+
+@pytest.fixture
+def samples(tmpdir):
+    path = str(tmpdir.join('samples.csv'))
+    with open(path, 'w') as output_file:
+        output_file.write('NAME,PROPERTY: Hardness (HV),PROPERTY: Density (g/cc),CONDITION: Temperature (K)\n')
+        output_file.write('\n'.join(ROWS) + '\n')
+
+    return path
+
+
+def test_convert_merge_on_name(samples):
+    merged = [p.as_dictionary() for p in convert([samples], merge_on='name')]
+    assert [p.get('names') for p in merged] == [None, ['a'], ['b']]
+    assert [prop['scalars'] for prop in merged[1]['properties']] == [['2', '4'], ['7.2', '7.4']]
+    assert merged[1]['properties'][1]['conditions'] == [{'name': 'Temperature', 'scalars': ['300', '500'],
+                                                         'units': 'K'}]
+
+    assert list(convert([samples], merge_on='name', output='dict')) == merged
+    assert [p.as_dictionary() for p in merge_pifs(convert([samples]), 'name', buffer_rows=2)] == merged
+
+    with pytest.raises(ValueError):
+        list(convert([samples], merge_on='name', output='record'))
+
+
+def test_convert_merge_sorted(samples):
+    merged = [p.as_dictionary() for p in convert([samples], merge_on='name', merge_sorted=True)]
+    assert [p.get('names') for p in merged] == [['b'], ['a'], ['b'], None, ['a']]
+
+    systems = sorted(convert([samples]), key=lambda system: system.names or [])
+    merged = [p.as_dictionary() for p in merge_pifs(systems, 'name', presorted=True)]
+    assert merged == [p.as_dictionary() for p in convert([samples], merge_on='name')]
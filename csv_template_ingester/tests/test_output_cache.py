@@ -0,0 +1,59 @@
+# coding: utf-8
+import os
+import shutil
+import pytest
+from csv_template_ingester.converter import convert
+from csv_template_ingester.output_cache import OutputCache, main
+
+EXAMPLE = './test_files/template_example.csv'
+
+
+def test_convert_with_output_cache(tmpdir):
+    cache = OutputCache(str(tmpdir.join('cache')))
+    expected = [p.as_dictionary() for p in convert([EXAMPLE])]
+
+    assert [p.as_dictionary() for p in convert([EXAMPLE], output_cache=cache)] == expected
+    assert (cache.hits, cache.misses) == (0, 1)
+    assert [p.as_dictionary() for p in convert([EXAMPLE], output_cache=cache)] == expected
+    assert list(convert([EXAMPLE], output='dict', output_cache=cache)) == expected
+    assert (cache.hits, cache.misses) == (2, 1)
+
+    copy = str(tmpdir.join('copy.csv'))
+    shutil.copy(EXAMPLE, copy)
+    assert [p.as_dictionary() for p in convert([copy], output_cache=cache)] == expected
+    assert cache.hits == 3
+
+    assert len(list(convert([EXAMPLE], rows=slice(0, 1), output_cache=cache))) == 1
+    assert cache.misses == 2
+    assert len(cache.entries()) == 2
+
+
+def test_output_cache_incomplete(tmpdir):
+    cache = OutputCache(str(tmpdir))
+
+    pifs = convert([EXAMPLE], output_cache=cache)
+    next(pifs)
+    pifs.close()
+
+    with pytest.raises(ValueError):
+        list(convert([EXAMPLE], cell_limit=5, output_cache=cache))
+
+    assert os.listdir(str(tmpdir)) == []
+
+
+def test_output_cache_prune(tmpdir, capsys):
+    cache = OutputCache(str(tmpdir))
+    for i, sheets in enumerate([[0], [1], None]):
+        list(convert(['./test_files/template_example.xls'], sheets=sheets, output_cache=cache))
+        os.utime(cache.entries()[-1][2], (i, i))
+
+    list(convert(['./test_files/template_example.xls'], sheets=[0], output_cache=cache))
+    used, size, path = cache.entries()[0]
+    cache.max_bytes = cache.size - 1
+    assert cache.prune() == 1
+    assert not os.path.exists(path)
+    assert cache.hits == 1 and len(cache.entries()) == 2
+
+    assert main([str(tmpdir), '--clear']) == 0
+    assert cache.entries() == []
+    assert 'Pruned 2 entries' in capsys.readouterr().out
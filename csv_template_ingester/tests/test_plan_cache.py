@@ -0,0 +1,55 @@
+# coding: utf-8
+import json
+import os
+from csv_template_ingester import plan_cache
+from csv_template_ingester.plan_cache import HeaderPlanCache, header_key
+from csv_template_ingester.template_csv_parser import compile_header_plan
+
+HEADERS = ['NAME', 'PROPERTY: Hardness (HV)', 'Martensite PROPERTY: Density (g/cc)', 'UNKNOWN THING']
+
+
+def test_get_plan():
+    cache = HeaderPlanCache(maxsize=2)
+    plan = cache.get_plan(HEADERS)
+    assert plan == compile_header_plan(HEADERS)
+    assert cache.get_plan(list(HEADERS)) is plan
+    assert (cache.hits, cache.misses) == (1, 1)
+
+    cache.get_plan(['NAME'])
+    cache.get_plan(HEADERS)
+    cache.get_plan(['NAME', 'UID'])
+    assert cache.get_plan(HEADERS) is plan
+    assert cache.misses == 3
+    assert len(cache.plans) == 2
+    cache.get_plan(['NAME'])
+    assert cache.misses == 4
+
+
+def test_get_plan_from_directory(tmpdir):
+    directory = str(tmpdir.join('plans'))
+    plan = HeaderPlanCache(directory=directory).get_plan(HEADERS)
+    assert os.listdir(directory) == ['{}.json'.format(header_key(HEADERS))]
+
+    cache = HeaderPlanCache(directory=directory)
+    assert cache.get_plan(HEADERS) == plan
+    assert (cache.hits, cache.misses) == (1, 0)
+
+
+def test_parser_version_change(tmpdir, monkeypatch):
+    directory = str(tmpdir)
+    HeaderPlanCache(directory=directory).get_plan(HEADERS)
+
+    path = os.path.join(directory, '{}.json'.format(header_key(HEADERS)))
+    with open(path) as entry_file:
+        entry = json.load(entry_file)
+    entry['version'] -= 1
+    entry['names'] = ['stale'] * len(HEADERS)
+    with open(path, 'w') as entry_file:
+        json.dump(entry, entry_file)
+
+    cache = HeaderPlanCache(directory=directory)
+    assert cache.get_plan(HEADERS) == compile_header_plan(HEADERS)
+    assert cache.misses == 1
+
+    monkeypatch.setattr(plan_cache, 'HEADER_PARSER_VERSION', plan_cache.HEADER_PARSER_VERSION + 1)
+    assert header_key(HEADERS) != os.path.basename(path)[:-len('.json')]
@@ -0,0 +1,103 @@
+# coding: utf-8
+import logging
+import os
+from csv_template_ingester.converter import convert
+from csv_template_ingester import row_store
+from csv_template_ingester.plan_cache import header_key
+from csv_template_ingester.row_store import RowStore, convert_incremental, source_key
+
+HEADER = 'NAME,PROPERTY: Hardness (HV),METHOD\n'
+
+
+def write(path, rows):
+    with open(path, 'w') as output_file:
+        output_file.write(HEADER + ''.join(rows))
+
+
+def test_convert_incremental(tmpdir):
+    path = str(tmpdir.join('samples.csv'))
+    write(path, ['a,1,x\n', 'b,2,y\n', 'c,3,z\n', 'c,3,z\n'])
+
+    with RowStore(str(tmpdir.join('rows.sqlite'))) as store:
+        changes = list(convert_incremental([path], store))
+        assert [change.row_number for change in changes] == [1, 2, 3]
+        assert [change.pif.as_dictionary() for change in changes] == [p.as_dictionary() for p in convert([path])][:3]
+        first_hashes = [change.row_hash for change in changes]
+        assert list(convert_incremental([path], store)) == []
+
+        write(path, ['a,1,x\n', 'b,20,y\n', 'd,4,w\n'])
+        changes = list(convert_incremental([path], store, output='dict'))
+        assert [(change.row_number, change.removed) for change in changes] == [(2, False), (3, False),
+                                                                                (None, True), (None, True)]
+        assert changes[0].pif == [p.as_dictionary() for p in convert([path])][1]
+        assert set(change.row_hash for change in changes[2:]) == set(first_hashes[1:])
+
+    with RowStore(str(tmpdir.join('rows.sqlite'))) as store:
+        assert list(convert_incremental([path], store)) == []
+        store.forget_source(source_key(path))
+        assert len(list(convert_incremental([path], store))) == 3
+
+
+def test_convert_incremental_diagnostics(tmpdir, caplog):
+    path = str(tmpdir.join('unknown.csv'))
+    with open(path, 'w') as output_file:
+        output_file.write('NAME,NOT A KEYWORD\na,x\nb,x\nc,x\n')
+
+    reports = []
+    with RowStore(str(tmpdir.join('rows.sqlite'))) as store:
+        assert len(list(convert_incremental([path], store, diagnostics=reports))) == 3
+    assert caplog.records == []
+
+    expected = []
+    list(convert([path], diagnostics=expected))
+    assert [report.source for report in reports] == [path]
+    assert reports[0].items() == expected[0].items()
+
+    with RowStore(str(tmpdir.join('logged.sqlite'))) as store:
+        with caplog.at_level(logging.WARNING, logger='csv_template_ingester'):
+            list(convert_incremental([path], store))
+    assert len(caplog.records) == 1
+
+
+def test_row_store_version(tmpdir, monkeypatch):
+    path = str(tmpdir.join('samples.csv'))
+    write(path, ['a,1,x\n'])
+
+    with RowStore(str(tmpdir.join('rows.sqlite'))) as store:
+        monkeypatch.setattr(row_store, 'ROW_STORE_VERSION', 1)
+        old_key = row_store.row_hash(header_key(HEADER.strip().split(',')), ['a', '1', 'x'])
+        store.put_pifs([(old_key, '{"category": "system.chemical", "names": ["stale"]}')])
+        monkeypatch.undo()
+
+        changes = list(convert_incremental([path], store))
+        assert [change.row_hash for change in changes] != [old_key]
+        assert [change.pif.as_dictionary() for change in changes] == [p.as_dictionary() for p in convert([path])]
+
+
+def test_row_store_eviction(tmpdir):
+    path = str(tmpdir.join('samples.csv'))
+    write(path, ['{0},{0},x\n'.format(i) for i in range(20)])
+
+    with RowStore(str(tmpdir.join('rows.sqlite')), max_bytes=1000) as store:
+        changes = list(convert_incremental([path], store))
+        assert 0 < store.size <= 1000
+        assert len(store.get_pifs(change.row_hash for change in changes)) < 20
+
+        store.forget_source(source_key(path))
+        assert [change.pif.as_dictionary() for change in convert_incremental([path], store)] == \
+            [change.pif.as_dictionary() for change in changes]
+
+
+def test_row_store_shared(tmpdir):
+    database = str(tmpdir.join('rows.sqlite'))
+    first = str(tmpdir.join('first.csv'))
+    second = str(tmpdir.join('second.csv'))
+    write(first, ['a,1,x\n', 'b,2,y\n'])
+    write(second, ['b,2,y\n'])
+
+    with RowStore(database) as store, RowStore(database) as other:
+        changes = convert_incremental([first], store)
+        next(changes)
+        assert [change.row_number for change in convert_incremental([second], other)] == [1]
+        assert len(list(changes)) == 1
+        assert os.path.exists(database)
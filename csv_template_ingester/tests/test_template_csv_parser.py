@@ -1,6 +1,7 @@
 from csv_template_ingester.template_csv_parser import *
 from pypif.obj import *
 import pytest
+import time
 
 
 def test_get_units():
@@ -54,6 +55,52 @@ def test_split_on_keyword():
     assert len(pieces_three) == 3
     assert pieces_three[1] == 'processstep'
 
+    pieces_four = split_on_keyword('SUBSYSTEM A PREPARATION STEP DETAIL: Time (s)')
+    assert pieces_four[:2] == ['subsystema', 'preparationstepdetail']
+
+
+def test_parse_header_cell():
+    cell = parse_header_cell('SUBSYSTEM A PROPERTY: Hardness (HV)')
+    assert cell == HeaderCell('subsystema', 'property', 'Hardness', 'HV')
+
+    cell_two = parse_header_cell('PROPERTY: Name ((test)) (unit)')
+    assert cell_two == HeaderCell('main', 'PROPERTY', 'Name (test)', 'unit')
+    cell_three = parse_header_cell('PROPERTY: Name (A\\(B\\))')
+    assert cell_three == HeaderCell('main', 'PROPERTY', 'Name', 'A(B)')
+    assert get_units('Property name ((a)) (unit)\nsecond line (other unit)') == ('other unit',
+                                                                                'Property name (a) (unit)\nsecond line')
+
+
+def _parse_seconds(header):
+    """
+    :return: best time of a few runs of parse_header_cell and split_on_keyword on a header cell
+    """
+
+    best = None
+    for _ in range(3):
+        start = time.time()
+        parse_header_cell(header)
+        split_on_keyword(header)
+        elapsed = time.time() - start
+        best = elapsed if best is None else min(best, elapsed)
+
+    return best
+
+
+@pytest.mark.parametrize('make_header', [
+    lambda n: ')' + '(a' * n,
+    lambda n: 'PROPERTY: x' + '(a' * n + '))((',
+    lambda n: 'PROPERTY: ' + '\\(' * n + ')',
+    lambda n: 'PROPERTY: ' + '(' * n + 'a' + ')' * n,
+    lambda n: 'SUBSYSTEM ' + 'ab ' * n + 'PROPERTY: a',
+    lambda n: 'SUBSYSTEM ' + 'nam' * n + 'name',
+])
+def test_pathological_headers(make_header):
+    # 8 times the tokens take about 8 times as long in linear time and 64 times as long in quadratic time
+    small = _parse_seconds(make_header(5000))
+    large = _parse_seconds(make_header(40000))
+    assert large < 24 * max(small, 1e-4)
+
 
 def test_add_contacts():
     syst = add_contacts(ChemicalSystem(), 'Joanne Hill', ['name', 'url'], 0)
@@ -118,6 +165,23 @@ def test_add_reference():
     assert syst.references[1].doi == '10.10102'
 
 
+def test_add_reference_slots():
+    names = ['DOI', 'Title', 'Citation', 'doi', 'year'] * 50
+    syst = ChemicalSystem()
+    for j, name in enumerate(names):
+        syst = add_reference(syst, '' if name == 'year' else '{} {}'.format(name, j), names, j)
+
+    assert len(syst.references) == 200
+    assert [reference.as_dictionary() for reference in syst.references[:4]] == [
+        {'doi': 'DOI 0', 'title': 'Title 1'}, {}, {'doi': 'doi 3'}, {'doi': 'DOI 5'}]
+
+    syst = ChemicalSystem(contacts=Person(name='Jo'))
+    syst = add_contacts(syst, 'jo@email', ['name', 'E-mail'], 1)
+    syst = add_contacts(syst, 'Joanne', ['Name'], 0)
+    assert [person.as_dictionary() for person in syst.contacts] == [{'name': 'Jo', 'email': 'jo@email'},
+                                                                    {'name': 'Joanne'}]
+
+
 def test_get_header_info():
     keywords, names, units, systs = get_header_info(['IDENTIFIER', 'PROPERTY: Hardness (HV)'])
     assert keywords[0] == 'IDENTIFIER'
@@ -132,6 +196,12 @@ def test_add_fields():
     assert all_condition == []
     assert len(sys_dict) == 1
 
+    handlers = [get_field_handler('IDENTIFIER'), get_field_handler('ALL CONDITION')]
+    sys_dict, all_condition = add_fields(['IDENTIFIER', 'ALL CONDITION'], ['', 'Temperature'], ['', 'K'],
+                                         ['main', 'main'], {}, ['1234', '273'], handlers)
+    assert sys_dict['main'].ids[0].value == '1234'
+    assert all_condition[0].name == 'Temperature'
+
 
 def test_add_all_condition():
     all_conditions = add_all_condition([], '273', ['Temperature'], ['K'], 0)
@@ -232,4 +302,81 @@ def test_is_list():
 def test_create_list():
     lst = create_list('[1, 2, 3, 4]')
     assert len(lst) == 4
-    assert lst[1] == '2'
\ No newline at end of file
+    assert lst[1] == '2'
+
+
+def test_compile_header_plan():
+    plan = compile_header_plan(['NAME', 'SUBSYSTEM A PROPERTY: Hardness (HV)'])
+    assert plan.keywords == ('NAME', 'property')
+    assert plan.systs == ('main', 'subsystema')
+    assert plan.columns[1].name == 'Hardness'
+    assert plan.columns[1].unit == 'HV'
+    assert plan.columns[1].handler is FIELD_HANDLERS['property']
+    assert plan.handlers[0] is FIELD_HANDLERS['name']
+
+    assert compile_header_plan(['NAME', 'NOT A KEYWORD']).handlers[1] is None
+
+    plan = compile_header_plan(['NAME', 'CONTACT: E-mail', 'REFERENCE: DOI'])
+    assert plan.slots == (None, 'email', 'doi')
+    assert plan.columns[1].slot == 'email'
+    assert plan.handlers[2] == SlotHandler(FIELD_HANDLERS['reference'], 'doi')
+    syst = ChemicalSystem()
+    plan.handlers[1](syst, 'jo@email', plan.names, plan.units, 1, [])
+    assert syst.contacts[0].email == 'jo@email'
+
+
+def test_get_field_handler():
+    assert get_field_handler('PREPARATION STEP NAME') is get_field_handler('Process step name')
+    assert get_field_handler('COMPOSITION') is get_field_handler('IDEAL COMPOSITION')
+    assert get_field_handler('UNKNOWN') is None
+
+
+def test_find_parents():
+    plan = compile_header_plan(['NAME', 'PROPERTY: H (HV)', 'CONDITION: T (K)', 'PREPARATION STEP NAME',
+                                'PREPARATION STEP DETAIL: T (K)', 'PROPERTY: E', 'METHOD'])
+    assert [column.parent for column in plan.columns] == [None, None, 1, None, 3, None, 5]
+
+    with pytest.raises(ValueError):
+        compile_header_plan(['NAME', 'CONDITION: T (K)', 'PROPERTY: H'])
+    with pytest.raises(ValueError):
+        compile_header_plan(['NAME', 'PREPARATION STEP DETAIL: T (K)'])
+    with pytest.raises(ValueError):
+        compile_header_plan(['NAME', 'PROPERTY: H', 'SUBSYSTEM A CONDITION: T (K)'])
+
+
+def test_add_many_conditions():
+    names = ['Hardness'] + ['T{}'.format(i) for i in range(50)]
+    units = ['HV'] + ['K'] * 50
+    syst = System()
+    add_property(syst, '5', names, units, 0)
+    prop = syst.properties[0]
+    for i in range(1, 51):
+        add_condition(syst, str(i), names, units, i)
+
+    assert syst.properties[0] is prop
+    assert len(prop.conditions) == 50
+    assert prop.conditions[49].name == 'T49'
+
+
+def test_row_columns():
+    plan = compile_header_plan(['NAME', 'UID', 'PREPARATION STEP NAME', 'PREPARATION STEP DETAIL: T (K)',
+                                'PREPARATION STEP NAME', 'PREPARATION STEP DETAIL: t (s)', 'PROPERTY: H (HV)',
+                                'SUBSYSTEM A PREPARATION STEP NAME', 'NOT A KEYWORD'])
+    assert plan.placeholders == (1, 2, 7, 8)
+    assert plan.detail_steps == {3: 2, 5: 4}
+
+    assert row_columns(plan, ['a', '', '', '', '', '', '', '', '']) == [0, 1, 2, 7, 8]
+    assert row_columns(plan, ['a', '', '', '', '', '5', '', '', '']) == [0, 1, 2, 4, 5, 7, 8]
+    assert row_columns(plan, ['a', '', '']) == [0, 1, 2]
+
+    for row in (['a', '', '', '', '', '5', '', '', ''], ['a', '', 'Anneal', '', '', '', '3', '', 'x'],
+                ['a', '', '', '1', 'Quench', '', '', '', '']):
+        dense, _ = add_fields(plan.keywords, plan.names, plan.units, plan.systs, {}, row, plan.handlers, {})
+        sparse, _ = add_fields(plan.keywords, plan.names, plan.units, plan.systs, {}, row, plan.handlers, {},
+                               row_columns(plan, row))
+        assert sorted(dense) == sorted(sparse)
+        # the main system keeps only named steps
+        for systems in (dense, sparse):
+            systems['main'].preparation = [step for step in systems['main'].preparation if step.name != '']
+        for syst in dense:
+            assert dense[syst].as_dictionary() == sparse[syst].as_dictionary()
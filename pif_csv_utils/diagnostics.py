@@ -0,0 +1,140 @@
+# coding: utf-8
+"""
+Diagnostics raised while converting rows, such as unknown headers. During convert() they are counted in a
+DiagnosticsReport per file instead of being written out for every row; elsewhere they go to the
+'csv_template_ingester' logger as they happen.
+"""
+import logging
+import threading
+from collections import OrderedDict
+
+logger = logging.getLogger('csv_template_ingester')
+
+UNKNOWN_HEADERS = 'Unknown header(s) for column(s) %s.'
+
+MANUAL_UIDS = ('UIDs manually added. If two systems have the same then one will be overwritten by the information '
+               'in the other. Please make sure all UIDs are unique.')
+
+# Number of row numbers kept as samples for each message
+SAMPLE_ROWS = 5
+
+_state = threading.local()
+
+
+def warn(message, *args):
+    """
+    Records a diagnostic in the report of the row being converted, or logs it if no report is collecting
+
+    :param message: message, formatted with args as in logging only when the report is read
+    :param args: arguments of the message
+    """
+
+    report = getattr(_state, 'report', None)
+    if report is None:
+        logger.warning(message, *args)
+    else:
+        report.add(message, args, report.row_number)
+
+
+class MessageStats(object):
+    """
+    Count and sample row numbers of one message in a report
+    """
+
+    __slots__ = ('count', 'rows')
+
+    def __init__(self):
+        self.count = 0
+        self.rows = []
+
+
+class DiagnosticsReport(object):
+    """
+    Unique diagnostics of a file, each with the number of times it was raised and the first row numbers it was
+    raised for
+    """
+
+    def __init__(self, source=None):
+        """
+        Constructor.
+
+        :param source: path of the file the report is for
+        """
+        self.source = source
+        self.messages = OrderedDict()
+        self.row_number = None
+
+    def activate(self, row_number=None):
+        """
+        Collects the diagnostics of the current thread into this report until deactivate is called
+
+        :param row_number: number of the row being converted
+        """
+        self.row_number = row_number
+        _state.report = self
+
+    def deactivate(self):
+        if getattr(_state, 'report', None) is self:
+            _state.report = None
+
+    def add(self, message, args=(), row_number=None):
+        """
+        Records one diagnostic
+
+        :param message: message, formatted with args
+        :param args: tuple of the arguments of the message
+        :param row_number: row the diagnostic was raised for, if known
+        """
+
+        key = (message, args)
+        stats = self.messages.get(key)
+        if stats is None:
+            stats = self.messages[key] = MessageStats()
+
+        stats.count += 1
+        if row_number is not None and len(stats.rows) < SAMPLE_ROWS:
+            stats.rows.append(row_number)
+
+    def merge(self, other):
+        """
+        Adds the diagnostics of another report, e.g. the report of a later block of rows of the same file. Sample row
+        numbers are taken from this report first.
+
+        :param other: DiagnosticsReport to add
+        """
+
+        for key, other_stats in other.messages.items():
+            stats = self.messages.get(key)
+            if stats is None:
+                stats = self.messages[key] = MessageStats()
+
+            stats.count += other_stats.count
+            stats.rows.extend(other_stats.rows[:SAMPLE_ROWS - len(stats.rows)])
+
+    def __len__(self):
+        return len(self.messages)
+
+    def items(self):
+        """
+        :return: list of (formatted message, count, sample row numbers) in the order the messages were first raised
+        """
+        return [(message % args if args else message, stats.count, list(stats.rows))
+                for (message, args), stats in self.messages.items()]
+
+    def as_dictionary(self):
+        return {'source': self.source,
+                'messages': [{'message': message, 'count': count, 'rows': rows}
+                             for message, count, rows in self.items()]}
+
+    def log(self, level=logging.WARNING):
+        """
+        Logs each unique message once to the 'csv_template_ingester' logger
+        """
+
+        prefix = '{}: '.format(self.source) if self.source else ''
+        for message, count, rows in self.items():
+            if rows:
+                logger.log(level, '%s%s (%d row(s), e.g. rows %s)', prefix, message, count,
+                           ', '.join(str(row) for row in rows))
+            else:
+                logger.log(level, '%s%s (%d row(s))', prefix, message, count)
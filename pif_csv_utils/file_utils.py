@@ -1,23 +1,368 @@
 # coding: utf-8
+import codecs
 import csv
+import gzip
+import io
+import os
+import re
+import sys
+from collections import namedtuple, OrderedDict
+from pypif import pif
+from pif_csv_utils.general import to_text
 
 
-def get_data_from_csv(csv_file):
+SAMPLE_SIZE = 64 * 1024
+
+# Byte order marks and the codecs that strip them, longest first as the UTF-32 LE mark starts with the UTF-16 LE one
+BYTE_ORDER_MARKS = (
+    (codecs.BOM_UTF32_LE, 'utf-32'),
+    (codecs.BOM_UTF32_BE, 'utf-32'),
+    (codecs.BOM_UTF8, 'utf-8-sig'),
+    (codecs.BOM_UTF16_LE, 'utf-16'),
+    (codecs.BOM_UTF16_BE, 'utf-16'),
+)
+
+LATIN_1_FALLBACK = 'pif_csv_utils.latin_1_fallback'
+
+
+def _latin_1_fallback(error):
+    """
+    Codec error handler that decodes the bytes a codec rejects as latin-1, as decode_string did cell by cell
+    """
+
+    return error.object[error.start:error.end].decode('latin-1'), error.end
+
+
+codecs.register_error(LATIN_1_FALLBACK, _latin_1_fallback)
+
+
+def sniff_encoding(sample):
+    """
+    Detect the encoding of a file from a sample of its first bytes
+
+    :param sample: bytes from the start of the file
+    :return: name of the codec to read the file with. A byte order mark picks the codec that strips it, otherwise
+        utf-8 if the sample decodes as utf-8 and latin-1 if not
+    """
+
+    for mark, encoding in BYTE_ORDER_MARKS:
+        if sample.startswith(mark):
+            return encoding
+
+    try:
+        # final=False so that a character cut by the end of the sample is not an error
+        codecs.getincrementaldecoder('utf-8')().decode(sample, False)
+    except UnicodeDecodeError:
+        return 'latin-1'
+
+    return 'utf-8'
+
+
+# Candidate delimiters, in order of preference when several fit the sample equally well
+DELIMITERS = (',', '\t', ';', '|')
+
+LINE_PATTERN = re.compile(r'[^\r\n]*(?:\r\n|\r|\n)|[^\r\n]+')
+
+# A cell quoted with single quotes that holds the delimiter, between line boundaries or delimiters. {0} is the
+# escaped delimiter
+SINGLE_QUOTED_DELIMITER_PATTERN = r"(?:^|{0})'[^'\r\n]*{0}[^'\r\n]*'(?={0}|[\r\n]|$)"
+
+
+def _split_lines(text):
+    """
+    Split text into lines on \\r\\n, \\r or \\n only, keeping the line endings, unlike str.splitlines which also
+    splits on characters csv reads as part of a cell
+    """
+
+    return LINE_PATTERN.findall(text)
+
+
+def sniff_dialect(sample, delimiter=None, truncated=True):
+    """
+    Detect the delimiter, quote character and line terminator of a table from a sample of its text
+
+    Single quotes are taken as the quote character only if the sample has no double quotes and a cell enclosed in
+    single quotes holds the delimiter, so that single quotes that are part of the data, as in 'abc' or O'Brien, are
+    kept. The delimiter is the candidate from DELIMITERS that splits the header row into more than one cell and
+    gives the most sampled data rows the same number of cells as the header; ties go to the earlier candidate, and
+    a table with a single column is read as comma separated.
+
+    :param sample: text from the start of the file
+    :param delimiter: known delimiter, only the quote character and line terminator are sniffed if given
+    :param truncated: True if the sample may end part way through a line, which is then left out
+    :return: delimiter, quote character, line terminator
+    """
+
+    lines = _split_lines(sample)
+    if truncated and len(lines) > 1:
+        lines = lines[:-1]
+
+    ending = re.search(r'\r\n|\r|\n', sample)
+    lineterminator = ending.group(0) if ending else '\r\n'
+
+    if delimiter is not None:
+        return delimiter, _sniff_quotechar(sample, delimiter), lineterminator
+
+    delimiter = ','
+    quotechar = _sniff_quotechar(sample, delimiter)
+    best = None
+    for candidate in DELIMITERS:
+        candidate_quotechar = _sniff_quotechar(sample, candidate)
+        rows = _sample_rows(lines, candidate, candidate_quotechar)
+        if not rows or len(rows[0]) < 2:
+            continue
+
+        score = (sum(1 for row in rows[1:] if len(row) == len(rows[0])), len(rows[0]))
+        if best is None or score > best:
+            delimiter, quotechar, best = candidate, candidate_quotechar, score
+
+    return delimiter, quotechar, lineterminator
+
+
+def _sniff_quotechar(sample, delimiter):
+    """
+    :return: the quote character of a table with the given delimiter, single quotes only if the sample has no double
+        quotes and a cell enclosed in single quotes holds the delimiter
+    """
+
+    if '\"' not in sample and re.search(SINGLE_QUOTED_DELIMITER_PATTERN.format(re.escape(delimiter)), sample,
+                                         re.MULTILINE):
+        return "'"
+
+    return '\"'
+
+
+def _sample_rows(lines, delimiter, quotechar):
+    """
+    :return: rows of the sampled lines, as far as they parse
+    """
+
+    rows = []
+    try:
+        for row in csv.reader(lines, delimiter=delimiter, quotechar=quotechar):
+            rows.append(row)
+    except csv.Error:
+        pass
+
+    return rows
+
+
+def _replay_lines(sample, text_file):
+    """
+    Lines of a text file whose first characters have already been read
+
+    :param sample: text already read from the file
+    :param text_file: the file, positioned after the sample
+    :return: yields the lines of the whole file
+    """
+
+    lines = _split_lines(sample)
+    if lines and not lines[-1].endswith(('\n', '\r')):
+        lines[-1] += text_file.readline()
+
+    rest = iter(text_file)
+    line = None
+    if lines and lines[-1].endswith('\r'):
+        # the end of the sample may have cut a \r\n line ending in two
+        line = next(rest, None)
+        if line is not None and line.startswith('\n'):
+            lines[-1] += '\n'
+            line = line[1:]
+
+    for sampled in lines:
+        yield sampled
+
+    if line:
+        yield line
+
+    for line in rest:
+        yield line
+
+
+def _read_sample(binary_file, sample_size):
+    """
+    Read up to sample_size bytes, reading again where a stream such as a pipe returns less than asked for
+    """
+
+    chunks = []
+    remaining = sample_size
+    while remaining > 0:
+        chunk = binary_file.read(remaining)
+        if not chunk:
+            break
+        chunks.append(chunk)
+        remaining -= len(chunk)
+
+    return b''.join(chunks)
+
+
+class _ReplayStream(io.RawIOBase):
+    """
+    Binary stream that gives the bytes of a sample already read from a stream, then the rest of the stream, so that
+    a non-seekable stream can be sniffed and still read from the start
+    """
+
+    def __init__(self, sample, binary_file):
+        io.RawIOBase.__init__(self)
+        self.sample = sample
+        self.position = 0
+        self.binary_file = binary_file
+
+    def readable(self):
+        return True
+
+    def readinto(self, buffer):
+        if self.position < len(self.sample):
+            data = self.sample[self.position:self.position + len(buffer)]
+            self.position += len(data)
+        else:
+            data = self.binary_file.read(len(buffer))
+
+        buffer[:len(data)] = data
+
+        return len(data)
+
+    def close(self):
+        if not self.closed:
+            self.binary_file.close()
+        io.RawIOBase.close(self)
+
+
+class TableDialect(namedtuple('TableDialect', ['encoding', 'delimiter', 'quotechar', 'lineterminator'])):
+    """
+    Format of a csv or tsv file, see open_table
+
+    :param encoding: codec the file is read with
+    :param delimiter: cell delimiter
+    :param quotechar: quote character
+    :param lineterminator: line ending of the first line
+    """
+
+    __slots__ = ()
+
+
+class _EncodedLines(object):
+    """
+    Python 2 view of a text file that gives utf-8 encoded text, as the Python 2 csv module only reads bytes
+    """
+
+    def __init__(self, text_file):
+        self.text_file = text_file
+
+    def read(self, size=-1):
+        return self.text_file.read(size).encode('utf-8')
+
+    def readline(self):
+        return self.text_file.readline().encode('utf-8')
+
+    def close(self):
+        self.text_file.close()
+
+    def __iter__(self):
+        for line in self.text_file:
+            yield line.encode('utf-8')
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+_DIALECT_CACHE = OrderedDict()
+
+DIALECT_CACHE_SIZE = 256
+
+
+def _dialect_cache_key(file_path):
+    """
+    :return: key of a file in the dialect cache, changing whenever the file is modified
+    """
+
+    stat = os.stat(file_path)
+
+    return os.path.abspath(file_path), stat.st_size, getattr(stat, 'st_mtime_ns', stat.st_mtime)
+
+
+def open_table(source, delimiter=None, sample_size=SAMPLE_SIZE):
+    """
+    Open a csv or tsv file in binary mode and decode it as a stream. A single sample of the first bytes is read to
+    sniff the encoding, byte order mark and dialect, and then replayed, so the file is read once and a non-seekable
+    stream can be read too. The result is cached for files given by path until they change. Bytes that do not
+    decode are read as latin-1. Line endings are translated as in universal newlines mode.
+
+    :param source: path to the csv or tsv file, or a binary file object
+    :param delimiter: known delimiter, sniffed from the sample if None
+    :param sample_size: number of bytes to sniff from
+    :return: open text file, giving utf-8 encoded text on Python 2, and its TableDialect
+    """
+
+    key = None
+    if isinstance(source, (type(b''), type(u''))):
+        key = (_dialect_cache_key(source), delimiter)
+        binary_file = io.open(source, 'rb')
+    else:
+        binary_file = source
+
+    try:
+        dialect = _DIALECT_CACHE.get(key) if key is not None else None
+        if dialect is None:
+            sample = _read_sample(binary_file, sample_size)
+            encoding = sniff_encoding(sample)
+            text = codecs.getincrementaldecoder(encoding)(LATIN_1_FALLBACK).decode(sample, False)
+            dialect = TableDialect(encoding, *sniff_dialect(text, delimiter, len(sample) == sample_size))
+
+            if key is not None:
+                _DIALECT_CACHE[key] = dialect
+                if len(_DIALECT_CACHE) > DIALECT_CACHE_SIZE:
+                    _DIALECT_CACHE.popitem(last=False)
+
+            binary_file = io.BufferedReader(_ReplayStream(sample, binary_file))
+
+        text_file = io.TextIOWrapper(binary_file, encoding=dialect.encoding, errors=LATIN_1_FALLBACK)
+    except Exception:
+        binary_file.close()
+        raise
+
+    return text_file if sys.version_info[0] > 2 else _EncodedLines(text_file), dialect
+
+
+def open_text(source, sample_size=SAMPLE_SIZE):
+    """
+    Open a csv or tsv file in binary mode and decode it as a stream, see open_table
+
+    :param source: path to the csv or tsv file, or a binary file object
+    :param sample_size: number of bytes to sniff the encoding from
+    :return: open text file, giving utf-8 encoded text on Python 2
+    """
+
+    return open_table(source, sample_size=sample_size)[0]
+
+
+def get_data_from_table(table_file, dialect):
     """
-    Get the data from a CSV file
+    Get the data from a file opened with open_table
+    :param table_file: open file from open_table
+    :param dialect: TableDialect from open_table
+    :return: list of table data
+    """
+
+    return csv.reader(table_file, delimiter=dialect.delimiter, quotechar=dialect.quotechar)
+
+
+def get_data_from_csv(csv_file, sample_size=SAMPLE_SIZE):
+    """
+    Get the data from a CSV file. The delimiter and quote character are sniffed from a sample of the file, which is
+    then replayed to the reader, so the file is read once and need not be seekable.
     :param csv_file: open csv file
+    :param sample_size: number of characters to sniff the dialect from
     :return: list of table data
     """
 
-    # rough check for tab separated files
-    if '\t' in csv_file.readline() and ',' not in csv_file.readline():
-        csv_file.seek(0)
-        reader = csv.reader(csv_file, delimiter='\t', quotechar='\"')
-    else:
-        csv_file.seek(0)
-        reader = csv.reader(csv_file, delimiter=',', quotechar='\"')
+    sample = csv_file.read(sample_size)
+    delimiter, quotechar, lineterminator = sniff_dialect(sample, truncated=len(sample) == sample_size)
 
-    return reader
+    return csv.reader(_replay_lines(sample, csv_file), delimiter=delimiter, quotechar=quotechar)
 
 
 def get_data_from_tsv(tsv_file):
@@ -28,3 +373,191 @@ def get_data_from_tsv(tsv_file):
     """
 
     return csv.reader(tsv_file, delimiter='\t', quotechar='\"')
+
+
+def _excel_cell_value(cell, datemode, xlrd):
+    """
+    Get the typed value of a spreadsheet cell
+
+    :param cell: xlrd cell
+    :param datemode: datemode of the workbook
+    :param xlrd: the xlrd module
+    :return: int or float for numbers, text otherwise
+    """
+
+    if cell.ctype == xlrd.XL_CELL_NUMBER:
+        return int(cell.value) if cell.value.is_integer() else cell.value
+    elif cell.ctype == xlrd.XL_CELL_TEXT:
+        return cell.value if sys.version_info[0] > 2 else cell.value.encode('utf-8')
+    elif cell.ctype == xlrd.XL_CELL_DATE:
+        return xlrd.xldate.xldate_as_datetime(cell.value, datemode).isoformat()
+    elif cell.ctype == xlrd.XL_CELL_BOOLEAN:
+        return 'TRUE' if cell.value else 'FALSE'
+
+    return ''
+
+
+def _get_rows_from_sheet(sheet, datemode, xlrd):
+    """
+    Get the rows of a spreadsheet one at a time. The header row is returned as text
+
+    :param sheet: xlrd sheet
+    :param datemode: datemode of the workbook
+    :param xlrd: the xlrd module
+    :return: yields lists of cell values
+    """
+
+    header_read = False
+
+    for i in range(sheet.nrows):
+        row = [_excel_cell_value(cell, datemode, xlrd) for cell in sheet.row(i)]
+
+        if not header_read and any(row):
+            row = [to_text(value) for value in row]
+            header_read = True
+
+        yield row
+
+
+def get_data_from_excel(excel_path, sheets=None):
+    """
+    Get the data from an XLS/XLSX workbook. Sheets are loaded one at a time and released once read.
+    Numbers are returned as int or float rather than text.
+
+    :param excel_path: path of the workbook
+    :param sheets: names or indices of the sheets to read, defaults to every sheet
+    :return: yields a row iterator per sheet, each must be read before the next sheet is loaded
+    """
+
+    import xlrd
+
+    if excel_path.endswith('.xlsx') and int(xlrd.__VERSION__.split('.')[0]) >= 2:
+        raise IOError('Reading .xlsx files needs xlrd<2, xlrd {} only reads .xls files.\n'.format(xlrd.__VERSION__))
+
+    book = xlrd.open_workbook(excel_path, on_demand=True)
+    try:
+        for selected in range(book.nsheets) if sheets is None else sheets:
+            if isinstance(selected, int):
+                sheet = book.sheet_by_index(selected)
+            else:
+                sheet = book.sheet_by_name(selected)
+
+            yield _get_rows_from_sheet(sheet, book.datemode, xlrd)
+
+            book.unload_sheet(sheet.name)
+    finally:
+        book.release_resources()
+
+
+class TableSizeEstimate(namedtuple('TableSizeEstimate', ['file_size', 'sample_rows', 'row_width', 'columns',
+                                                         'rows', 'cells'])):
+    """
+    Estimated size of a table, see estimate_table_size
+
+    :param file_size: size of the file in bytes
+    :param sample_rows: number of data rows in the sample
+    :param row_width: mean width of the sampled data rows in bytes
+    :param columns: number of columns in the header row
+    :param rows: estimated number of data rows
+    :param cells: estimated number of cells (rows * columns)
+    """
+
+    __slots__ = ()
+
+
+def estimate_table_size(file_path, sample_size=64 * 1024):
+    """
+    Estimate the size of a table from os.stat and a sample from the start of the file, without reading the whole file
+
+    :param file_path: path to the csv or tsv file
+    :param sample_size: number of bytes to sample
+    :return: TableSizeEstimate
+    """
+
+    file_size = os.stat(file_path).st_size
+
+    with open(file_path, 'rb') as input_file:
+        sample = input_file.read(sample_size)
+
+    lines = sample.splitlines(True)
+    if len(sample) < file_size and len(lines) > 1:
+        # the last line of a partial sample is cut short
+        lines = lines[:-1]
+
+    if not lines:
+        return TableSizeEstimate(file_size, 0, 0, 0, 0, 0)
+
+    text = sample.decode('latin-1') if str is not bytes else sample
+    delimiter, quotechar, lineterminator = sniff_dialect(text, '\t' if file_path.endswith('.tsv') else None,
+                                                         len(sample) < file_size)
+    header = lines[0].decode('latin-1') if str is not bytes else lines[0]
+    columns = len(next(csv.reader([header], delimiter=delimiter, quotechar=quotechar)))
+
+    data_lines = lines[1:]
+    if not data_lines:
+        return TableSizeEstimate(file_size, 0, 0, columns, 0, 0)
+
+    row_width = float(sum(len(line) for line in data_lines)) / len(data_lines)
+    rows = int(round((file_size - len(lines[0])) / row_width))
+
+    return TableSizeEstimate(file_size, len(data_lines), row_width, columns, rows, rows * columns)
+
+
+def open_output(output_path, compress=False):
+    """
+    Open a text file to write PIFs to
+
+    :param output_path: path of the file to write
+    :param compress: gzip the output if True
+    :return: open file
+    """
+
+    if compress:
+        return gzip.open(output_path, 'wt' if sys.version_info[0] > 2 else 'wb')
+
+    return open(output_path, 'w')
+
+
+def write_pifs(pifs, output_file, output_format='json', flush_every=1000, indent=None):
+    """
+    Stream PIFs to a file one record at a time, so memory stays flat however many PIFs there are
+
+    :param pifs: iterable of pypif objects or already serialized PIFs (JSON strings, written as given)
+    :param output_file: open file to write to
+    :param output_format: 'json' for a JSON array, 'jsonl' for one PIF per line
+    :param flush_every: flush the file after this many records
+    :param indent: indent for the json format, as in json.dump
+    :return: number of PIFs written
+    """
+
+    if output_format not in ('json', 'jsonl'):
+        raise ValueError('Output format must be json or jsonl, not {}'.format(output_format))
+
+    as_array = output_format == 'json'
+    prefix = ' ' * indent if as_array and indent else ''
+    separator = ',\n' + prefix if as_array else '\n'
+
+    count = 0
+    for count, record in enumerate(pifs, 1):
+        if not isinstance(record, str):
+            record = pif.dumps(record, indent=indent if as_array else None)
+            if prefix:
+                record = record.replace('\n', '\n' + prefix)
+
+        if count == 1:
+            output_file.write('[\n' + prefix if as_array else '')
+        else:
+            output_file.write(separator)
+        output_file.write(record)
+
+        if count % flush_every == 0:
+            output_file.flush()
+
+    if as_array:
+        output_file.write('\n]' if count else '[]')
+    elif count:
+        output_file.write('\n')
+
+    output_file.flush()
+
+    return count
@@ -1,4 +1,10 @@
 import re
+import sys
+
+if sys.version_info[0] > 2:
+    NUMBER_TYPES = (int, float)
+else:
+    NUMBER_TYPES = (int, long, float)
 
 
 def normalize(string):
@@ -54,3 +60,19 @@ def decode_string(string):
         pass
 
     return string
+
+
+def to_text(value):
+    """
+    Converts a typed cell value, such as a number read from a spreadsheet, to the text a CSV file would hold
+
+    :param value: the value to convert
+    :return: text for numbers, other values unchanged
+    """
+
+    if isinstance(value, float):
+        return repr(value)
+    elif isinstance(value, NUMBER_TYPES):
+        return str(value)
+
+    return value
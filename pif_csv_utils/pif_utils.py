@@ -1,6 +1,9 @@
 # coding: utf-8
+import copy
+from collections import OrderedDict
 from pypif.obj import *
 from pif_csv_utils.general import *
+from pif_csv_utils.diagnostics import warn, MANUAL_UIDS, UNKNOWN_HEADERS
 
 
 def add_uid(systm, uid):
@@ -19,7 +22,7 @@ def add_uid(systm, uid):
         raise ValueError('You are trying to add multiple UIDs to a system. Each ChemicalSystem can only have 1 UID')
     elif uid:
         systm.uid = re.sub(r'\W', '', uid)
-        print ('UIDs manually added. If two systems have the same then one will be overwritten by the information in the other. Please make sure all UIDs are unique.')
+        warn(MANUAL_UIDS)
 
     return systm
 
@@ -67,6 +70,48 @@ def add_name(systm, systm_name):
     return systm
 
 
+METHOD_BEFORE_PROPERTY = 'Method details provided before a property was specified. Method columns must appear to the right of the property they belong to.\n'
+
+NUMBER_BEFORE_PROPERTY = 'Number details provided before a property was specified. Number columns must appear to the right of the property they belong to.\n'
+
+CAPTION_BEFORE_PROPERTY = 'Caption details provided before a property was specified. Caption columns must appear to the right of the property they belong to.\n'
+
+DATATYPE_BEFORE_PROPERTY = 'Data type provided before a property was specified. Data type columns must appear to the right of the property that they belong to.\n'
+
+
+def last_property(systm, message):
+    """
+    Gets the property that a detail column adds to, the last property in a system
+
+    :param systm: system object
+    :param message: error message if the system has no property yet
+    :return: property object
+    """
+
+    if not systm.properties:
+        raise ValueError(message)
+
+    return systm.properties[-1]
+
+
+def child_list(parent, attribute):
+    """
+    Gets a list attribute of an object to append to in place, creating it or wrapping a single value as needed
+
+    :param parent: object holding the list
+    :param attribute: name of the list attribute
+    :return: the list held by the object
+    """
+
+    children = getattr(parent, attribute)
+    if not children:
+        setattr(parent, attribute, [])
+    elif not isinstance(children, list):
+        setattr(parent, attribute, [children])
+
+    return getattr(parent, attribute)
+
+
 def add_method(systm, method_value):
     """
     Adds a method to the last property in a system
@@ -77,27 +122,35 @@ def add_method(systm, method_value):
     """
 
     if method_value:
-        if systm.properties:
-            prop = systm.properties[-1]
-        else:
-            raise ValueError(
-                'Method details provided before a property was specified. Method columns must appear to the right of the property they belong to.\n')
-
-        if prop.methods:
-            prop.methods = listify(prop.methods)
-        else:
-            prop.methods = []
+        prop = last_property(systm, METHOD_BEFORE_PROPERTY)
 
         new_method = Method()
         new_method.name = method_value
 
-        prop.methods.append(new_method)
-
-        systm.properties[-1] = prop
+        child_list(prop, 'methods').append(new_method)
 
     return systm
 
 
+def _display_item(systm, value, source_type, attribute, message):
+    """
+    Sets the number or caption of the figure or table of the first reference of the last property in a system
+    """
+
+    prop = last_property(systm, message)
+
+    references = child_list(prop, 'references')
+    if not references:
+        references.append(Reference())
+
+    display_item = getattr(references[0], source_type)
+    if not display_item:
+        display_item = DisplayItem()
+        setattr(references[0], source_type, display_item)
+
+    setattr(display_item, attribute, value)
+
+
 def add_number(systm, number_value, source_type):
     """
     Adds a number to the last property in a system
@@ -109,27 +162,8 @@ def add_number(systm, number_value, source_type):
     """
 
     if number_value:
-        if systm.properties:
-            prop = systm.properties[-1]
-        else:
-            raise ValueError(
-                'Number details provided before a property was specified. Number columns must appear to the right of the property they belong to.\n')
-
-        if prop.references:
-            prop.references = listify(prop.references)
-        else:
-            prop.references = [Reference()]
-
-        if source_type == 'figure':
-            if not prop.references[0].figure:
-                prop.references[0].figure = DisplayItem()
-            prop.references[0].figure.number = number_value
-        else:
-            if not prop.references[0].table:
-                prop.references[0].table = DisplayItem()
-            prop.references[0].table.number = number_value
-
-        systm.properties[-1] = prop
+        _display_item(systm, number_value, 'figure' if source_type == 'figure' else 'table', 'number',
+                      NUMBER_BEFORE_PROPERTY)
 
     return systm
 
@@ -144,27 +178,8 @@ def add_caption(systm, caption_value, source_type):
     """
 
     if caption_value:
-        if systm.properties:
-            prop = systm.properties[-1]
-        else:
-            raise ValueError(
-                'Caption details provided before a property was specified. Caption columns must appear to the right of the property they belong to.\n')
-
-        if prop.references:
-            prop.references = listify(prop.references)
-        else:
-            prop.references = [Reference()]
-
-        if source_type == 'figure':
-            if not prop.references[0].figure:
-                prop.references[0].figure = DisplayItem()
-            prop.references[0].figure.caption = caption_value
-        else:
-            if not prop.references[0].table:
-                prop.references[0].table = DisplayItem()
-            prop.references[0].table.caption = caption_value
-
-        systm.properties[-1] = prop
+        _display_item(systm, caption_value, 'figure' if source_type == 'figure' else 'table', 'caption',
+                      CAPTION_BEFORE_PROPERTY)
 
     return systm
 
@@ -179,16 +194,7 @@ def add_datatype(systm, datatype):
     """
 
     if datatype:
-
-        if systm.properties:
-            prop = systm.properties[-1]
-        else:
-            raise ValueError(
-                'Data type provided before a property was specified. Data type columns must appear to the right of the property that they belong to.\n')
-
-        prop.data_type = datatype
-
-        systm.properties[-1] = prop
+        last_property(systm, DATATYPE_BEFORE_PROPERTY).data_type = datatype
 
     return systm
 
@@ -206,11 +212,7 @@ def add_preparation_step(systm, preparation_step_name):
 
     step.name = preparation_step_name
 
-    if systm.preparation:
-        systm.preparation = listify(systm.preparation)
-        systm.preparation.append(step)
-    else:
-        systm.preparation = [step]
+    child_list(systm, 'preparation').append(step)
 
     return systm
 
@@ -252,63 +254,60 @@ def property_merge(properties_list):
         for i, p in enumerate(prop_dict[item]):
             if i == 0:
                 if p.scalars:
-                    if not isinstance(p.scalars, list):
-                        p.scalars = [p.scalars]
+                    p.scalars = list(listify(p.scalars))
                     if p.conditions:
-                        for c in p.conditions:
-                            if not isinstance(c.scalars, list):
-                                c.scalars = [c.scalars]
+                        # conditions may be shared with other properties of the same row, e.g. all_conditions
+                        p.conditions = [_copy_value(c) for c in listify(p.conditions)]
                 merged_properties.append(p)
 
             else:
                 if p.scalars:
-                    if not isinstance(p.scalars, list):
-                        merged_properties[-1].scalars.append(p.scalars)
-                    else:
-                        merged_properties[-1].scalars.extend(p.scalars)
+                    merged_properties[-1].scalars.extend(listify(p.scalars))
                     if p.conditions:
-                        for j, c in enumerate(p.conditions):
-                            if not isinstance(c.scalars, list):
-                                merged_properties[-1].conditions[j].scalars.append(c.scalars)
-                            else:
-                                merged_properties[-1].conditions[j].scalars.extend(c.scalars)
+                        for j, c in enumerate(listify(p.conditions)):
+                            merged_properties[-1].conditions[j].scalars.extend(listify(c.scalars))
 
     return merged_properties
 
 
+def _copy_value(value):
+    """
+    :return: shallow copy of a value with its scalars in a new list
+    """
+
+    value = copy.copy(value)
+    value.scalars = list(listify(value.scalars) or [])
+
+    return value
+
+
+def property_key(prop):
+    """
+    Key of a property for merging
+
+    :param prop: property object
+    :return: tuple of the name, unit, condition names and units, method names and data type
+    """
+
+    return (prop.name,
+            prop.units or '',
+            tuple((cond.name, cond.units or '') for cond in listify(prop.conditions) or ()),
+            tuple(meth.name for meth in listify(prop.methods) or ()),
+            prop.data_type or '')
+
+
 def create_prop_dictionary(properties_list):
     """
     Creates a dictionary of all properties from the properties list
 
     :param properties_list: list of property objects
-    :return: dictionary of property objects grouped by unique key (name, unit, condition name, condition unit, method and data type)
+    :return: ordered dictionary of property objects grouped by property_key (name, unit, condition name, condition
+        unit, method and data type)
     """
 
-    prop_dict = {}
+    prop_dict = OrderedDict()
     for prop in properties_list:
-
-        identifier = prop.name + '-'
-        if prop.units:
-            identifier += prop.units + '-'
-        else:
-            identifier += '' + '-'
-        if prop.conditions:
-            for cond in prop.conditions:
-                identifier += cond.name + '-'
-                if cond.units:
-                    identifier += cond.units
-                else:
-                    identifier += '' + '-'
-        if prop.methods:
-            for meth in prop.methods:
-                identifier += meth.name + '-'
-        if prop.data_type:
-            identifier += prop.data_type + '-'
-
         if prop.scalars or prop.files:
-            try:
-                prop_dict[identifier].append(prop)
-            except KeyError:
-                prop_dict[identifier] = [prop]
+            prop_dict.setdefault(property_key(prop), []).append(prop)
 
     return prop_dict
@@ -0,0 +1,329 @@
+# coding: utf-8
+import bisect
+import csv
+import io
+import json
+import mmap
+import os
+import re
+import sys
+from array import array
+from collections import OrderedDict
+from pif_csv_utils.file_utils import open_table, TableDialect, LATIN_1_FALLBACK, _dialect_cache_key, _split_lines
+
+try:
+    array('Q')
+    OFFSET_TYPECODE = 'Q'
+except ValueError:
+    # Python 2 has no unsigned long long arrays
+    OFFSET_TYPECODE = 'L'
+
+ROW_INDEX_VERSION = 2
+
+SIDECAR_SUFFIX = '.rowidx'
+
+# Bytes of consecutive rows parsed at a time by RowIndex.read_rows, a longer row is parsed on its own
+READ_BLOCK_BYTES = 1024 * 1024
+
+NEWLINE_PATTERN = re.compile(br'\r\n|\r|\n')
+
+# Codecs whose line endings and quotes are single ASCII bytes, and the codec to decode a row with once the byte
+# order mark has been skipped
+ROW_CODECS = {'utf-8': 'utf-8', 'utf-8-sig': 'utf-8', 'latin-1': 'latin-1'}
+
+
+def _open_map(file_path):
+    """
+    :return: read only memory map of a file, None for an empty file
+    """
+
+    with io.open(file_path, 'rb') as input_file:
+        if os.fstat(input_file.fileno()).st_size == 0:
+            return None
+
+        return mmap.mmap(input_file.fileno(), 0, access=mmap.ACCESS_READ)
+
+
+def parse_rows(data, dialect):
+    """
+    Parse rows from a byte range of a csv or tsv file, translating line endings as the streaming reader does
+
+    :param data: bytes of whole rows
+    :param dialect: TableDialect of the file
+    :return: list of rows
+    """
+
+    text = data.decode(ROW_CODECS[dialect.encoding], LATIN_1_FALLBACK).replace('\r\n', '\n').replace('\r', '\n')
+    lines = _split_lines(text)
+    if sys.version_info[0] < 3:
+        lines = [line.encode('utf-8') for line in lines]
+
+    return list(csv.reader(lines, delimiter=dialect.delimiter, quotechar=dialect.quotechar))
+
+
+def read_span(file_path, dialect, start, end):
+    """
+    Read the rows in a byte range of a file through a memory map, e.g. a span from RowIndex.span in a worker process
+
+    :param file_path: path to the csv or tsv file
+    :param dialect: TableDialect of the file
+    :param start: byte offset of the first row
+    :param end: byte offset after the last row
+    :return: list of rows
+    """
+
+    mapped = _open_map(file_path)
+    if mapped is None:
+        return []
+
+    try:
+        return parse_rows(mapped[start:end], dialect)
+    finally:
+        mapped.close()
+
+
+class RowIndex(object):
+    """
+    Byte offsets of the rows of a csv or tsv file, for reading any row without reading the rows before it. Rows
+    quoted over several lines are a single row. The file is read through a memory map, close the index when done.
+    """
+
+    def __init__(self, file_path, dialect, offsets, file_key):
+        """
+        Constructor.
+
+        :param file_path: path to the csv or tsv file
+        :param dialect: TableDialect of the file
+        :param offsets: array of the byte offset of each row, header row first, followed by the end of the last row
+        :param file_key: size and modification time of the file the offsets were taken from
+        """
+        self.file_path = file_path
+        self.dialect = dialect
+        self.offsets = offsets
+        self.file_key = file_key
+        self.mapped = _open_map(file_path)
+
+    def __len__(self):
+        """
+        :return: number of rows, the header row and empty rows included
+        """
+        return max(len(self.offsets) - 1, 0)
+
+    def span(self, start, stop):
+        """
+        :param start: number of the first row, the header row being row 0
+        :param stop: number after the last row
+        :return: byte offsets of the start of the first row and the end of the last one
+        """
+        return self.offsets[start], self.offsets[stop]
+
+    def read_rows(self, rows=None):
+        """
+        Read rows without reading the rows before them. Consecutive rows are parsed in blocks of about
+        READ_BLOCK_BYTES, each yielded before the next is read.
+
+        :param rows: slice of the row numbers to read, the header row being row 0, defaults to every row
+        :return: yields tuples of (row number, row). Empty rows are read as []
+        """
+
+        start, stop, step = (rows or slice(None)).indices(len(self))
+
+        if step == 1:
+            while start < stop:
+                end = bisect.bisect_right(self.offsets, self.offsets[start] + READ_BLOCK_BYTES, start + 1, stop + 1)
+                end = max(end - 1, start + 1)
+                for i, row in enumerate(parse_rows(self.mapped[slice(*self.span(start, end))], self.dialect), start):
+                    yield i, row
+                start = end
+            return
+
+        for i in range(start, stop, step):
+            parsed = parse_rows(self.mapped[slice(*self.span(i, i + 1))], self.dialect)
+            yield i, parsed[0] if parsed else []
+
+    def save(self, sidecar_path=None):
+        """
+        Write the index to a sidecar file
+
+        :param sidecar_path: path to write to, defaults to the file path followed by .rowidx
+        :return: path written
+        """
+
+        sidecar_path = sidecar_path or self.file_path + SIDECAR_SUFFIX
+        header = {
+            'version': ROW_INDEX_VERSION,
+            'file_key': list(self.file_key),
+            'dialect': list(self.dialect),
+            'typecode': self.offsets.typecode,
+            'itemsize': self.offsets.itemsize,
+            'byteorder': sys.byteorder,
+            'count': len(self.offsets),
+        }
+
+        with io.open(sidecar_path, 'wb') as sidecar_file:
+            sidecar_file.write(json.dumps(header).encode('utf-8') + b'\n')
+            self.offsets.tofile(sidecar_file)
+
+        return sidecar_path
+
+    def close(self):
+        if self.mapped is not None:
+            self.mapped.close()
+            self.mapped = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+def build_row_index(file_path, delimiter=None):
+    """
+    Build the row index of a csv or tsv file in one pass over a memory map of it
+
+    :param file_path: path to the csv or tsv file
+    :param delimiter: known delimiter, sniffed if None
+    :return: RowIndex
+    """
+
+    file_key = _dialect_cache_key(file_path)[1:]
+    table_file, dialect = open_table(file_path, delimiter)
+    table_file.close()
+
+    if dialect.encoding not in ROW_CODECS:
+        raise ValueError('Row indexes need a file with single byte line endings, not {}'.format(dialect.encoding))
+
+    offsets = array(OFFSET_TYPECODE)
+    mapped = _open_map(file_path)
+    if mapped is None:
+        return RowIndex(file_path, dialect, offsets, file_key)
+
+    try:
+        size = len(mapped)
+        start = 3 if dialect.encoding == 'utf-8-sig' else 0
+        quote = dialect.quotechar.encode('ascii')
+        offsets.append(start)
+
+        if mapped.find(quote, start) == -1:
+            for match in NEWLINE_PATTERN.finditer(mapped, start):
+                offsets.append(match.end())
+        else:
+            # let the csv reader decide where quoted rows end, it only asks for another line when a row is not
+            # complete
+            position = [start]
+
+            def lines():
+                for match in NEWLINE_PATTERN.finditer(mapped, start):
+                    line = mapped[position[0]:match.end()]
+                    position[0] = match.end()
+                    yield line.decode('latin-1') if sys.version_info[0] > 2 else line
+                if position[0] < size:
+                    line = mapped[position[0]:size]
+                    position[0] = size
+                    yield line.decode('latin-1') if sys.version_info[0] > 2 else line
+
+            for row in csv.reader(lines(), delimiter=dialect.delimiter, quotechar=dialect.quotechar):
+                offsets.append(position[0])
+
+        if offsets[-1] != size:
+            offsets.append(size)
+    finally:
+        mapped.close()
+
+    return RowIndex(file_path, dialect, offsets, file_key)
+
+
+def _read_sidecar_header(file_path, sidecar_file):
+    """
+    :return: header of a sidecar file, None if it was written by another version or for another version of the file
+    """
+
+    header = json.loads(sidecar_file.readline().decode('utf-8'))
+    if header.get('version') != ROW_INDEX_VERSION or header.get('file_key') != list(_dialect_cache_key(file_path)[1:]):
+        return None
+
+    return header
+
+
+def _sidecar_matches(file_path):
+    """
+    :return: True if the file has an up to date sidecar file
+    """
+
+    try:
+        with io.open(file_path + SIDECAR_SUFFIX, 'rb') as sidecar_file:
+            return _read_sidecar_header(file_path, sidecar_file) is not None
+    except (IOError, OSError, ValueError):
+        return False
+
+
+def load_row_index(file_path, sidecar_path=None):
+    """
+    Load the row index of a file from its sidecar file
+
+    :param file_path: path to the csv or tsv file
+    :param sidecar_path: path of the sidecar file, defaults to the file path followed by .rowidx
+    :return: RowIndex, None if there is no sidecar file or it was written for another version of the file
+    """
+
+    sidecar_path = sidecar_path or file_path + SIDECAR_SUFFIX
+
+    try:
+        with io.open(sidecar_path, 'rb') as sidecar_file:
+            header = _read_sidecar_header(file_path, sidecar_file)
+            if header is None:
+                return None
+
+            offsets = array(header['typecode'])
+            if offsets.itemsize != header['itemsize']:
+                return None
+            offsets.fromfile(sidecar_file, header['count'])
+    except (IOError, OSError, ValueError, EOFError):
+        return None
+
+    if header['byteorder'] != sys.byteorder:
+        offsets.byteswap()
+
+    return RowIndex(file_path, TableDialect(*header['dialect']), offsets, tuple(header['file_key']))
+
+
+_ROW_INDEX_CACHE = OrderedDict()
+
+ROW_INDEX_CACHE_SIZE = 16
+
+
+def get_row_index(file_path, delimiter=None, sidecar=False):
+    """
+    Get the row index of a file, reusing an index built earlier in this process or saved in a sidecar file while
+    the file is unchanged
+
+    :param file_path: path to the csv or tsv file
+    :param delimiter: known delimiter, sniffed if None
+    :param sidecar: load the index from a sidecar file next to the file if there is one, and save it there if not
+    :return: RowIndex
+    """
+
+    key = (_dialect_cache_key(file_path), delimiter)
+    cached = _ROW_INDEX_CACHE.get(key)
+    if cached is not None:
+        index = RowIndex(file_path, *cached)
+        if sidecar and not _sidecar_matches(file_path):
+            index.save()
+        return index
+
+    index = load_row_index(file_path) if sidecar else None
+    if index is not None and delimiter is not None and index.dialect.delimiter != delimiter:
+        index.close()
+        index = None
+
+    if index is None:
+        index = build_row_index(file_path, delimiter)
+        if sidecar:
+            index.save()
+
+    _ROW_INDEX_CACHE[key] = (index.dialect, index.offsets, index.file_key)
+    if len(_ROW_INDEX_CACHE) > ROW_INDEX_CACHE_SIZE:
+        _ROW_INDEX_CACHE.popitem(last=False)
+
+    return index
@@ -0,0 +1,43 @@
+# coding: utf-8
+import logging
+from pif_csv_utils.diagnostics import *
+from pif_csv_utils.pif_utils import add_uid
+from pypif.obj import System
+
+
+def test_diagnostics_report(caplog):
+    report = DiagnosticsReport('samples.csv')
+    for i in range(1, 8):
+        report.activate(i)
+        add_uid(System(), 'uid%s' % i)
+        warn(UNKNOWN_HEADERS, '3')
+        report.deactivate()
+
+    assert report.items() == [(MANUAL_UIDS, 7, [1, 2, 3, 4, 5]), ('Unknown header(s) for column(s) 3.', 7,
+                                                                  [1, 2, 3, 4, 5])]
+    assert report.as_dictionary()['messages'][1] == {'message': 'Unknown header(s) for column(s) 3.', 'count': 7,
+                                                     'rows': [1, 2, 3, 4, 5]}
+
+    with caplog.at_level(logging.WARNING, logger='csv_template_ingester'):
+        add_uid(System(), 'uid')
+        report.log()
+    assert [record.getMessage() for record in caplog.records] == [
+        MANUAL_UIDS,
+        'samples.csv: {} (7 row(s), e.g. rows 1, 2, 3, 4, 5)'.format(MANUAL_UIDS),
+        'samples.csv: Unknown header(s) for column(s) 3. (7 row(s), e.g. rows 1, 2, 3, 4, 5)',
+    ]
+
+
+def test_diagnostics_report_merge():
+    first = DiagnosticsReport('samples.csv')
+    first.add(UNKNOWN_HEADERS, ('3',), 1)
+    first.add(UNKNOWN_HEADERS, ('3',), 2)
+
+    second = DiagnosticsReport()
+    for i in range(3, 9):
+        second.add(MANUAL_UIDS, (), i)
+        second.add(UNKNOWN_HEADERS, ('3',), i)
+
+    first.merge(second)
+    assert first.items() == [('Unknown header(s) for column(s) 3.', 8, [1, 2, 3, 4, 5]),
+                             (MANUAL_UIDS, 6, [3, 4, 5, 6, 7])]
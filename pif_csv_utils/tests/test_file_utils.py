@@ -1,5 +1,11 @@
 # coding: utf-8
+import json
 from pif_csv_utils.file_utils import *
+from pypif.obj import ChemicalSystem
+try:
+    from StringIO import StringIO
+except ImportError:
+    from io import StringIO
 
 
 def test_get_data_from_csv():
@@ -16,3 +22,151 @@ def test_get_data_from_tsv():
         for i, row in enumerate(data):
             if i == 0:
                 assert row[0] == 'NAME:'
+
+
+
+def test_sniff_encoding():
+    assert sniff_encoding(codecs.BOM_UTF8 + b'NAME') == 'utf-8-sig'
+    assert sniff_encoding(codecs.BOM_UTF16_LE + u'NAME'.encode('utf-16-le')) == 'utf-16'
+    assert sniff_encoding(u'NAME,Temp (\u00b0C)'.encode('utf-8')) == 'utf-8'
+    assert sniff_encoding(u'NAME,Temp (\u00b0C)'.encode('utf-8')[:-2]) == 'utf-8'
+    assert sniff_encoding(u'NAME,Temp (\u00b0C)'.encode('latin-1')) == 'latin-1'
+
+
+def test_open_text(tmpdir):
+    with open_text("./test_files/large_test.csv") as input_file:
+        assert next(get_data_from_csv(input_file))[0] == 'NAME'
+
+    text = u'NAME,PROPERTY: Temp (\u00b0C)\nSample \u00e9,5\n'
+    expected = text if sys.version_info[0] > 2 else text.encode('utf-8')
+
+    for encoding in ('utf-8', 'latin-1', 'utf-16', 'utf-8-sig'):
+        path = str(tmpdir.join('{}.csv'.format(encoding)))
+        with io.open(path, 'wb') as output_file:
+            output_file.write(text.encode(encoding))
+
+        with open_text(path, sample_size=16) as input_file:
+            assert ''.join(input_file) == expected
+
+    # latin-1 bytes after a utf-8 sample
+    path = str(tmpdir.join('mixed.csv'))
+    with io.open(path, 'wb') as output_file:
+        output_file.write(u'NAME\r\n\u00e9\r\n'.encode('utf-8') + u'\u00e9\r\n'.encode('latin-1'))
+
+    with open_text(path, sample_size=8) as input_file:
+        rows = list(get_data_from_csv(input_file))
+    e_acute = u'\u00e9' if sys.version_info[0] > 2 else u'\u00e9'.encode('utf-8')
+    assert [row[0] for row in rows] == ['NAME', e_acute, e_acute]
+
+
+def test_sniff_dialect():
+    assert sniff_dialect('NAME,PROPERTY: a;b\r\nA,1;2\r\n') == (',', '"', '\r\n')
+    assert sniff_dialect('NAME;PROPERTY: a (kg,m)\nA;"1,5"\nB;2\n', truncated=False) == (';', '"', '\n')
+    assert sniff_dialect('NAME\tPROPERTY: a\rA\t1,5\rB\t2\r') == ('\t', '"', '\r')
+    assert sniff_dialect('NAME\rSample 1\rSample 2\rSamp') == (',', '"', '\r')
+    assert sniff_dialect("NAME|PROPERTY: a\n'A|B'|1\n", truncated=False) == ('|', "'", '\n')
+    assert sniff_dialect('NAME;PROPERTY: a', delimiter='\t') == ('\t', '"', '\r\n')
+    assert sniff_dialect("NAME,PROPERTY: a\n'A|B'|1\n", delimiter='|') == ('|', "'", '\n')
+
+
+def test_sniff_dialect_single_quotes_in_data():
+    text = "NAME,PROPERTY: a,METHOD\n'abc',1,O'Brien's test\n'x y',2,'z'\n"
+    assert sniff_dialect(text, truncated=False) == (',', '"', '\n')
+    assert list(get_data_from_csv(StringIO(text))) == [['NAME', 'PROPERTY: a', 'METHOD'],
+                                                       ["'abc'", '1', "O'Brien's test"],
+                                                       ["'x y'", '2', "'z'"]]
+    assert sniff_dialect("NAME;PROPERTY: a\n'1,5';2\n", truncated=False) == (';', '"', '\n')
+
+
+def test_get_data_from_csv_sample():
+    text = 'NAME;PROPERTY: a\r\nA;1\r\nB;2\r\nC;"3\r\n4"\r\n'
+    for sample_size in range(text.index('\n') + 1, len(text) + 2):
+        rows = list(get_data_from_csv(StringIO(text), sample_size=sample_size))
+        assert rows == [['NAME', 'PROPERTY: a'], ['A', '1'], ['B', '2'], ['C', '3\r\n4']]
+
+
+class _Pipe(io.RawIOBase):
+    """
+    Non-seekable stream giving a few bytes per read
+    """
+
+    def __init__(self, data):
+        io.RawIOBase.__init__(self)
+        self.data = data
+
+    def readable(self):
+        return True
+
+    def readinto(self, buffer):
+        chunk, self.data = self.data[:3], self.data[3:]
+        buffer[:len(chunk)] = chunk
+        return len(chunk)
+
+
+def test_open_table(tmpdir):
+    text = u'NAME;PROPERTY: Temp (\u00b0C)\rA;1\rB;2\r'
+    stream = _Pipe(codecs.BOM_UTF8 + text.encode('utf-8'))
+    assert not stream.seekable()
+
+    table_file, dialect = open_table(stream, sample_size=40)
+    assert dialect == TableDialect('utf-8-sig', ';', '"', '\r')
+    with table_file:
+        rows = list(get_data_from_table(table_file, dialect))
+    assert [row[0] for row in rows] == ['NAME', 'A', 'B']
+
+    path = str(tmpdir.join('table.csv'))
+    with io.open(path, 'wb') as output_file:
+        output_file.write(text.encode('latin-1'))
+
+    for i in range(2):
+        table_file, dialect = open_table(path)
+        with table_file:
+            assert len(list(get_data_from_table(table_file, dialect))) == 3
+        assert dialect == TableDialect('latin-1', ';', '"', '\r')
+
+def test_estimate_table_size():
+    estimate = estimate_table_size("./test_files/template_example.csv")
+    assert estimate.columns == 30
+    assert estimate.rows == 2
+    assert estimate.cells == 60
+
+    estimate = estimate_table_size("./test_files/large_test.csv", sample_size=4096)
+    assert estimate.file_size == 314824
+    assert estimate.columns == 1
+    assert 20000 < estimate.rows < 30000
+
+
+def test_write_pifs():
+    pifs = [ChemicalSystem(names=['A']), ChemicalSystem(names=['B'])]
+
+    output = StringIO()
+    assert write_pifs(iter(pifs), output, indent=2) == 2
+    assert output.getvalue() == pif.dumps(pifs, indent=2)
+
+    output = StringIO()
+    assert write_pifs(iter(pifs), output, 'jsonl', flush_every=1) == 2
+    assert [json.loads(line)['names'] for line in output.getvalue().splitlines()] == [['A'], ['B']]
+
+    output = StringIO()
+    assert write_pifs([pif.dumps(p) for p in pifs], output) == 2
+    assert [p['names'] for p in json.loads(output.getvalue())] == [['A'], ['B']]
+
+    output = StringIO()
+    assert write_pifs([], output) == 0
+    assert json.loads(output.getvalue()) == []
+
+
+def test_open_output(tmpdir):
+    path = str(tmpdir.join('out.jsonl.gz'))
+    with open_output(path, compress=True) as output_file:
+        write_pifs([ChemicalSystem(names=['A'])], output_file, 'jsonl')
+
+    with gzip.open(path, 'rb') as input_file:
+        assert json.loads(input_file.read().decode('utf-8'))['names'] == ['A']
+
+
+def test_get_data_from_excel():
+    sheets = get_data_from_excel("./test_files/template_example.xls", sheets=[1])
+    rows = list(next(sheets))
+    assert rows == [['NAME', 'PROPERTY: Year Measured'], ['Sample 4', 2017]]
+    assert list(sheets) == []
@@ -17,3 +17,9 @@ def test_listify():
 
     result_three = listify([Person()])
     assert isinstance(result_three[0], Person)
+
+
+def test_to_text():
+    assert to_text(12) == '12'
+    assert to_text(7.85) == '7.85'
+    assert to_text('abc') == 'abc'
@@ -69,3 +69,20 @@ def test_property_merge():
         [Property(name='Hardness', scalars='12', units='HV'), Property(name='Hardness', scalars='120', units='HV'),
          Property(name='Hardness', scalars='1', units='HRC')])
     assert len(new_properties) == 2
+
+
+def test_property_merge_shared_conditions():
+    conditions = [Value(name='Temperature', scalars='300', units='K')]
+    properties = property_merge(
+        [Property(name='Hardness', scalars='1', units='HV', conditions=conditions),
+         Property(name='Density', scalars='7', units='g/cc', conditions=conditions),
+         Property(name='Hardness', scalars='2', units='HV', conditions=[Value(name='Temperature', scalars='400', units='K')]),
+         Property(name='Density', scalars='8', units='g/cc', conditions=[Value(name='Temperature', scalars='400', units='K')])])
+    assert [prop.scalars for prop in properties] == [['1', '2'], ['7', '8']]
+    assert [prop.conditions[0].scalars for prop in properties] == [['300', '400'], ['300', '400']]
+    assert conditions[0].scalars == '300'
+
+
+def test_property_key():
+    assert property_key(Property(name='Hardness', scalars='1', units='HV', methods=[Method(name='Vickers')])) == \
+        ('Hardness', 'HV', (), ('Vickers',), '')
@@ -0,0 +1,60 @@
+# coding: utf-8
+import io
+import os
+from pif_csv_utils.row_index import *
+
+
+def write(path, data):
+    with io.open(path, 'wb') as output_file:
+        output_file.write(data)
+
+
+def test_build_row_index(tmpdir):
+    path = str(tmpdir.join('rows.csv'))
+    write(path, b'\xef\xbb\xbfNAME,NOTE\r\n"a\r\nb",1\r\n\r\nc,"x, ""y"""\r\nd,4')
+
+    with build_row_index(path) as index:
+        assert len(index) == 5
+        assert index.span(0, 1) == (3, 14)
+        assert list(index.read_rows()) == [(0, ['NAME', 'NOTE']), (1, ['a\nb', '1']), (2, []),
+                                           (3, ['c', 'x, "y"']), (4, ['d', '4'])]
+        assert list(index.read_rows(slice(4, 0, -3))) == [(4, ['d', '4']), (1, ['a\nb', '1'])]
+
+
+def test_read_rows_blocks(tmpdir, monkeypatch):
+    path = str(tmpdir.join('rows.csv'))
+    write(path, b'NAME,NOTE\n' + b''.join(b'r%d,"x\ny"\n' % i for i in range(20)) + b'\nlong,' + b'z' * 40)
+
+    with build_row_index(path) as index:
+        rows = list(index.read_rows())
+        monkeypatch.setattr('pif_csv_utils.row_index.READ_BLOCK_BYTES', 16)
+        parsed = []
+        monkeypatch.setattr('pif_csv_utils.row_index.parse_rows',
+                            lambda data, dialect: parsed.append(data) or parse_rows(data, dialect))
+        assert list(index.read_rows()) == rows
+        assert list(index.read_rows(slice(5, 19))) == rows[5:19]
+    assert len(rows) == 23 and rows[21] == (21, []) and rows[22] == (22, ['long', 'z' * 40])
+    assert [data for data in parsed if len(data) > 16] == [b'long,' + b'z' * 40]
+
+
+def test_row_index_sidecar(tmpdir):
+    path = str(tmpdir.join('rows.tsv'))
+    write(path, b'NAME\tNOTE\na\t1\nb\t2\n')
+
+    with get_row_index(path, '\t', sidecar=True) as index:
+        offsets = list(index.offsets)
+    assert os.path.exists(path + SIDECAR_SUFFIX)
+
+    with load_row_index(path) as loaded:
+        assert list(loaded.offsets) == offsets
+        assert loaded.dialect.delimiter == '\t'
+        assert list(loaded.read_rows(slice(2, None))) == [(2, ['b', '2'])]
+
+    write(path, b'NAME\tNOTE\na\t1\nb\t2\nc\t3\n')
+    os.utime(path, (0, 0))
+    assert load_row_index(path) is None
+
+    with get_row_index(path, '\t', sidecar=True) as index:
+        assert len(index) == 4
+    with load_row_index(path) as loaded:
+        assert len(loaded) == 4
@@ -11,6 +11,9 @@ setup(name='csv_template_ingester',
         'pypif>=2.1.0,<3',
         'xlrd'
     ],
+    extras_require={
+        'batches': ['numpy'],
+    },
     entry_points={
         'citrine.dice.converter': [
             'template_csv = csv_template_ingester.converter',
@@ -2,13 +2,30 @@ import csv
 import argparse
 import random
 
-def generate_csv(rows, columns):
+# Repeating column pattern of the 'mixed' keyword mix, as (header, kind of generated value)
+MIXED_COLUMNS = [
+    ('PROPERTY: Sample Property {} (Unit)', 'number'),
+    ('CONDITION: Sample Condition {} (K)', 'number'),
+    ('METHOD', 'text'),
+    ('IDENTIFIER: Sample Identifier {}', 'text'),
+    ('CLASSIFICATION: Sample Classification {}', 'text'),
+    ('PREPARATION STEP NAME', 'text'),
+    ('PREPARATION STEP DETAIL: Sample Detail {} (s)', 'number'),
+    ('REFERENCE: doi', 'text'),
+    ('SUBSYSTEM {} NAME', 'text'),
+    ('SUBSYSTEM {} ACTUAL QUANTITY (mass)', 'number'),
+]
+
+KEYWORD_MIXES = ['property', 'mixed']
+
+
+def generate_csv(rows, columns, fill=1.0):
 
     for r in range(rows):
         generated_row = [''.join(random.choice('0123456789ABCDEF') for i in range(16))]
 
         for i in range(columns):
-            generated_row.append(random.randint(0,100000))
+            generated_row.append(random.randint(0,100000) if fill >= 1 or random.random() < fill else '')
 
         yield generated_row
 
@@ -23,18 +40,72 @@ def generate_headers(columns):
     return headers
 
 
-if __name__ == '__main__':
-    parser = argparse.ArgumentParser()
-    parser.add_argument('-r', '--rows', help='Number of rows required')
-    parser.add_argument('-c', '--columns', help='Number of columns required')
+def generate_mixed_csv(rows, columns, fill=1.0):
 
-    args = parser.parse_args()
+    kinds = [MIXED_COLUMNS[i % len(MIXED_COLUMNS)][1] for i in range(columns)]
+
+    for r in range(rows):
+        generated_row = [''.join(random.choice('0123456789ABCDEF') for i in range(16))]
+
+        for i, kind in enumerate(kinds):
+            # a repetition of the pattern is filled or left empty as a whole, so that details keep their property
+            if i % len(MIXED_COLUMNS) == 0:
+                filled = fill >= 1 or random.random() < fill
 
-    csv_output = generate_csv(int(args.rows), int(args.columns))
+            if not filled:
+                generated_row.append('')
+            elif kind == 'number':
+                generated_row.append(random.randint(0,100000))
+            else:
+                generated_row.append(''.join(random.choice('ABCDEFGH') for i in range(8)))
+
+        yield generated_row
+
+
+def generate_mixed_headers(columns):
+
+    headers = ['NAME']
 
-    with open('test_file-{}-{}.csv'.format(args.rows, args.columns), 'w') as output_file:
+    for i in range(columns):
+        header = MIXED_COLUMNS[i % len(MIXED_COLUMNS)][0]
+        # both SUBSYSTEM columns of a repetition name the same sub-system
+        headers.append(header.format(i - i % len(MIXED_COLUMNS) if header.startswith('SUBSYSTEM') else i))
+
+    return headers
+
+
+def write_test_csv(path, rows, columns, keyword_mix='property', fill=1.0):
+    """
+    Writes a generated file of a header row followed by the given number of data rows
+
+    :param path: path of the csv file to write
+    :param rows: number of data rows
+    :param columns: number of columns after the NAME column
+    :param keyword_mix: 'property' for PROPERTY columns only, 'mixed' for a repeating mix of keywords
+    :param fill: fraction of the cells after the NAME column that hold a value, the others are left empty
+    """
+
+    if keyword_mix == 'mixed':
+        headers, csv_output = generate_mixed_headers(columns), generate_mixed_csv(rows, columns, fill)
+    else:
+        headers, csv_output = generate_headers(columns), generate_csv(rows, columns, fill)
+
+    with open(path, 'w') as output_file:
         writer = csv.writer(output_file)
 
-        writer.writerow(generate_headers(int(args.columns)))
+        writer.writerow(headers)
         for row in csv_output:
             writer.writerow(row)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('-r', '--rows', help='Number of rows required')
+    parser.add_argument('-c', '--columns', help='Number of columns required')
+    parser.add_argument('-m', '--mix', choices=KEYWORD_MIXES, default='property', help='Keyword mix of the columns')
+    parser.add_argument('-f', '--fill', type=float, default=1.0, help='Fraction of the cells that hold a value')
+
+    args = parser.parse_args()
+
+    write_test_csv('test_file-{}-{}.csv'.format(args.rows, args.columns), int(args.rows), int(args.columns), args.mix,
+                   args.fill)
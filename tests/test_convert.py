@@ -1,5 +1,14 @@
 # coding: utf-8
-from csv_template_ingester.converter import convert
+import glob
+import json
+import logging
+import os
+import random
+from pypif import pif
+from csv_template_ingester.converter import convert, create_pif, compile_header_plan
+from csv_template_ingester.dict_builder import create_pif_dict
+from csv_template_ingester.stats import ConversionStats
+import pytest
 
 
 def test_convert():
@@ -25,3 +34,202 @@ def test_convert():
     assert pifs_two[0].properties[1].scalars[0] == '456'
     assert pifs_two[0].properties[-1].scalars[0].minimum == 453
     assert pifs_two[0].properties[-1].scalars[0].maximum == 474
+
+
+def test_create_pif_with_plan():
+    plan = compile_header_plan(['NAME', 'PROPERTY: Hardness (HV)'])
+    first = create_pif(plan, ['Sample 1', '12'])
+    second = create_pif(plan, ['Sample 2', '13'])
+    assert first.names[0] == 'Sample 1'
+    assert second.properties[0].scalars[0] == '13'
+    assert second.properties[0].units == 'HV'
+
+    from_headers = create_pif(['NAME', 'PROPERTY: Hardness (HV)'], ['Sample 1', '12'])
+    assert from_headers.as_dictionary() == first.as_dictionary()
+
+
+def test_create_pif_sub_systems():
+    plan = compile_header_plan(['NAME', 'SUBSYSTEM B NAME', 'SUBSYSTEM A NAME', 'SUBSYSTEM B PROPERTY: Hardness (HV)',
+                                'SUBSYSTEM C IDENTIFIER: Batch'])
+    system = create_pif(plan, ['Sample', '', 'Phase A', '12', ''])
+    assert [sub.names for sub in system.sub_systems] == [['Phase A'], None]
+    assert system.sub_systems[1].properties[0].scalars == ['12']
+    assert system.properties is None
+
+    assert create_pif(plan, ['Sample', '', '', '', '']).sub_systems == []
+    assert create_pif(plan, ['Sample', '', '', '', '7']).sub_systems[0].ids[0].value == '7'
+    for row in (['Sample', '', '', '', ''], ['Sample', '', 'Phase A', '12', '']):
+        assert create_pif(plan, row).as_dictionary() == create_pif_dict(plan, row)
+
+    with pytest.raises(ValueError):
+        compile_header_plan(['NAME', 'SUBSYSTEM A PROPERTY'])
+
+
+# Header cells and data cells that random tables are made of, covering every keyword, systems and the special
+# cell syntaxes
+RANDOM_HEADERS = [
+    'NAME', 'UID', 'FORMULA', 'IDENTIFIER', 'IDENTIFIER: Batch', 'CLASSIFICATION: Class', 'CONTACT: name',
+    'CONTACT: email', 'CONTACT: url', 'CONTACT', 'CONTACT: orcid', 'REFERENCE: doi', 'REFERENCE: title',
+    'REFERENCE: year', 'REFERENCE', 'PREPARATION STEP NAME', 'PROCESS STEP NAME', 'PREPARATION STEP DETAIL: Time (s)',
+    'PROCESS STEP DETAIL', 'PROPERTY: Hardness (HV)', 'PROPERTY', 'CONDITION: Load (N)', 'CONDITION',
+    'ALL CONDITION: Pressure (atm)', 'ALL CONDITION', 'METHOD', 'DATA TYPE', 'FIGURE NUMBER', 'FIGURE CAPTION',
+    'TABLE NUMBER', 'TABLE CAPTION', 'FILE: Image', 'FILE', 'IDEAL COMPOSITION: Fe (wt%)',
+    'ACTUAL COMPOSITION: Cu (at%)', 'COMPOSITION: Ni (x)', 'IDEAL QUANTITY (mass%)', 'ACTUAL QUANTITY (number)',
+    'IDEAL QUANTITY (x)', 'SUBSYSTEM A NAME', 'SUBSYSTEM A PROPERTY: Strength', 'SUBSYSTEM A CONDITION: Load',
+    'SUBSYSTEM B PREPARATION STEP NAME', 'SUBSYSTEM B REFERENCE: doi', 'NOT A KEYWORD',
+]
+RANDOM_CELLS = ['', '', '', 'a', 'b.png', 'c.txt', '1', '0', 0, 3, 2.5, '[1, 2]', '[]', 'range(1, 2)', 'range(3, 1)',
+                'x y']
+
+
+@pytest.mark.parametrize('seed', range(5))
+def test_create_pif_dict_random(seed):
+    random_state = random.Random(seed)
+    compared = 0
+    for _ in range(300):
+        headers = [random_state.choice(RANDOM_HEADERS) for _ in range(random_state.randint(1, 12))]
+        try:
+            plan = compile_header_plan(headers)
+        except ValueError:
+            continue
+
+        for _ in range(3):
+            row = [random_state.choice(RANDOM_CELLS) for _ in headers]
+            try:
+                expected = create_pif(plan, row).as_dictionary()
+            except TypeError:
+                # pypif's own type checks on attribute values are not repeated by the dictionary handlers
+                continue
+            except Exception as e:
+                with pytest.raises(type(e)) as raised:
+                    create_pif_dict(plan, row)
+                assert str(raised.value) == str(e)
+                continue
+
+            assert create_pif_dict(plan, row) == expected, (headers, row)
+            compared += 1
+
+    assert compared > 100
+
+
+def test_convert_cell_limit():
+    pifs = convert(["./test_files/template_example.csv"], cell_limit=31)
+    assert next(pifs).names[0] == 'P20 Tool steel'
+    with pytest.raises(ValueError):
+        next(pifs)
+
+
+def test_convert_xls():
+    pifs = list(convert(["./test_files/template_example.xls"]))
+    assert len(pifs) == 4
+    assert pifs[0].uid == '1001'
+    assert pifs[0].ids[0].value == '12'
+    assert pifs[0].properties[0].scalars == [123]
+    assert pifs[0].properties[1].scalars == [7.85]
+    assert pifs[0].properties[2].scalars[0].maximum == 474
+    assert pifs[0].preparation[0].details[0].scalars == [3600]
+    assert pifs[2].names == ['Sample 3']
+    assert pifs[3].properties[0].name == 'Year Measured'
+
+    pifs = list(convert(["./test_files/template_example.xls"], sheets=['Other']))
+    assert [p.names[0] for p in pifs] == ['Sample 4']
+
+
+def test_convert_records(tmpdir):
+    records = list(convert(["./test_files/template_example.csv"], output='record'))
+    pifs = list(convert(["./test_files/template_example.csv"]))
+    assert [r.row_number for r in records] == [1, 2]
+    assert records[0].values[0] == (0, 'P20 Tool steel', False)
+    assert all(value != '' for j, value, fills in records[0].values)
+    assert [r.as_dictionary() for r in records] == [p.as_dictionary() for p in pifs]
+    assert records[1].to_pif().names == pifs[1].names
+
+    path = str(tmpdir.join('records.csv'))
+    with open(path, 'w') as output_file:
+        output_file.write('NAME,PROPERTY: Hardness (HV),SUBSYSTEM A NAME\nSample 1,"[1, 2]",\n')
+    record, = convert([path], output='record')
+    assert record.values == ((0, 'Sample 1', False), (1, ['1', '2'], False))
+    assert record.to_pif().as_dictionary() == create_pif(['NAME', 'PROPERTY: Hardness (HV)', 'SUBSYSTEM A NAME'],
+                                                         ['Sample 1', '[1, 2]', '']).as_dictionary()
+
+    with pytest.raises(ValueError):
+        next(convert(["./test_files/template_example.csv"], output='xml'))
+
+
+@pytest.mark.parametrize('path', sorted(glob.glob('./test_files/*.csv') + glob.glob('./test_files/*.tsv') +
+                                        glob.glob('./test_files/*.xls')))
+def test_convert_dicts(path):
+    dicts = list(convert([path], output='dict'))
+    assert dicts == [p.as_dictionary() for p in convert([path])]
+    assert json.loads(json.dumps(dicts)) == json.loads(pif.dumps(list(convert([path]))))
+
+
+def test_convert_stats():
+    stats = ConversionStats()
+    pifs = list(convert(["./test_files/template_example.csv"], stats=stats))
+    assert [p.as_dictionary() for p in pifs] == [p.as_dictionary() for p in convert(["./test_files/template_example.csv"])]
+    assert stats.stages['header'].calls == 1
+    assert stats.stages['read'].rows == 3
+    assert stats.stages['add_fields'].rows == 2
+    assert stats.stages['assemble'].calls == 2
+    assert stats.stages['field:contact'].cells == 14
+    assert stats.stages['field:property'].cells == 6
+    assert 'field:contact' in stats.report()
+
+    events = []
+    dicts = list(convert(["./test_files/template_example.csv"], output='dict',
+                         on_stage=lambda stage, seconds, rows, cells: events.append((stage, rows, cells))))
+    assert dicts == [p.as_dictionary() for p in pifs]
+    assert events.count(('build_dict', 1, 30)) == 2
+    assert ('field:name', 0, 1) in events
+
+
+def test_convert_rows(tmpdir):
+    path = str(tmpdir.join('rows.csv'))
+    with open(path, 'w') as output_file:
+        output_file.write('NAME,PROPERTY: Hardness (HV),METHOD\n"Sample\n1",1,"a, b"\n\nSample 3,3,c\nSample 4,4,d\n')
+
+    names = [p.names[0] for p in convert([path])]
+    assert names == ['Sample\n1', 'Sample 3', 'Sample 4']
+    assert [p.names[0] for p in convert([path], rows=slice(0, 2))] == names[:1]
+    assert [p.names[0] for p in convert([path], rows=slice(2, None))] == names[1:]
+    assert [p.names[0] for p in convert([path], rows=slice(None, None, -1))] == names[::-1]
+    assert [r.row_number for r in convert([path], rows=slice(-1, None), output='record')] == [4]
+
+    assert [p.names[0] for p in convert([path], rows=slice(1, None), index_sidecar=True)] == names[1:]
+    assert os.path.exists(path + '.rowidx')
+    assert [p.names[0] for p in convert([path], rows=slice(3, 4), index_sidecar=True)] == names[2:]
+
+    # row 3 of the sheet is empty, rows counts it
+    pifs = list(convert(["./test_files/template_example.xls"], sheets=[0], rows=slice(1, 4)))
+    assert [p.as_dictionary() for p in pifs] == [p.as_dictionary() for p in
+                                                 convert(["./test_files/template_example.xls"], sheets=[0])][1:3]
+
+    with pytest.raises(ValueError):
+        list(convert([path], rows=slice(0, 4), cell_limit=8))
+
+
+def test_convert_diagnostics(tmpdir, capsys, caplog):
+    path = str(tmpdir.join('unknown.csv'))
+    with open(path, 'w') as output_file:
+        output_file.write('NAME,UID,NOT A KEYWORD,ALSO UNKNOWN\n' +
+                          ''.join('Sample {0},{0},x,y\n'.format(i) for i in range(1, 21)))
+
+    reports = []
+    assert len(list(convert([path], diagnostics=reports))) == 20
+    assert len(list(convert([path], output='dict', diagnostics=reports, stats=ConversionStats()))) == 20
+    assert capsys.readouterr().out == ''
+    assert caplog.records == []
+
+    assert [report.source for report in reports] == [path, path]
+    assert reports[0].items() == reports[1].items() == [
+        ('UIDs manually added. If two systems have the same then one will be overwritten by the information in the '
+         'other. Please make sure all UIDs are unique.', 20, [1, 2, 3, 4, 5]),
+        ('Unknown header(s) for column(s) 2, 3.', 20, [1, 2, 3, 4, 5]),
+    ]
+
+    with caplog.at_level(logging.WARNING, logger='csv_template_ingester'):
+        list(convert([path]))
+    assert len(caplog.records) == 2
+    assert caplog.records[1].getMessage() == \
+        '{}: Unknown header(s) for column(s) 2, 3. (20 row(s), e.g. rows 1, 2, 3, 4, 5)'.format(path)
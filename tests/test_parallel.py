@@ -0,0 +1,79 @@
+# coding: utf-8
+import json
+from csv_template_ingester.converter import convert
+from csv_template_ingester.parallel import convert_many, convert_file_parallel
+from pypif import pif
+
+
+def test_convert_many():
+    files = ["./test_files/template_example.csv", "./test_files/template_example_two.csv"]
+    results = list(convert_many(files, workers=2))
+    assert [result.path for result in results] == files
+    assert all(result.error is None for result in results)
+
+    expected = [p.as_dictionary() for p in convert(["./test_files/template_example.csv"])]
+    assert [json.loads(s) for s in results[0].pifs] == expected
+    assert pif.loads(results[1].pifs[0]).names[1] == 'Sample 1'
+
+
+def test_convert_many_errors():
+    files = ["./test_files/template_example.csv", "./test_files/missing.csv", "./test_files/generate_test_csv.py"]
+    results = list(convert_many(files, workers=2, ordered=False))
+    assert sorted(result.path for result in results) == sorted(files)
+
+    errors = dict((result.path, result.error) for result in results)
+    assert errors["./test_files/template_example.csv"] is None
+    assert errors["./test_files/missing.csv"] is not None
+    assert 'not compatible' in errors["./test_files/generate_test_csv.py"]
+
+    serial = list(convert_many(files, workers=1))
+    assert [result.error is None for result in serial] == [True, False, False]
+
+
+def test_convert_file_parallel():
+    expected = [p.as_dictionary() for p in convert(["./test_files/large_test.csv"])]
+
+    pifs = list(convert_file_parallel("./test_files/large_test.csv", workers=2, chunk_size=997, max_pending=3))
+    assert [json.loads(s) for s in pifs] == expected
+
+    expected = [p.as_dictionary() for p in convert(["./test_files/template_example.csv"])]
+    pifs = list(convert_file_parallel("./test_files/template_example.csv", workers=1, chunk_size=1))
+    assert [json.loads(s) for s in pifs] == expected
+
+
+def test_convert_file_parallel_with_index():
+    expected = [p.as_dictionary() for p in convert(["./test_files/large_test.csv"])]
+    pifs = list(convert_file_parallel("./test_files/large_test.csv", workers=2, chunk_size=997, use_index=True))
+    assert [json.loads(s) for s in pifs] == expected
+
+    for path in ("./test_files/template_example.csv", "./test_files/template_example_tsv.tsv"):
+        expected = [p.as_dictionary() for p in convert([path])]
+        pifs = list(convert_file_parallel(path, workers=1, chunk_size=1, use_index=True))
+        assert [json.loads(s) for s in pifs] == expected
+
+
+def test_parallel_diagnostics(tmpdir, caplog):
+    path = str(tmpdir.join('unknown.csv'))
+    with open(path, 'w') as output_file:
+        output_file.write('NAME,UID,NOT A KEYWORD\n' +
+                          ''.join('Sample {0},{0},x\n'.format(i) for i in range(1, 4)) + '\n' +
+                          ''.join('Sample {0},{0},x\n'.format(i) for i in range(5, 21)))
+
+    expected = []
+    list(convert([path], diagnostics=expected))
+    assert [rows for message, count, rows in expected[0].items()] == [[1, 2, 3, 5, 6], [1, 2, 3, 5, 6]]
+
+    for workers, use_index in ((1, False), (2, False), (1, True), (2, True)):
+        reports = []
+        pifs = list(convert_file_parallel(path, workers=workers, chunk_size=3, use_index=use_index,
+                                          diagnostics=reports))
+        assert len(pifs) == 19
+        assert [report.source for report in reports] == [path]
+        assert reports[0].items() == expected[0].items()
+
+    reports = []
+    results = list(convert_many([path, "./test_files/missing.csv"], workers=2, diagnostics=reports))
+    assert [result.path for result in results] == [report.source for report in reports]
+    assert reports[0].items() == expected[0].items()
+    assert len(reports[1]) == 0
+    assert caplog.records == []